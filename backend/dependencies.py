@@ -0,0 +1,172 @@
+"""
+Ресурсы приложения и зависимости FastAPI для них
+
+AppResources создается один раз на воркер в lifespan (server.py) и хранится в
+app.state.resources. Роутеры получают ресурсы только через Depends(get_db),
+Depends(get_fourthchki), Depends(get_notifier) - в тестах их можно заменить
+через app.dependency_overrides без подмены модулей
+"""
+
+import asyncio
+import logging
+import math
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from fastapi import Depends, HTTPException, Query, Request
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+
+from services import metrics
+from services.admin_access import get_admin_registry
+from services.fourthchki_client import FourthchkiClient, get_fourthchki_client
+from services.rate_limiter import get_rate_limiter
+from services.telegram_bot import TelegramNotifier, get_telegram_notifier
+from utils.telegram_auth import TelegramAuthError, decode_session_token
+
+logger = logging.getLogger(__name__)
+
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '10'))
+
+
+def use_mock_data() -> bool:
+    """Проверяем, используем ли mock данные"""
+    return os.environ.get('USE_MOCK_DATA', 'false').lower() == 'true'
+
+
+@dataclass
+class AppResources:
+    """Разделяемые ресурсы одного воркера"""
+    mongo_client: AsyncIOMotorClient
+    db: AsyncIOMotorDatabase
+    notifier: TelegramNotifier
+    fourthchki: Optional[FourthchkiClient] = None
+    _fourthchki_lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    async def load_fourthchki(self) -> FourthchkiClient:
+        """Загрузить WSDL и создать SOAP клиент (в отдельном потоке - zeep блокирующий)"""
+        if self.fourthchki is None:
+            async with self._fourthchki_lock:
+                if self.fourthchki is None:
+                    self.fourthchki = await asyncio.to_thread(get_fourthchki_client)
+        return self.fourthchki
+
+
+async def create_resources() -> AppResources:
+    """Создать ресурсы воркера: пул MongoDB, Telegram бот и SOAP клиент поставщика"""
+    mongo_client = AsyncIOMotorClient(
+        os.environ['MONGO_URL'],
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        # BSON даты возвращаются как datetime в UTC с часовым поясом
+        tz_aware=True,
+        # Длительность команд по коллекциям для /api/metrics
+        event_listeners=[metrics.get_mongo_command_listener()] if metrics.METRICS_ENABLED else [],
+    )
+    db = mongo_client[os.environ['DB_NAME']]
+    resources = AppResources(
+        mongo_client=mongo_client,
+        db=db,
+        notifier=get_telegram_notifier(db),
+    )
+
+    # Первое соединение открываем сейчас, а не на первом запросе покупателя
+    try:
+        await db.command('ping')
+    except Exception as e:
+        logger.error(f"MongoDB is not reachable at startup: {e}")
+
+    if not use_mock_data():
+        try:
+            await resources.load_fourthchki()
+            logger.info("4tochki WSDL preloaded")
+        except Exception as e:
+            logger.error(f"Failed to preload 4tochki client, will retry on request: {e}")
+
+    return resources
+
+
+async def close_resources(resources: AppResources):
+    resources.mongo_client.close()
+
+
+def get_resources(request: Request) -> AppResources:
+    return request.app.state.resources
+
+
+def get_db(request: Request) -> AsyncIOMotorDatabase:
+    return request.app.state.resources.db
+
+
+def get_notifier(request: Request) -> TelegramNotifier:
+    return request.app.state.resources.notifier
+
+
+async def require_admin(
+    telegram_id: str = Query(..., description="Telegram ID админа"),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+) -> str:
+    """Доступ только для админа (см. services/admin_access.py); возвращает telegram_id админа"""
+    try:
+        is_admin = await get_admin_registry().is_admin(db, telegram_id)
+    except Exception as e:
+        logger.error(f"Error checking admin access: {e}")
+        raise HTTPException(status_code=500, detail="Failed to check access")
+    if not is_admin:
+        raise HTTPException(status_code=403, detail="Access denied")
+    return telegram_id
+
+
+_NO_SESSION = object()
+
+
+def get_session(request: Request) -> Optional[Dict[str, Any]]:
+    """
+    Данные токена сессии из заголовка Authorization: Bearer (см. POST /auth/session)
+    None - токена нет или он недействителен: эндпоинт проверяет пользователя по базе, как раньше
+    """
+    session = getattr(request.state, "session", _NO_SESSION)
+    if session is not _NO_SESSION:
+        return session
+    session = None
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            session = decode_session_token(token)
+        except TelegramAuthError as e:
+            logger.debug(f"Invalid session token: {e}")
+    request.state.session = session
+    return session
+
+
+async def charge_supplier_budget(request: Request, cost: float):
+    """
+    Досписать бюджет поставщика за запрос, стоимость которого известна только после разбора тела
+    (пакетный поиск). Ключи клиента берутся из RateLimitMiddleware; без него (лимит выключен,
+    путь не ограничивается) ничего не списывается. Сверх лимита - 429 с Retry-After
+    """
+    client = getattr(request.state, "rate_limit_client", None)
+    if client is None or not cost:
+        return
+    retry_after = await get_rate_limiter().check_supplier(
+        request.app.state.resources.db, client.ip, client.user_key, cost, exempt_user=client.exempt_user
+    )
+    if retry_after > 0:
+        seconds = max(1, math.ceil(retry_after))
+        raise HTTPException(
+            status_code=429,
+            detail=f"Слишком много запросов, повторите через {seconds} сек.",
+            headers={"Retry-After": str(seconds)},
+        )
+
+
+async def get_fourthchki(request: Request) -> Optional[FourthchkiClient]:
+    """SOAP клиент 4tochki (None в режиме USE_MOCK_DATA)"""
+    if use_mock_data():
+        return None
+    try:
+        return await request.app.state.resources.load_fourthchki()
+    except Exception as e:
+        logger.error(f"4tochki client unavailable: {e}")
+        raise HTTPException(status_code=503, detail="Supplier API unavailable")
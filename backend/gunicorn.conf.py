@@ -0,0 +1,30 @@
+"""
+Конфигурация gunicorn для запуска backend в несколько воркеров
+
+    gunicorn -c gunicorn.conf.py server:app
+
+Каждый воркер - отдельный процесс uvicorn со своим пулом соединений MongoDB
+(создается в lifespan после fork, поэтому preload_app выключен).
+Polling бота, отправку outbox и рассылки выполняет только один воркер -
+лидер по аренде в MongoDB (services/leader_lease.py)
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8001")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Клиенты MongoDB и SOAP нельзя переносить через fork - создаем в каждом воркере
+preload_app = False
+
+# Поиск у поставщика может занимать десятки секунд
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+# Пустое значение отключает access log (например, для бенчмарка)
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-") or None
+errorlog = "-"
+loglevel = os.environ.get("LOG_LEVEL", "info")
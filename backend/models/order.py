@@ -3,6 +3,8 @@ from typing import List, Optional
 from datetime import datetime, timezone
 from enum import Enum
 
+from utils.order_ids import generate_order_id
+
 class OrderStatus(str, Enum):
     PENDING_CONFIRMATION = "pending_confirmation"  # Ждет подтверждения админа
     CONFIRMED = "confirmed"  # Подтвержден админом (в обработке)
@@ -13,6 +15,16 @@ class OrderStatus(str, Enum):
     COMPLETED = "completed"  # Выполнен
     CANCELLED = "cancelled"  # Отменен
 
+# Текст статуса для уведомлений клиенту
+ORDER_STATUS_MESSAGES = {
+    OrderStatus.AWAITING_PAYMENT: "Ожидает оплаты",
+    OrderStatus.IN_PROGRESS: "Принят в работу",
+    OrderStatus.DELIVERY: "Передан в доставку",
+    OrderStatus.DELAYED: "Задержан",
+    OrderStatus.COMPLETED: "Выполнен",
+    OrderStatus.CANCELLED: "Отменен"
+}
+
 class OrderItem(BaseModel):
     code: str  # Код товара SAE
     name: str
@@ -41,8 +53,16 @@ class DeliveryAddress(BaseModel):
     phone: Optional[str] = None  # Телефон клиента (обязательно для новых заказов)
     comment: Optional[str] = None
 
+class SupplierOrderRef(BaseModel):
+    """Заказ у 4tochki по одному складу (см. services/supplier_orders.py)"""
+    supplier_order_id: str
+    warehouse_id: int
+    status: Optional[str] = None  # Статус у поставщика как есть
+    placed_at: Optional[datetime] = None
+    checked_at: Optional[datetime] = None
+
 class Order(BaseModel):
-    order_id: str = Field(default_factory=lambda: f"ORD-{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}")
+    order_id: str = Field(default_factory=generate_order_id)  # ORD-<время до мс>-<случайная часть>
     user_telegram_id: str
     user_name: Optional[str] = None
     user_username: Optional[str] = None  # Telegram username клиента (если есть)
@@ -53,9 +73,12 @@ class Order(BaseModel):
     delivery_address: Optional[DeliveryAddress] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     confirmed_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None  # Последняя смена статуса
     confirmed_by_admin: Optional[str] = None
     fourthchki_order_id: Optional[str] = None  # ID заказа в системе 4tochki
     fourthchki_order_number: Optional[str] = None  # Номер заказа от 4tochki
+    supplier_orders: List[SupplierOrderRef] = []  # Заказы у поставщика по складам
+    supplier_error: Optional[str] = None  # Последняя ошибка автоматического заказа у поставщика
     admin_comment: Optional[str] = None
 
 class OrderCreate(BaseModel):
@@ -67,3 +90,26 @@ class OrderConfirm(BaseModel):
 
 class OrderReject(BaseModel):
     reason: str
+
+class OrderSummaryAddress(BaseModel):
+    city: Optional[str] = None
+    phone: Optional[str] = None
+
+class OrderSummary(BaseModel):
+    """Строка списка заказов в админке - без состава заказа и полного адреса"""
+    order_id: str
+    user_telegram_id: str
+    user_name: Optional[str] = None
+    user_username: Optional[str] = None
+    status: OrderStatus
+    total_amount: float
+    items_count: int = 0
+    delivery_address: Optional[OrderSummaryAddress] = None
+    created_at: datetime
+    confirmed_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+class OrderSummaryPage(BaseModel):
+    orders: List[OrderSummary]
+    next_cursor: Optional[str] = None  # Передать в cursor для следующей страницы
+    has_more: bool = False
@@ -17,3 +17,11 @@ class UserCreate(BaseModel):
     username: Optional[str] = None
     first_name: Optional[str] = None
     last_name: Optional[str] = None
+
+class TelegramSessionRequest(BaseModel):
+    init_data: str  # window.Telegram.WebApp.initData как есть
+
+class AuthSession(BaseModel):
+    user: User
+    token: str  # Передавать в заголовке Authorization: Bearer <token>
+    expires_at: datetime
@@ -1,18 +1,28 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import PlainTextResponse
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime, timezone
 import logging
 
+from services import search_analytics
+from services import broadcast as broadcast_service
+from services.broadcast import BroadcastCreate, BroadcastSegment, get_broadcast_runner
+from services import cache_prewarm
+from services.cache_prewarm import get_cache_prewarmer
+from services.brand_index import get_brand_index
+from services.fourthchki_client import FourthchkiClient
+from services import profiler as profiler_service
+from services.profiler import ProfilerBusy, get_profiler
+from services.supplier_cache import all_caches
+from services.telegram_bot import TelegramNotifier
+from dependencies import get_db, get_fourthchki, get_notifier, require_admin
+
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
-def get_db():
-    from server import db
-    return db
-
 class MarkupUpdate(BaseModel):
     markup_percentage: float
 
@@ -42,22 +52,13 @@ class MarkupSettingsResponse(BaseModel):
 
 @router.get("/markup", response_model=MarkupResponse)
 async def get_markup(
-    telegram_id: str = Query(..., description="Telegram ID админа"),
+    telegram_id: str = Depends(require_admin),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """
     Получить текущий процент наценки (только для админа)
     """
     try:
-        # Проверяем, что пользователь админ
-        user = await db.users.find_one(
-            {"telegram_id": telegram_id},
-            {"_id": 0}
-        )
-        
-        if not user or not user.get('is_admin'):
-            raise HTTPException(status_code=403, detail="Access denied")
-        
         settings = await db.settings.find_one({}, {"_id": 0})
         
         if not settings:
@@ -81,22 +82,13 @@ async def get_markup(
 @router.put("/markup", response_model=MarkupResponse)
 async def update_markup(
     markup_data: MarkupUpdate,
-    telegram_id: str = Query(..., description="Telegram ID админа"),
+    telegram_id: str = Depends(require_admin),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """
     Изменить процент наценки (только для админа)
     """
     try:
-        # Проверяем, что пользователь админ
-        user = await db.users.find_one(
-            {"telegram_id": telegram_id},
-            {"_id": 0}
-        )
-        
-        if not user or not user.get('is_admin'):
-            raise HTTPException(status_code=403, detail="Access denied")
-        
         # Валидация
         if markup_data.markup_percentage < 0 or markup_data.markup_percentage > 100:
             raise HTTPException(
@@ -132,22 +124,13 @@ async def update_markup(
 # Новые endpoints для гибкой системы наценки
 @router.get("/markup/settings", response_model=MarkupSettingsResponse)
 async def get_markup_settings(
-    telegram_id: str = Query(..., description="Telegram ID админа"),
+    telegram_id: str = Depends(require_admin),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """
     Получить настройки системы наценки (фиксированная или ступенчатая)
     """
     try:
-        # Проверяем, что пользователь админ
-        user = await db.users.find_one(
-            {"telegram_id": telegram_id},
-            {"_id": 0}
-        )
-        
-        if not user or not user.get('is_admin'):
-            raise HTTPException(status_code=403, detail="Access denied")
-        
         settings = await db.settings.find_one({}, {"_id": 0})
         
         if not settings or 'markup_settings' not in settings:
@@ -176,22 +159,13 @@ async def get_markup_settings(
 @router.put("/markup/settings", response_model=MarkupSettingsResponse)
 async def update_markup_settings(
     settings_data: MarkupSettingsUpdate,
-    telegram_id: str = Query(..., description="Telegram ID админа"),
+    telegram_id: str = Depends(require_admin),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """
     Обновить настройки системы наценки
     """
     try:
-        # Проверяем, что пользователь админ
-        user = await db.users.find_one(
-            {"telegram_id": telegram_id},
-            {"_id": 0}
-        )
-        
-        if not user or not user.get('is_admin'):
-            raise HTTPException(status_code=403, detail="Access denied")
-        
         # Валидация
         if settings_data.type not in ['fixed', 'tiered']:
             raise HTTPException(
@@ -267,22 +241,13 @@ async def update_markup_settings(
 
 @router.get("/stats")
 async def get_admin_stats(
-    telegram_id: str = Query(..., description="Telegram ID админа"),
+    telegram_id: str = Depends(require_admin),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """
     Получить статистику для админа
     """
     try:
-        # Проверяем, что пользователь админ
-        user = await db.users.find_one(
-            {"telegram_id": telegram_id},
-            {"_id": 0}
-        )
-        
-        if not user or not user.get('is_admin'):
-            raise HTTPException(status_code=403, detail="Access denied")
-        
         # Подсчитываем статистику
         total_orders = await db.orders.count_documents({})
         pending_orders = await db.orders.count_documents(
@@ -328,7 +293,7 @@ async def get_admin_stats(
 
 @router.get("/users")
 async def get_all_users(
-    telegram_id: str = Query(..., description="Telegram ID админа"),
+    telegram_id: str = Depends(require_admin),
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=200),
     db: AsyncIOMotorDatabase = Depends(get_db)
@@ -337,23 +302,10 @@ async def get_all_users(
     Получить список всех пользователей (только для админа)
     """
     try:
-        # Проверяем, что пользователь админ
-        user = await db.users.find_one({"telegram_id": telegram_id})
-        
-        if not user or not user.get('is_admin'):
-            raise HTTPException(status_code=403, detail="Access denied")
-        
         # Получаем пользователей
         users_cursor = db.users.find({}, {"_id": 0}).skip(skip).limit(limit).sort("created_at", -1)
         users = await users_cursor.to_list(length=limit)
         
-        # Конвертируем даты из ISO строк
-        for u in users:
-            if isinstance(u.get('created_at'), str):
-                u['created_at'] = u['created_at']
-            if isinstance(u.get('last_activity'), str):
-                u['last_activity'] = u['last_activity']
-        
         total_count = await db.users.count_documents({})
         
         return {
@@ -373,19 +325,13 @@ async def get_all_users(
 @router.post("/users/{user_telegram_id}/block")
 async def block_user(
     user_telegram_id: str,
-    telegram_id: str = Query(..., description="Telegram ID админа"),
+    telegram_id: str = Depends(require_admin),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """
     Заблокировать пользователя (только для админа)
     """
     try:
-        # Проверяем, что пользователь админ
-        admin = await db.users.find_one({"telegram_id": telegram_id})
-        
-        if not admin or not admin.get('is_admin'):
-            raise HTTPException(status_code=403, detail="Access denied")
-        
         # Проверяем что пользователь существует
         target_user = await db.users.find_one({"telegram_id": user_telegram_id})
         if not target_user:
@@ -414,19 +360,13 @@ async def block_user(
 @router.post("/users/{user_telegram_id}/unblock")
 async def unblock_user(
     user_telegram_id: str,
-    telegram_id: str = Query(..., description="Telegram ID админа"),
+    telegram_id: str = Depends(require_admin),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """
     Разблокировать пользователя (только для админа)
     """
     try:
-        # Проверяем, что пользователь админ
-        admin = await db.users.find_one({"telegram_id": telegram_id})
-        
-        if not admin or not admin.get('is_admin'):
-            raise HTTPException(status_code=403, detail="Access denied")
-        
         # Проверяем что пользователь существует
         target_user = await db.users.find_one({"telegram_id": user_telegram_id})
         if not target_user:
@@ -450,7 +390,7 @@ async def unblock_user(
 
 @router.get("/activity")
 async def get_user_activity(
-    telegram_id: str = Query(..., description="Telegram ID админа"),
+    telegram_id: str = Depends(require_admin),
     user_telegram_id: Optional[str] = Query(None, description="Telegram ID пользователя для фильтра"),
     activity_type: Optional[str] = Query(None, description="Тип активности для фильтра"),
     skip: int = Query(0, ge=0),
@@ -461,12 +401,6 @@ async def get_user_activity(
     Получить логи активности пользователей (только для админа)
     """
     try:
-        # Проверяем, что пользователь админ
-        user = await db.users.find_one({"telegram_id": telegram_id})
-        
-        if not user or not user.get('is_admin'):
-            raise HTTPException(status_code=403, detail="Access denied")
-        
         # Формируем фильтр
         filter_query = {}
         if user_telegram_id:
@@ -501,21 +435,16 @@ async def get_user_activity(
 
 @router.delete("/activity/reset")
 async def reset_activity_logs(
-    telegram_id: str = Query(..., description="Telegram ID админа"),
+    telegram_id: str = Depends(require_admin),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """
     Сбросить всю активность (удалить все логи активности) - только для админа
     """
     try:
-        # Проверяем, что пользователь админ
-        user = await db.users.find_one({"telegram_id": telegram_id})
-        
-        if not user or not user.get('is_admin'):
-            raise HTTPException(status_code=403, detail="Access denied")
-        
         # Удаляем все логи активности
         result = await db.activity_logs.delete_many({})
+        await search_analytics.reset_rollups(db)
         
         logger.info(f"Activity logs reset by admin {telegram_id}. Deleted {result.deleted_count} logs")
         
@@ -533,7 +462,7 @@ async def reset_activity_logs(
 
 @router.delete("/stats/reset")
 async def reset_statistics(
-    telegram_id: str = Query(..., description="Telegram ID админа"),
+    telegram_id: str = Depends(require_admin),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """
@@ -541,17 +470,12 @@ async def reset_statistics(
     ВНИМАНИЕ: Это удалит ВСЕ заказы из базы данных!
     """
     try:
-        # Проверяем, что пользователь админ
-        user = await db.users.find_one({"telegram_id": telegram_id})
-        
-        if not user or not user.get('is_admin'):
-            raise HTTPException(status_code=403, detail="Access denied")
-        
         # Удаляем все заказы
         orders_result = await db.orders.delete_many({})
         
         # Удаляем все логи активности
         activity_result = await db.activity_logs.delete_many({})
+        await search_analytics.reset_rollups(db)
         
         # Сбрасываем last_activity у всех пользователей
         await db.users.update_many({}, {"$set": {"last_activity": None}})
@@ -576,6 +500,206 @@ async def reset_statistics(
         raise HTTPException(status_code=500, detail="Failed to reset statistics")
 
 
+@router.get("/analytics/search")
+async def get_search_analytics(
+    telegram_id: str = Depends(require_admin),
+    days: int = Query(30, ge=1, le=365, description="Период в днях"),
+    limit: int = Query(20, ge=1, le=200, description="Количество строк в каждом рейтинге"),
+    city: Optional[str] = Query(None, description="Фильтр спроса на бренды по городу"),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Аналитика спроса (только для админа):
+    популярные размеры и автомобили, поиски без результатов, спрос на бренды по городам
+    и конверсия поиск -> корзина -> заказ.
+    Читается из предрасчитанных агрегатов analytics_rollups
+    """
+    try:
+        return {
+            "success": True,
+            "days": days,
+            "top_sizes": await search_analytics.get_top_sizes(db, days=days, limit=limit),
+            "top_vehicles": await search_analytics.get_top_vehicles(db, days=days, limit=limit),
+            "zero_result_searches": await search_analytics.get_zero_result_searches(db, days=days, limit=limit),
+            "brand_demand": await search_analytics.get_brand_demand(db, days=days, limit=limit, city=city),
+            "conversion": await search_analytics.get_conversion(db, days=days)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting search analytics: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get search analytics")
+
+@router.post("/analytics/rebuild", status_code=202)
+async def rebuild_search_analytics(
+    telegram_id: str = Depends(require_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Запустить пересчет агрегатов аналитики по всем логам активности (только для админа)
+    Нужно для истории, накопленной до появления агрегатов. Пересчет идет в фоне,
+    ход - GET /analytics/rebuild; отчеты во время пересчета показывают прежние агрегаты
+    """
+    try:
+        try:
+            rebuild_id = await search_analytics.start_rebuild(db, requested_by=telegram_id)
+        except search_analytics.RebuildInProgress:
+            raise HTTPException(status_code=409, detail="Analytics rebuild is already running")
+        
+        logger.info(f"Analytics rollups rebuild {rebuild_id} started by admin {telegram_id}")
+        
+        return {
+            "success": True,
+            "rebuild_id": rebuild_id
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error starting analytics rebuild: {e}")
+        raise HTTPException(status_code=500, detail="Failed to start analytics rebuild")
+
+@router.get("/analytics/rebuild")
+async def get_search_analytics_rebuild(
+    telegram_id: str = Depends(require_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Ход последнего пересчета агрегатов: status (running, finishing, done, failed), processed (только для админа)"""
+    try:
+        state = await search_analytics.get_rebuild_state(db)
+        if state is None:
+            raise HTTPException(status_code=404, detail="Analytics rebuild has not been started")
+        
+        return {
+            "success": True,
+            "rebuild": state
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting analytics rebuild state: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get analytics rebuild state")
+
+
+@router.get("/cache/stats")
+async def get_cache_stats(
+    telegram_id: str = Depends(require_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Статистика кэша поставщика и прогрева (только для админа)
+    Кэш и счетчики - текущего воркера, история прогревов - всех воркеров
+    """
+    try:
+        return {
+            "success": True,
+            "caches": [cache.get_stats() for cache in all_caches()],
+            "prewarm": get_cache_prewarmer().get_report(),
+            "recent_runs": await cache_prewarm.get_recent_runs(db)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting cache stats: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get cache stats")
+
+@router.post("/cache/prewarm")
+async def prewarm_cache(
+    telegram_id: str = Depends(require_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    client: Optional[FourthchkiClient] = Depends(get_fourthchki)
+):
+    """Прогреть кэш популярных автомобилей и размеров сейчас (в воркере, принявшем запрос)"""
+    try:
+        if client is None:
+            raise HTTPException(status_code=400, detail="Cache prewarm is not available in mock mode")
+        
+        report = dict(await get_cache_prewarmer().run(db, client, reason=f"admin:{telegram_id}"))
+        report.pop("_id", None)
+        
+        return {
+            "success": True,
+            "report": report
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error prewarming cache: {e}")
+        raise HTTPException(status_code=500, detail="Failed to prewarm cache")
+
+
+@router.post("/brands/rebuild")
+async def rebuild_brand_index(
+    telegram_id: str = Depends(require_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    client: Optional[FourthchkiClient] = Depends(get_fourthchki)
+):
+    """Перестроить индекс брендов сейчас (остальные воркеры подхватят его при следующем перечитывании)"""
+    try:
+        if client is None:
+            raise HTTPException(status_code=400, detail="Brand index is not available in mock mode")
+        
+        report = await get_brand_index().rebuild(db, client)
+        
+        return {
+            "success": True,
+            "report": report
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error rebuilding brand index: {e}")
+        raise HTTPException(status_code=500, detail="Failed to rebuild brand index")
+
+
+@router.post("/profile")
+async def profile_worker(
+    telegram_id: str = Depends(require_admin),
+    mode: str = Query("cpu", description="cpu - выборочный профилировщик, memory - снимки tracemalloc"),
+    seconds: float = Query(10, gt=0, le=profiler_service.PROFILE_MAX_SECONDS, description="Длительность замера (предельная - при requests)"),
+    requests: int = Query(0, ge=0, le=profiler_service.PROFILE_MAX_REQUESTS, description="Закончить после N следующих запросов (0 - по времени)"),
+    interval_ms: float = Query(5, ge=1, le=1000, description="cpu: интервал снятия стеков"),
+    all_threads: bool = Query(False, description="cpu: также потоки to_thread (SOAP, zeep)"),
+    include_idle: bool = Query(False, description="cpu: учитывать ожидание event loop"),
+    limit: int = Query(30, ge=1, le=500, description="memory: строк в top"),
+    format: str = Query("json", description="json или collapsed - свернутые стеки текстом (speedscope, flamegraph.pl)")
+):
+    """
+    Профилировать этот воркер в течение seconds секунд или следующих requests запросов
+    Ответ приходит по окончании замера
+    """
+    try:
+        if mode not in ("cpu", "memory"):
+            raise HTTPException(status_code=400, detail="mode must be cpu or memory")
+        if format not in ("json", "collapsed"):
+            raise HTTPException(status_code=400, detail="format must be json or collapsed")
+        
+        logger.info(f"Admin {telegram_id} started {mode} profile: {seconds}s, {requests} requests")
+        if mode == "cpu":
+            result = await get_profiler().profile_cpu(
+                seconds, requests, interval_ms=interval_ms, all_threads=all_threads, include_idle=include_idle
+            )
+        else:
+            result = await get_profiler().profile_memory(seconds, requests, limit=limit)
+        
+        if format == "collapsed":
+            return PlainTextResponse(result["collapsed"] + "\n")
+        return result
+        
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=f"Profile is already running ({e})")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error profiling worker: {e}")
+        raise HTTPException(status_code=500, detail="Failed to profile worker")
+
+
 class SendMessageRequest(BaseModel):
     client_telegram_id: str
     message_text: str
@@ -584,28 +708,20 @@ class SendMessageRequest(BaseModel):
 @router.post("/send-message")
 async def send_message_to_client(
     message_data: SendMessageRequest,
-    telegram_id: str = Query(..., description="Telegram ID админа"),
-    db: AsyncIOMotorDatabase = Depends(get_db)
+    telegram_id: str = Depends(require_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    notifier: TelegramNotifier = Depends(get_notifier)
 ):
     """
     Отправить сообщение клиенту через Telegram бота (только для админа)
     """
     try:
-        # Проверяем, что пользователь админ
-        user = await db.users.find_one({"telegram_id": telegram_id})
-        
-        if not user or not user.get('is_admin'):
-            raise HTTPException(status_code=403, detail="Access denied")
-        
         # Проверяем что клиент существует
         client = await db.users.find_one({"telegram_id": message_data.client_telegram_id})
         if not client:
             raise HTTPException(status_code=404, detail="Client not found")
         
         # Отправляем сообщение через бота
-        from services.telegram_bot import get_telegram_notifier
-        notifier = get_telegram_notifier()
-        
         success = await notifier.send_admin_message_to_client(
             client_telegram_id=message_data.client_telegram_id,
             message_text=message_data.message_text,
@@ -628,3 +744,208 @@ async def send_message_to_client(
         logger.error(f"Error sending message to client: {e}")
         raise HTTPException(status_code=500, detail="Failed to send message")
 
+
+@router.post("/broadcasts/preview")
+async def preview_broadcast_segment(
+    segment: BroadcastSegment,
+    telegram_id: str = Depends(require_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Посчитать получателей сегмента без создания рассылки (только для админа)
+    """
+    try:
+        recipients = await broadcast_service.resolve_segment(db, segment)
+        
+        return {
+            "success": True,
+            "total": len(recipients)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error previewing broadcast segment: {e}")
+        raise HTTPException(status_code=500, detail="Failed to preview segment")
+
+@router.post("/broadcasts")
+async def create_broadcast(
+    broadcast_data: BroadcastCreate,
+    telegram_id: str = Depends(require_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Создать и запустить массовую рассылку по сегменту пользователей (только для админа)
+    Отправка идет в фоне, прогресс - GET /admin/broadcasts/{broadcast_id}
+    """
+    try:
+        if not broadcast_data.message_text.strip():
+            raise HTTPException(status_code=400, detail="Message text is required")
+        
+        broadcast = await broadcast_service.create_broadcast(db, broadcast_data, created_by=telegram_id)
+        get_broadcast_runner().start(db, broadcast["broadcast_id"])
+        
+        return {
+            "success": True,
+            "broadcast": broadcast
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error creating broadcast: {e}")
+        raise HTTPException(status_code=500, detail="Failed to create broadcast")
+
+@router.get("/broadcasts")
+async def list_broadcasts(
+    telegram_id: str = Depends(require_admin),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Список рассылок с прогрессом (только для админа)
+    """
+    try:
+        broadcasts = await db[broadcast_service.BROADCASTS_COLLECTION].find(
+            {}, {"_id": 0}
+        ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+        
+        return {
+            "success": True,
+            "broadcasts": broadcasts,
+            "skip": skip,
+            "limit": limit
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error listing broadcasts: {e}")
+        raise HTTPException(status_code=500, detail="Failed to list broadcasts")
+
+@router.get("/broadcasts/{broadcast_id}")
+async def get_broadcast(
+    broadcast_id: str,
+    telegram_id: str = Depends(require_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Прогресс рассылки и последние ошибки доставки (только для админа)
+    """
+    try:
+        broadcast = await db[broadcast_service.BROADCASTS_COLLECTION].find_one(
+            {"broadcast_id": broadcast_id}, {"_id": 0}
+        )
+        if not broadcast:
+            raise HTTPException(status_code=404, detail="Broadcast not found")
+        
+        failures = await db[broadcast_service.RECIPIENTS_COLLECTION].find(
+            {"broadcast_id": broadcast_id, "status": "failed"},
+            {"_id": 0, "telegram_id": 1, "error": 1}
+        ).limit(50).to_list(50)
+        
+        broadcast["pending"] = broadcast["total"] - broadcast["sent"] - broadcast["failed"]
+        broadcast["is_running_here"] = get_broadcast_runner().is_running(broadcast_id)
+        
+        return {
+            "success": True,
+            "broadcast": broadcast,
+            "failures": failures
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting broadcast: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get broadcast")
+
+@router.post("/broadcasts/{broadcast_id}/pause")
+async def pause_broadcast(
+    broadcast_id: str,
+    telegram_id: str = Depends(require_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Приостановить рассылку (только для админа)
+    Текущая пачка будет доотправлена, остальные получатели останутся в очереди
+    """
+    try:
+        result = await db[broadcast_service.BROADCASTS_COLLECTION].update_one(
+            {"broadcast_id": broadcast_id, "status": broadcast_service.STATUS_RUNNING},
+            {"$set": {"status": broadcast_service.STATUS_PAUSED}}
+        )
+        if not result.matched_count:
+            raise HTTPException(status_code=400, detail="Broadcast is not running")
+        
+        logger.info(f"Broadcast {broadcast_id} paused by admin {telegram_id}")
+        
+        return {"success": True, "message": "Рассылка приостановлена"}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error pausing broadcast: {e}")
+        raise HTTPException(status_code=500, detail="Failed to pause broadcast")
+
+@router.post("/broadcasts/{broadcast_id}/resume")
+async def resume_broadcast(
+    broadcast_id: str,
+    telegram_id: str = Depends(require_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Продолжить приостановленную рассылку (только для админа)
+    """
+    try:
+        result = await db[broadcast_service.BROADCASTS_COLLECTION].update_one(
+            {"broadcast_id": broadcast_id, "status": broadcast_service.STATUS_PAUSED},
+            {"$set": {"status": broadcast_service.STATUS_RUNNING}, "$unset": {"last_error": ""}}
+        )
+        if not result.matched_count:
+            raise HTTPException(status_code=400, detail="Broadcast is not paused")
+        
+        get_broadcast_runner().start(db, broadcast_id)
+        
+        logger.info(f"Broadcast {broadcast_id} resumed by admin {telegram_id}")
+        
+        return {"success": True, "message": "Рассылка продолжена"}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error resuming broadcast: {e}")
+        raise HTTPException(status_code=500, detail="Failed to resume broadcast")
+
+@router.post("/broadcasts/{broadcast_id}/cancel")
+async def cancel_broadcast(
+    broadcast_id: str,
+    telegram_id: str = Depends(require_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Отменить рассылку (только для админа)
+    Текущая пачка будет доотправлена, остальным получателям сообщение не уйдет;
+    отмененную рассылку продолжить нельзя
+    """
+    try:
+        now = datetime.now(timezone.utc).isoformat()
+        result = await db[broadcast_service.BROADCASTS_COLLECTION].update_one(
+            {
+                "broadcast_id": broadcast_id,
+                "status": {"$in": [broadcast_service.STATUS_RUNNING, broadcast_service.STATUS_PAUSED]}
+            },
+            {"$set": {"status": broadcast_service.STATUS_CANCELLED, "finished_at": now, "updated_at": now}}
+        )
+        if not result.matched_count:
+            raise HTTPException(status_code=400, detail="Broadcast is not running or paused")
+        
+        logger.info(f"Broadcast {broadcast_id} cancelled by admin {telegram_id}")
+        
+        return {"success": True, "message": "Рассылка отменена"}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error cancelling broadcast: {e}")
+        raise HTTPException(status_code=500, detail="Failed to cancel broadcast")
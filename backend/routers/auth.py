@@ -1,94 +1,151 @@
 from fastapi import APIRouter, HTTPException, Depends
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from datetime import datetime, timezone
+from pymongo import ReturnDocument
+from typing import Any, Dict, Tuple
+from datetime import datetime, timedelta, timezone
 import os
 import logging
 
-from models.user import User, UserCreate
-from services.telegram_bot import get_telegram_notifier
+from models.user import AuthSession, TelegramSessionRequest, User, UserCreate
+from services.telegram_bot import TelegramNotifier
+from utils.mongo_codec import decode_user
+from utils.telegram_auth import TelegramAuthError, issue_session_token, verify_init_data
+from dependencies import get_db, get_notifier
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
-def get_db():
-    from server import db
-    return db
+# Как часто обновлять last_activity при входе (чаще - без записи в базу)
+LAST_ACTIVITY_INTERVAL_MINUTES = int(os.environ.get('LAST_ACTIVITY_INTERVAL_MINUTES', '5'))
+# Разрешить вход без подписанной initData (POST /auth/telegram) - для тестов вне Telegram
+# По умолчанию разрешен только без TELEGRAM_BOT_TOKEN: с токеном initData можно проверить
+TELEGRAM_AUTH_ALLOW_UNSIGNED = os.environ.get(
+    'TELEGRAM_AUTH_ALLOW_UNSIGNED', 'false' if os.environ.get('TELEGRAM_BOT_TOKEN') else 'true'
+).lower() == 'true'
+
+async def upsert_user(
+    db: AsyncIOMotorDatabase,
+    profile: UserCreate,
+    update_profile: bool
+) -> Tuple[Dict[str, Any], bool]:
+    """
+    Создать или обновить пользователя одним find_one_and_update
+    last_activity меняется не чаще раза в LAST_ACTIVITY_INTERVAL_MINUTES: если ни оно,
+    ни профиль не изменились, MongoDB не выполняет запись
+    Возвращает (документ пользователя, создан ли он сейчас)
+    """
+    now = datetime.now(timezone.utc)
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)  # BSON хранит миллисекунды
+    stale = now - timedelta(minutes=LAST_ACTIVITY_INTERVAL_MINUTES)
+    admin_id = os.environ.get('ADMIN_TELEGRAM_ID')
+    
+    def profile_field(name: str):
+        # $literal - имя вида "$..." не должно читаться как путь к полю
+        value = {"$literal": getattr(profile, name)}
+        return value if update_profile else {"$ifNull": [f"${name}", value]}
+    
+    user = await db.users.find_one_and_update(
+        {"telegram_id": profile.telegram_id},
+        [{"$set": {
+            "username": profile_field("username"),
+            "first_name": profile_field("first_name"),
+            "last_name": profile_field("last_name"),
+            "is_admin": {"$ifNull": ["$is_admin", profile.telegram_id == admin_id]},
+            "is_blocked": {"$ifNull": ["$is_blocked", False]},
+            "created_at": {"$ifNull": ["$created_at", now]},
+            "last_activity": {"$cond": [
+                {"$gt": [{"$ifNull": ["$last_activity", None]}, stale]},
+                "$last_activity",
+                now
+            ]},
+        }}],
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return user, user.get("created_at") == now
+
+async def notify_new_visitor(notifier: TelegramNotifier, user: Dict[str, Any]):
+    """Уведомить админа о новом посетителе (только если это не сам админ)"""
+    if user.get("is_admin"):
+        return
+    try:
+        await notifier.notify_admin_new_visitor(
+            telegram_id=user["telegram_id"],
+            username=user.get("username"),
+            first_name=user.get("first_name"),
+            last_name=user.get("last_name")
+        )
+    except Exception as e:
+        logger.error(f"Failed to notify admin about new visitor: {e}")
+
+@router.post("/session", response_model=AuthSession)
+async def create_session(
+    session_data: TelegramSessionRequest,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    notifier: TelegramNotifier = Depends(get_notifier)
+):
+    """
+    Вход из Telegram Mini App по подписанной initData
+    Создает пользователя если не существует и выдает токен сессии
+    для заголовка Authorization: Bearer <token>
+    """
+    bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
+    if not bot_token:
+        raise HTTPException(status_code=503, detail="Telegram auth is not configured")
+    
+    try:
+        init_data = verify_init_data(session_data.init_data, bot_token)
+    except TelegramAuthError as e:
+        logger.warning(f"Rejected Telegram init data: {e}")
+        raise HTTPException(status_code=401, detail="Invalid Telegram init data")
+    
+    try:
+        telegram_user = init_data["user"]
+        profile = UserCreate(
+            telegram_id=str(telegram_user["id"]),
+            username=telegram_user.get("username"),
+            first_name=telegram_user.get("first_name"),
+            last_name=telegram_user.get("last_name")
+        )
+        user, created = await upsert_user(db, profile, update_profile=True)
+        if created:
+            logger.info(f"New user created: {profile.telegram_id}, admin: {user.get('is_admin')}")
+            await notify_new_visitor(notifier, user)
+        
+        token, expires_at = issue_session_token(user)
+        return {
+            "user": decode_user(user),
+            "token": token,
+            "expires_at": expires_at
+        }
+        
+    except Exception as e:
+        logger.error(f"Error creating session: {e}")
+        raise HTTPException(status_code=500, detail="Authentication failed")
 
 @router.post("/telegram", response_model=User)
 async def authenticate_telegram_user(
     user_data: UserCreate,
-    db: AsyncIOMotorDatabase = Depends(get_db)
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    notifier: TelegramNotifier = Depends(get_notifier)
 ):
     """
-    Аутентификация пользователя через Telegram
+    Аутентификация пользователя через Telegram (без проверки initData)
     Создает нового пользователя если не существует
+    Mini App входит через POST /auth/session; этот путь - для тестов вне Telegram
     """
+    if not TELEGRAM_AUTH_ALLOW_UNSIGNED:
+        raise HTTPException(status_code=401, detail="Use /auth/session with Telegram init data")
+    
     try:
-        admin_id = os.environ.get('ADMIN_TELEGRAM_ID')
-        
-        # Проверяем, существует ли пользователь
-        existing_user = await db.users.find_one(
-            {"telegram_id": user_data.telegram_id},
-            {"_id": 0}
-        )
-        
-        if existing_user:
-            logger.info(f"Existing user authenticated: {user_data.telegram_id}")
-            # Конвертируем timestamp обратно в datetime
-            if isinstance(existing_user.get('created_at'), str):
-                existing_user['created_at'] = datetime.fromisoformat(existing_user['created_at'])
-            return User(**existing_user)
+        user, created = await upsert_user(db, user_data, update_profile=False)
+        if created:
+            logger.info(f"New user created: {user_data.telegram_id}, admin: {user.get('is_admin')}")
+            await notify_new_visitor(notifier, user)
         
-        # Создаем нового пользователя
-        is_admin = user_data.telegram_id == admin_id
-        
-        new_user = User(
-            telegram_id=user_data.telegram_id,
-            username=user_data.username,
-            first_name=user_data.first_name,
-            last_name=user_data.last_name,
-            is_admin=is_admin
-        )
-        
-        # Сохраняем в базу
-        user_dict = new_user.model_dump()
-        user_dict['created_at'] = user_dict['created_at'].isoformat()
-        
-        try:
-            await db.users.insert_one(user_dict)
-            logger.info(f"New user created: {user_data.telegram_id}, admin: {is_admin}")
-            
-            # Уведомляем админа о новом посетителе (только если это не сам админ)
-            if not is_admin:
-                try:
-                    notifier = get_telegram_notifier()
-                    await notifier.notify_admin_new_visitor(
-                        telegram_id=user_data.telegram_id,
-                        username=user_data.username,
-                        first_name=user_data.first_name,
-                        last_name=user_data.last_name
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to notify admin about new visitor: {e}")
-            
-            return new_user
-            
-        except Exception as insert_error:
-            # Если произошла ошибка дубликата ключа (race condition), 
-            # возвращаем существующего пользователя
-            if "duplicate key" in str(insert_error).lower() or "E11000" in str(insert_error):
-                logger.warning(f"Duplicate user creation attempt detected for {user_data.telegram_id}, returning existing user")
-                existing_user = await db.users.find_one(
-                    {"telegram_id": user_data.telegram_id},
-                    {"_id": 0}
-                )
-                if existing_user:
-                    if isinstance(existing_user.get('created_at'), str):
-                        existing_user['created_at'] = datetime.fromisoformat(existing_user['created_at'])
-                    return User(**existing_user)
-            # Пробрасываем другие ошибки
-            raise insert_error
+        return decode_user(user)
         
     except Exception as e:
         logger.error(f"Error authenticating user: {e}")
@@ -109,10 +166,7 @@ async def get_current_user(
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
-        if isinstance(user.get('created_at'), str):
-            user['created_at'] = datetime.fromisoformat(user['created_at'])
-        
-        return User(**user)
+        return decode_user(user)
         
     except HTTPException:
         raise
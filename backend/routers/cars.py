@@ -3,8 +3,11 @@ from typing import Optional
 from motor.motor_asyncio import AsyncIOMotorDatabase
 import logging
 import os
+import re
 
-from services.fourthchki_client import get_fourthchki_client
+from services.fourthchki_client import FourthchkiClient
+from services.search_analytics import record_activity
+from services.supplier_cache import PRODUCT_TYPES, get_fitment_goods_cache, get_supplier_cache
 from services.mock_data import (
     MOCK_CAR_BRANDS,
     MOCK_CAR_MODELS,
@@ -12,6 +15,8 @@ from services.mock_data import (
     MOCK_MODIFICATIONS,
     generate_mock_goods_by_car
 )
+from dependencies import get_db, get_fourthchki
+from utils import server_timing
 
 logger = logging.getLogger(__name__)
 
@@ -21,10 +26,6 @@ def use_mock_data() -> bool:
 
 router = APIRouter(prefix="/cars", tags=["cars"])
 
-def get_db():
-    from server import db
-    return db
-
 def apply_markup(price: float, markup_percentage: float) -> float:
     return round(price * (1 + markup_percentage / 100), 2)
 
@@ -35,7 +36,9 @@ async def get_markup_percentage(db: AsyncIOMotorDatabase) -> float:
     return 15.0
 
 @router.get("/brands")
-async def get_car_brands():
+async def get_car_brands(
+    client: Optional[FourthchkiClient] = Depends(get_fourthchki)
+):
     try:
         if use_mock_data():
             logger.info("Using MOCK data for car brands")
@@ -45,8 +48,7 @@ async def get_car_brands():
                 "mock_mode": True
             }
         
-        client = get_fourthchki_client()
-        response = client.get_car_brands()
+        response = await get_supplier_cache().call(client, 'get_car_brands')
         
         # Check if there's a meaningful error (not just empty error structure)
         error = response.get('error')
@@ -73,7 +75,8 @@ async def get_car_brands():
 
 @router.get("/models")
 async def get_car_models(
-    brand: str = Query(..., description="Марка автомобиля")
+    brand: str = Query(..., description="Марка автомобиля"),
+    client: Optional[FourthchkiClient] = Depends(get_fourthchki)
 ):
     try:
         if use_mock_data():
@@ -85,8 +88,7 @@ async def get_car_models(
                 "mock_mode": True
             }
         
-        client = get_fourthchki_client()
-        response = client.get_car_models(brand)
+        response = await get_supplier_cache().call(client, 'get_car_models', {'brand': brand})
         
         # Check if there's a meaningful error (not just empty error structure)
         error = response.get('error')
@@ -114,7 +116,8 @@ async def get_car_models(
 @router.get("/years")
 async def get_car_years(
     brand: str = Query(..., description="Марка автомобиля"),
-    model: str = Query(..., description="Модель автомобиля")
+    model: str = Query(..., description="Модель автомобиля"),
+    client: Optional[FourthchkiClient] = Depends(get_fourthchki)
 ):
     try:
         if use_mock_data():
@@ -125,8 +128,7 @@ async def get_car_years(
                 "mock_mode": True
             }
         
-        client = get_fourthchki_client()
-        response = client.get_car_years(brand, model)
+        response = await get_supplier_cache().call(client, 'get_car_years', {'brand': brand, 'model': model})
         
         # Check if there's a meaningful error (not just empty error structure)
         error = response.get('error')
@@ -171,7 +173,8 @@ async def get_car_modifications(
     brand: str = Query(..., description="Марка автомобиля"),
     model: str = Query(..., description="Модель автомобиля"),
     year_begin: str = Query(..., description="Год начала выпуска"),
-    year_end: str = Query(..., description="Год окончания выпуска")
+    year_end: str = Query(..., description="Год окончания выпуска"),
+    client: Optional[FourthchkiClient] = Depends(get_fourthchki)
 ):
     try:
         if use_mock_data():
@@ -182,8 +185,12 @@ async def get_car_modifications(
                 "mock_mode": True
             }
         
-        client = get_fourthchki_client()
-        response = client.get_car_modifications(brand, model, year_begin, year_end)
+        response = await get_supplier_cache().call(client, 'get_car_modifications', {
+            'brand': brand,
+            'model': model,
+            'year_begin': year_begin,
+            'year_end': year_end
+        })
         
         # Check if there's a meaningful error (not just empty error structure)
         error = response.get('error')
@@ -212,34 +219,50 @@ async def get_car_modifications(
         raise HTTPException(status_code=500, detail="Failed to get car modifications")
 
 @router.get("/goods")
+@server_timing.timed_endpoint
 async def get_goods_by_car(
     brand: str = Query(..., description="Марка автомобиля"),
     model: str = Query(..., description="Модель автомобиля"),
     year_begin: str = Query(..., description="Год начала выпуска"),
     year_end: str = Query(..., description="Год окончания выпуска"),
     modification: Optional[str] = Query(None, description="Модификация (опционально)"),
-    product_type: str = Query("tyre", description="Тип товара: tyre, disk"),
-    db: AsyncIOMotorDatabase = Depends(get_db)
+    product_type: str = Query("tyre", description="Тип товара: tyre, disk (пусто - шины и диски)"),
+    include_replacement: bool = Query(False, description="Добавить замены (podbor_type=2) к заводской комплектации"),
+    telegram_id: Optional[str] = Query(None, description="Telegram ID пользователя для логирования"),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    client: Optional[FourthchkiClient] = Depends(get_fourthchki)
 ):
     try:
+        if product_type and product_type not in PRODUCT_TYPES:
+            raise HTTPException(status_code=400, detail=f"Unknown product_type: {product_type}")
+        
         markup = await get_markup_percentage(db)
+        server_timing.lap("markup")
+        
+        fitments = ('original', 'replacement') if include_replacement else ('original',)
         
         if use_mock_data():
             logger.info(f"Using MOCK data for goods by car")
-            response = generate_mock_goods_by_car(brand, model, product_type)
+            # В mock режиме замен нет - только заводская комплектация
+            fitment_responses = {'original': generate_mock_goods_by_car(brand, model, product_type)}
         else:
-            client = get_fourthchki_client()
-            type_list = [product_type] if product_type else ['tyre', 'disk']
-            
-            response = client.get_goods_by_car(
+            # Шины и диски запрашиваются у поставщика одним вызовом и кэшируются,
+            # оригинал и замена - параллельно
+            fitment_responses = await get_fitment_goods_cache().get_goods_by_fitment(
+                client,
                 brand=brand,
                 model=model,
                 year_begin=year_begin,
                 year_end=year_end,
-                modification=modification if modification else "",
-                product_type=type_list,
-                podbor_type=[1]
+                modification=modification,
+                product_type=product_type or None,
+                fitments=fitments
             )
+        server_timing.lap("supplier")
+        
+        response = fitment_responses['original']
+        if isinstance(response, Exception):
+            raise response
         
         # Check if there's a meaningful error (not just empty error structure)
         # Some error codes like 52 are warnings and still return data
@@ -248,68 +271,105 @@ async def get_goods_by_car(
             error_msg = error.get('Message') or error.get('comment') or f"Error code: {error.get('code')}"
             raise HTTPException(status_code=400, detail=error_msg)
         
-        # Extract goods data from nested structure
-        goods_data = []
-        price_rest_list = response.get('price_rest_list', {})
-        if isinstance(price_rest_list, dict) and 'TyrePriceRest' in price_rest_list:
-            goods_data = price_rest_list['TyrePriceRest']
-        elif isinstance(price_rest_list, list):
-            goods_data = price_rest_list
+        # Замены - дополнительная информация: ошибка их загрузки не должна ломать подбор
+        fitment_errors = {}
+        replacement = fitment_responses.get('replacement')
+        if isinstance(replacement, Exception):
+            logger.warning(f"Failed to get replacement goods for {brand} {model}: {replacement}")
+            fitment_errors['replacement'] = str(replacement)
+            del fitment_responses['replacement']
+        elif replacement is not None:
+            replacement_error = replacement.get('error')
+            if replacement_error and replacement_error.get('code') and replacement_error.get('code') not in [52]:
+                fitment_errors['replacement'] = (
+                    replacement_error.get('Message') or replacement_error.get('comment')
+                    or f"Error code: {replacement_error.get('code')}"
+                )
+                del fitment_responses['replacement']
         
         # Apply markup to prices and normalize data structure
         # Приоритизируем Тюмень по умолчанию (ID 42)
         TYUMEN_WAREHOUSE_ID = 42
         priority_warehouses = [TYUMEN_WAREHOUSE_ID]
         
-        filtered_goods_data = []
+        goods_data = []
+        groups = {}
+        seen_codes = set()
         
-        for item in goods_data:
-            # Parse size from name
-            import re
-            name = item.get('name', '')
-            
-            # Try tire pattern first (185/60R15)
-            tire_match = re.match(r'(\d+)/(\d+)R(\d+)', name)
-            if tire_match:
-                item['width'] = int(tire_match.group(1))
-                item['height'] = int(tire_match.group(2))
-                item['diameter'] = int(tire_match.group(3))
-            else:
-                # Try disk pattern (7x16)
-                disk_match = re.search(r'(\d+\.?\d*)x(\d+)', name)
-                if disk_match:
-                    item['width'] = float(disk_match.group(1))
-                    item['diameter'] = int(disk_match.group(2))
+        for fitment, fitment_response in fitment_responses.items():
+            # Extract goods data from nested structure
+            fitment_goods = []
+            price_rest_list = fitment_response.get('price_rest_list', {})
+            if isinstance(price_rest_list, dict) and 'TyrePriceRest' in price_rest_list:
+                fitment_goods = price_rest_list['TyrePriceRest']
+            elif isinstance(price_rest_list, dict) and 'DiskPriceRest' in price_rest_list:
+                fitment_goods = price_rest_list['DiskPriceRest']
+            elif isinstance(price_rest_list, list):
+                fitment_goods = price_rest_list
             
-            # Extract brand and model if not present
-            if not item.get('brand'):
-                item['brand'] = item.get('marka', 'Неизвестно')
-            
-            # Find the best price from warehouse data
-            if item.get('whpr') and item['whpr'].get('wh_price_rest'):
-                warehouses = item['whpr']['wh_price_rest']
-                if warehouses:
-                    # Приоритизируем склады Тюмени
-                    tyumen_warehouses = [w for w in warehouses if w.get('wrh') in priority_warehouses]
-                    best_warehouse = tyumen_warehouses[0] if tyumen_warehouses else warehouses[0]
-                    
-                    best_price = float(best_warehouse.get('price', 0))
-                    item['price_original'] = best_price
-                    item['price'] = apply_markup(best_price, markup)
-                    
-                    # Extract warehouse info for display
-                    item['rest'] = best_warehouse.get('rest', 0)
-                    wrh_id = best_warehouse.get('wrh', 0)
-                    item['warehouse_name'] = f'Склад {wrh_id}'
-                    item['warehouse_id'] = wrh_id
-                    
-                    # Сохраняем все склады для отображения (опционально)
-                    item['all_warehouses'] = warehouses
-                    
-                    filtered_goods_data.append(item)
-        
-        # Заменяем goods_data на отфильтрованный список
-        goods_data = filtered_goods_data
+            for item in fitment_goods:
+                # Товар из оригинальной комплектации в заменах не повторяем
+                code = item.get('code')
+                if code is not None and code in seen_codes:
+                    continue
+                
+                # Копия - ответ поставщика лежит в кэше и используется другими запросами
+                item = dict(item)
+                item['fitment'] = fitment
+                
+                # Parse size from name
+                name = item.get('name', '')
+                
+                # Try tire pattern first (185/60R15)
+                tire_match = re.match(r'(\d+)/(\d+)R(\d+)', name)
+                if tire_match:
+                    item['width'] = int(tire_match.group(1))
+                    item['height'] = int(tire_match.group(2))
+                    item['diameter'] = int(tire_match.group(3))
+                    item['size'] = tire_match.group(0)
+                else:
+                    # Try disk pattern (7x16)
+                    disk_match = re.search(r'(\d+\.?\d*)x(\d+)', name)
+                    if disk_match:
+                        item['width'] = float(disk_match.group(1))
+                        item['diameter'] = int(disk_match.group(2))
+                        item['size'] = disk_match.group(0)
+                
+                # Extract brand and model if not present
+                if not item.get('brand'):
+                    item['brand'] = item.get('marka', 'Неизвестно')
+                
+                # Find the best price from warehouse data
+                if item.get('whpr') and item['whpr'].get('wh_price_rest'):
+                    warehouses = item['whpr']['wh_price_rest']
+                    if warehouses:
+                        # Приоритизируем склады Тюмени
+                        tyumen_warehouses = [w for w in warehouses if w.get('wrh') in priority_warehouses]
+                        best_warehouse = tyumen_warehouses[0] if tyumen_warehouses else warehouses[0]
+                        
+                        best_price = float(best_warehouse.get('price', 0))
+                        item['price_original'] = best_price
+                        item['price'] = apply_markup(best_price, markup)
+                        
+                        # Extract warehouse info for display
+                        item['rest'] = best_warehouse.get('rest', 0)
+                        wrh_id = best_warehouse.get('wrh', 0)
+                        item['warehouse_name'] = f'Склад {wrh_id}'
+                        item['warehouse_id'] = wrh_id
+                        
+                        # Сохраняем все склады для отображения (опционально)
+                        item['all_warehouses'] = warehouses
+                        
+                        seen_codes.add(code)
+                        goods_data.append(item)
+                        
+                        # Группа "тип подбора + размер"
+                        group_key = (fitment, item.get('size'))
+                        if group_key not in groups:
+                            groups[group_key] = {"fitment": fitment, "size": item.get('size'), "count": 0, "codes": []}
+                        groups[group_key]["count"] += 1
+                        groups[group_key]["codes"].append(code)
+        server_timing.lap("parse")
         
         # Extract warehouse data
         warehouses = []
@@ -319,9 +379,37 @@ async def get_goods_by_car(
         elif isinstance(warehouse_logistics, list):
             warehouses = warehouse_logistics
         
+        # Логируем выбор автомобиля - по этим данным прогревается кэш популярных авто
+        if telegram_id:
+            from datetime import datetime, timezone
+            user = await db.users.find_one({"telegram_id": telegram_id})
+            # Используем username или first_name в качестве идентификатора
+            user_display = None
+            if user:
+                user_display = user.get("username") or user.get("first_name") or f"User_{telegram_id[-4:]}"
+            activity_log = {
+                "telegram_id": telegram_id,
+                "username": user_display,
+                "activity_type": "car_selection",
+                "search_params": {
+                    "brand": brand,
+                    "model": model,
+                    "year_begin": year_begin,
+                    "year_end": year_end,
+                    "modification": modification,
+                    "product_type": product_type
+                },
+                "result_count": len(goods_data),
+                "timestamp": datetime.now(timezone.utc).isoformat()
+            }
+            await record_activity(db, activity_log)
+        server_timing.lap("activity_log")
+        
         return {
             "success": True,
             "data": goods_data,
+            "groups": list(groups.values()),
+            "fitment_errors": fitment_errors,
             "warehouses": warehouses,
             "currency": response.get('currencyRate', {}),
             "markup_percentage": markup,
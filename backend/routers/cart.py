@@ -5,16 +5,13 @@ import os
 
 from models.cart import Cart, CartItem, CartItemAdd, CartUpdateQuantity
 from models.activity import ActivityLog, ActivityType
+from services.search_analytics import record_activity
+from dependencies import get_db
 
 router = APIRouter(prefix="/cart", tags=["cart"])
 
-# Получаем database из server.py через dependency
-def get_database():
-    from server import db
-    return db
-
 @router.get("/{telegram_id}", response_model=Cart)
-async def get_cart(telegram_id: str, db = Depends(get_database)):
+async def get_cart(telegram_id: str, db = Depends(get_db)):
     """Получить корзину пользователя"""
     cart = await db.carts.find_one({"telegram_id": telegram_id})
     
@@ -35,7 +32,7 @@ async def get_cart(telegram_id: str, db = Depends(get_database)):
     return Cart(**cart)
 
 @router.post("/{telegram_id}/items")
-async def add_to_cart(telegram_id: str, item: CartItemAdd, db = Depends(get_database)):
+async def add_to_cart(telegram_id: str, item: CartItemAdd, db = Depends(get_db)):
     """Добавить товар в корзину"""
     # Проверяем блокировку пользователя
     user = await db.users.find_one({"telegram_id": telegram_id})
@@ -95,7 +92,7 @@ async def add_to_cart(telegram_id: str, item: CartItemAdd, db = Depends(get_data
         "result_count": None,
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
-    await db.activity_logs.insert_one(activity)
+    await record_activity(db, activity)
     
     return {"message": "Товар добавлен в корзину", "cart_items_count": len(items)}
 
@@ -105,7 +102,7 @@ async def update_cart_item(
     item_code: str, 
     warehouse_id: int,
     update: CartUpdateQuantity, 
-    db = Depends(get_database)
+    db = Depends(get_db)
 ):
     """Обновить количество товара в корзине"""
     # Проверяем блокировку пользователя
@@ -148,7 +145,7 @@ async def remove_from_cart(
     telegram_id: str, 
     item_code: str,
     warehouse_id: int,
-    db = Depends(get_database)
+    db = Depends(get_db)
 ):
     """Удалить товар из корзины"""
     # Проверяем блокировку пользователя
@@ -184,12 +181,12 @@ async def remove_from_cart(
         "result_count": None,
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
-    await db.activity_logs.insert_one(activity)
+    await record_activity(db, activity)
     
     return {"message": "Товар удален из корзины", "cart_items_count": len(items)}
 
 @router.delete("/{telegram_id}")
-async def clear_cart(telegram_id: str, db = Depends(get_database)):
+async def clear_cart(telegram_id: str, db = Depends(get_db)):
     """Очистить корзину"""
     # Проверяем блокировку пользователя
     user = await db.users.find_one({"telegram_id": telegram_id})
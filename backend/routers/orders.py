@@ -1,23 +1,45 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Header, Response
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime, timezone
 import os
 import logging
+from pymongo.errors import DuplicateKeyError
 
 from models.order import (
-    Order, OrderCreate, OrderStatus, OrderConfirm, OrderReject
+    Order, OrderCreate, OrderStatus, OrderConfirm, OrderReject, OrderSummaryPage,
+    ORDER_STATUS_MESSAGES
 )
-from services.fourthchki_client import get_fourthchki_client
-from services.telegram_bot import get_telegram_notifier
+from models.activity import ActivityType
+from services.telegram_bot import TelegramNotifier
+from services.search_analytics import record_activity
+from services.supplier_orders import SUPPLIER_ORDERS_ENABLED, STATE_PENDING
+from services import idempotency
+from utils.order_ids import generate_order_id
+from utils.mongo_codec import cursor_condition, decode_cursor, decode_order, encode_cursor, encode_model
+from dependencies import get_db, get_notifier, get_session, require_admin
+from utils import server_timing
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/orders", tags=["orders"])
 
-def get_db():
-    from server import db
-    return db
+# Поля строки списка заказов в админке (состав и полный адрес - в GET /orders/{order_id})
+ORDER_SUMMARY_PROJECTION = {
+    "_id": 0,
+    "order_id": 1,
+    "user_telegram_id": 1,
+    "user_name": 1,
+    "user_username": 1,
+    "status": 1,
+    "total_amount": 1,
+    "created_at": 1,
+    "confirmed_at": 1,
+    "updated_at": 1,
+    "delivery_address.city": 1,
+    "delivery_address.phone": 1,
+    "items_count": {"$size": {"$ifNull": ["$items", []]}},
+}
 
 async def get_markup_percentage(db: AsyncIOMotorDatabase) -> float:
     """Получить текущий процент наценки"""
@@ -27,34 +49,82 @@ async def get_markup_percentage(db: AsyncIOMotorDatabase) -> float:
     return float(os.environ.get('DEFAULT_MARKUP_PERCENTAGE', '15'))
 
 @router.post("", response_model=Order)
+@server_timing.timed_endpoint
 async def create_order(
     order_data: OrderCreate,
+    response: Response,
     telegram_id: str = Query(..., description="Telegram ID пользователя"),
-    db: AsyncIOMotorDatabase = Depends(get_db)
+    idempotency_key: Optional[str] = Header(
+        None, alias=idempotency.IDEMPOTENCY_HEADER,
+        description="Один ключ на попытку оформления - повторы вернут уже созданный заказ"
+    ),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    notifier: TelegramNotifier = Depends(get_notifier),
+    session: Optional[Dict[str, Any]] = Depends(get_session)
 ):
     """
     Создать новый заказ
     Заказ создается со статусом pending_confirmation и ждет подтверждения админа
+    С заголовком Idempotency-Key повтор запроса (двойное нажатие, повтор после таймаута)
+    возвращает исходный заказ без создания нового и без повторного уведомления
     """
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= idempotency.IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail="Invalid Idempotency-Key")
+    
+    idempotency_scope = f"orders:{telegram_id}"
+    key_claimed = False
+    if idempotency_key:
+        try:
+            saved = await idempotency.begin_request(
+                db, idempotency_scope, idempotency_key,
+                idempotency.request_fingerprint(order_data.model_dump(mode="json"))
+            )
+        except idempotency.IdempotencyKeyReused:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different order")
+        except idempotency.IdempotencyInProgress:
+            raise HTTPException(status_code=409, detail="Order with this Idempotency-Key is still being processed")
+        except Exception as e:
+            logger.error(f"Error checking idempotency key: {e}")
+            raise HTTPException(status_code=500, detail="Failed to create order")
+        
+        if saved is not None:
+            # Повтор - отдаем заказ, созданный первым запросом
+            existing = await db.orders.find_one({"order_id": saved["order_id"]}, {"_id": 0})
+            if not existing:
+                raise HTTPException(status_code=404, detail="Order not found")
+            logger.info(f"Order {saved['order_id']} replayed for idempotency key of user {telegram_id}")
+            response.headers["Idempotent-Replayed"] = "true"
+            return decode_order(existing)
+        key_claimed = True
+    server_timing.lap("idempotency")
+    
     try:
-        # Получаем пользователя
-        user = await db.users.find_one(
-            {"telegram_id": telegram_id},
-            {"_id": 0}
-        )
-        
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
+        if session and session["sub"] == telegram_id:
+            # Имя и username из токена сессии - без запроса к базе
+            user_display_name = session.get('name') or telegram_id
+            user_username = session.get('usr')
+        else:
+            # Получаем пользователя
+            user = await db.users.find_one(
+                {"telegram_id": telegram_id},
+                {"_id": 0}
+            )
+            
+            if not user:
+                raise HTTPException(status_code=404, detail="User not found")
+            
+            user_display_name = user.get('username') or user.get('first_name') or telegram_id
+            user_username = user.get('username')  # Сохраняем username если есть
+        server_timing.lap("user")
         
         # Получаем текущий процент наценки
         markup = await get_markup_percentage(db)
+        server_timing.lap("markup")
         
         # Вычисляем общую сумму
         total_amount = sum(item.price_final * item.quantity for item in order_data.items)
         
         # Создаем заказ
-        user_display_name = user.get('username') or user.get('first_name') or telegram_id
-        user_username = user.get('username')  # Сохраняем username если есть
         
         order = Order(
             user_telegram_id=telegram_id,
@@ -67,25 +137,52 @@ async def create_order(
             status=OrderStatus.PENDING_CONFIRMATION
         )
         
-        # Сохраняем в базу
-        order_dict = order.model_dump()
-        order_dict['created_at'] = order_dict['created_at'].isoformat()
-        order_dict['status'] = order_dict['status'].value
-        if order_dict.get('confirmed_at'):
-            order_dict['confirmed_at'] = order_dict['confirmed_at'].isoformat()
-        
-        await db.orders.insert_one(order_dict)
+        # Сохраняем в базу (даты - BSON datetime)
+        order_dict = encode_model(order)
+        
+        # Уникальный индекс на order_id - при коллизии выдаем новый номер
+        for attempt in range(3):
+            try:
+                await db.orders.insert_one(order_dict)
+                break
+            except DuplicateKeyError:
+                if attempt == 2:
+                    raise
+                logger.warning(f"Order ID collision for {order.order_id}, regenerating")
+                order.order_id = generate_order_id()
+                order_dict.pop('_id', None)
+                order_dict['order_id'] = order.order_id
+        
+        # Заказ сохранен - повторы с этим ключом получат его, даже если дальше что-то упадет
+        if key_claimed:
+            await idempotency.complete_request(db, idempotency_scope, idempotency_key, {"order_id": order.order_id})
+            key_claimed = False
+        server_timing.lap("insert")
         
         logger.info(f"Order created: {order.order_id} by user {telegram_id}")
         
+        # Логируем активность (для воронки поиск -> корзина -> заказ)
+        try:
+            await record_activity(db, {
+                "telegram_id": telegram_id,
+                "username": user_display_name,
+                "activity_type": ActivityType.ORDER_CREATED.value,
+                "search_params": {"order_id": order.order_id},
+                "result_count": len(order_data.items),
+                "timestamp": order.created_at.isoformat()
+            })
+        except Exception as e:
+            logger.error(f"Failed to log order activity: {e}")
+        server_timing.lap("activity_log")
+        
         # Отправляем уведомление админу
-        notifier = get_telegram_notifier()
         await notifier.notify_admin_new_order(
             order_id=order.order_id,
             user_name=user_display_name,
             total_amount=total_amount,
             items_count=len(order_data.items)
         )
+        server_timing.lap("notify")
         
         return order
         
@@ -94,8 +191,16 @@ async def create_order(
     except Exception as e:
         logger.error(f"Error creating order: {e}")
         raise HTTPException(status_code=500, detail="Failed to create order")
+    finally:
+        # Заказ не создан - освобождаем ключ, чтобы повтор выполнился заново
+        if key_claimed:
+            try:
+                await idempotency.release_request(db, idempotency_scope, idempotency_key)
+            except Exception as e:
+                logger.error(f"Failed to release idempotency key: {e}")
 
 @router.get("/my", response_model=List[Order])
+@server_timing.timed_endpoint
 async def get_my_orders(
     telegram_id: str = Query(..., description="Telegram ID пользователя"),
     db: AsyncIOMotorDatabase = Depends(get_db)
@@ -108,15 +213,7 @@ async def get_my_orders(
             {"user_telegram_id": telegram_id},
             {"_id": 0}
         ).sort("created_at", -1).to_list(100)
-        
-        # Конвертируем даты и статусы
-        for order in orders:
-            if isinstance(order.get('created_at'), str):
-                order['created_at'] = datetime.fromisoformat(order['created_at'])
-            if isinstance(order.get('confirmed_at'), str):
-                order['confirmed_at'] = datetime.fromisoformat(order['confirmed_at'])
-            if isinstance(order.get('status'), str):
-                order['status'] = OrderStatus(order['status'])
+        server_timing.lap("query")
         
         return orders
         
@@ -125,6 +222,7 @@ async def get_my_orders(
         raise HTTPException(status_code=500, detail="Failed to get orders")
 
 @router.get("/{order_id}", response_model=Order)
+@server_timing.timed_endpoint
 async def get_order(
     order_id: str,
     telegram_id: str = Query(..., description="Telegram ID пользователя"),
@@ -149,19 +247,12 @@ async def get_order(
             query["user_telegram_id"] = telegram_id
         
         order = await db.orders.find_one(query, {"_id": 0})
+        server_timing.lap("query")
         
         if not order:
             raise HTTPException(status_code=404, detail="Order not found")
         
-        # Конвертируем даты и статус
-        if isinstance(order.get('created_at'), str):
-            order['created_at'] = datetime.fromisoformat(order['created_at'])
-        if isinstance(order.get('confirmed_at'), str):
-            order['confirmed_at'] = datetime.fromisoformat(order['confirmed_at'])
-        if isinstance(order.get('status'), str):
-            order['status'] = OrderStatus(order['status'])
-        
-        return Order(**order)
+        return decode_order(order)
         
     except HTTPException:
         raise
@@ -171,36 +262,18 @@ async def get_order(
 
 @router.get("/admin/pending", response_model=List[Order])
 async def get_pending_orders(
-    telegram_id: str = Query(..., description="Telegram ID админа"),
+    telegram_id: str = Depends(require_admin),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """
     Получить список заказов ожидающих подтверждения (только для админа)
     """
     try:
-        # Проверяем, что пользователь админ
-        user = await db.users.find_one(
-            {"telegram_id": telegram_id},
-            {"_id": 0}
-        )
-        
-        if not user or not user.get('is_admin'):
-            raise HTTPException(status_code=403, detail="Access denied")
-        
         orders = await db.orders.find(
             {"status": OrderStatus.PENDING_CONFIRMATION.value},
             {"_id": 0}
         ).sort("created_at", -1).to_list(100)
         
-        # Конвертируем даты и статусы
-        for order in orders:
-            if isinstance(order.get('created_at'), str):
-                order['created_at'] = datetime.fromisoformat(order['created_at'])
-            if isinstance(order.get('confirmed_at'), str):
-                order['confirmed_at'] = datetime.fromisoformat(order['confirmed_at'])
-            if isinstance(order.get('status'), str):
-                order['status'] = OrderStatus(order['status'])
-        
         return orders
         
     except HTTPException:
@@ -211,45 +284,36 @@ async def get_pending_orders(
 
 
 @router.get("/admin/all", response_model=List[Order])
+@server_timing.timed_endpoint
 async def get_all_orders(
-    telegram_id: str = Query(..., description="Telegram ID админа"),
+    telegram_id: str = Depends(require_admin),
     status: Optional[str] = Query(None, description="Фильтр по статусу"),
+    created_from: Optional[datetime] = Query(None, description="Заказы, созданные не раньше (ISO 8601)"),
+    created_to: Optional[datetime] = Query(None, description="Заказы, созданные раньше (ISO 8601)"),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """
     Получить список ВСЕХ заказов (только для админа)
-    Опционально можно фильтровать по статусу
+    Опционально можно фильтровать по статусу и периоду создания
     """
     try:
-        # Проверяем, что пользователь админ
-        user = await db.users.find_one(
-            {"telegram_id": telegram_id},
-            {"_id": 0}
-        )
-        
-        if not user or not user.get('is_admin'):
-            raise HTTPException(status_code=403, detail="Access denied")
-        
         # Формируем фильтр
         filter_query = {"hidden_in_admin": {"$ne": True}}  # Не показывать скрытые
         if status:
             filter_query["status"] = status
+        # created_at - BSON datetime, диапазон читается по индексу
+        if created_from or created_to:
+            filter_query["created_at"] = {}
+            if created_from:
+                filter_query["created_at"]["$gte"] = created_from
+            if created_to:
+                filter_query["created_at"]["$lt"] = created_to
         
         orders = await db.orders.find(
             filter_query,
             {"_id": 0}
         ).sort("created_at", -1).to_list(1000)
-        
-        # Конвертируем даты и статусы
-        for order in orders:
-            if isinstance(order.get('created_at'), str):
-                order['created_at'] = datetime.fromisoformat(order['created_at'])
-            if isinstance(order.get('confirmed_at'), str):
-                order['confirmed_at'] = datetime.fromisoformat(order['confirmed_at'])
-            if isinstance(order.get('updated_at'), str):
-                order['updated_at'] = datetime.fromisoformat(order['updated_at'])
-            if isinstance(order.get('status'), str):
-                order['status'] = OrderStatus(order['status'])
+        server_timing.lap("query")
         
         return orders
         
@@ -260,27 +324,88 @@ async def get_all_orders(
         raise HTTPException(status_code=500, detail="Failed to get orders")
 
 
+@router.get("/admin/summary", response_model=OrderSummaryPage)
+@server_timing.timed_endpoint
+async def get_orders_summary(
+    telegram_id: str = Depends(require_admin),
+    status: Optional[List[OrderStatus]] = Query(None, description="Статусы (можно несколько)"),
+    created_from: Optional[datetime] = Query(None, description="Заказы, созданные не раньше (ISO 8601)"),
+    created_to: Optional[datetime] = Query(None, description="Заказы, созданные раньше (ISO 8601)"),
+    user_telegram_id: Optional[str] = Query(None, description="Заказы одного клиента"),
+    min_total: Optional[float] = Query(None, ge=0, description="Сумма заказа от"),
+    cursor: Optional[str] = Query(None, description="next_cursor предыдущей страницы"),
+    limit: int = Query(50, ge=1, le=200, description="Заказов на странице"),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Список заказов для админки: только поля строки списка, новые сверху (только для админа)
+    Постраничный вывод по курсору (created_at, order_id) - страница читается по индексу
+    без skip, поэтому скорость не зависит от числа заказов и номера страницы
+    """
+    try:
+        # Формируем фильтр
+        conditions = [{"hidden_in_admin": {"$ne": True}}]  # Не показывать скрытые
+        if status:
+            conditions.append({"status": {"$in": [s.value for s in status]}})
+        if user_telegram_id:
+            conditions.append({"user_telegram_id": user_telegram_id})
+        if min_total is not None:
+            conditions.append({"total_amount": {"$gte": min_total}})
+        if created_from:
+            conditions.append({"created_at": {"$gte": created_from}})
+        if created_to:
+            conditions.append({"created_at": {"$lt": created_to}})
+        if cursor:
+            try:
+                cursor_created_at, cursor_order_id = decode_cursor(cursor)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            # Строго после последней строки предыдущей страницы
+            conditions.append(cursor_condition(cursor_created_at, cursor_order_id))
+        
+        # Берем на одну строку больше - так узнаем, есть ли следующая страница
+        orders = await db.orders.aggregate([
+            {"$match": {"$and": conditions}},
+            {"$sort": {"created_at": -1, "order_id": -1}},
+            {"$limit": limit + 1},
+            {"$project": ORDER_SUMMARY_PROJECTION},
+        ]).to_list(limit + 1)
+        server_timing.lap("query")
+        
+        has_more = len(orders) > limit
+        orders = orders[:limit]
+        next_cursor = None
+        if has_more:
+            last = orders[-1]
+            next_cursor = encode_cursor(last["created_at"], last["order_id"])
+        
+        return {
+            "orders": orders,
+            "next_cursor": next_cursor,
+            "has_more": has_more
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting orders summary: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get orders")
+
+
 @router.post("/{order_id}/confirm", response_model=Order)
 async def confirm_order(
     order_id: str,
     confirm_data: OrderConfirm,
-    telegram_id: str = Query(..., description="Telegram ID админа"),
-    db: AsyncIOMotorDatabase = Depends(get_db)
+    telegram_id: str = Depends(require_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    notifier: TelegramNotifier = Depends(get_notifier)
 ):
     """
     Подтвердить заказ (только для админа)
-    Статус меняется на CONFIRMED для ручной обработки админом
+    Статус меняется на CONFIRMED; при SUPPLIER_ORDERS_ENABLED заказ ставится
+    в очередь автоматического заказа у поставщика, иначе - для ручной обработки админом
     """
     try:
-        # Проверяем, что пользователь админ
-        user = await db.users.find_one(
-            {"telegram_id": telegram_id},
-            {"_id": 0}
-        )
-        
-        if not user or not user.get('is_admin'):
-            raise HTTPException(status_code=403, detail="Access denied")
-        
         # Получаем заказ
         order = await db.orders.find_one(
             {"order_id": order_id},
@@ -300,10 +425,13 @@ async def confirm_order(
         now = datetime.now(timezone.utc)
         update_data = {
             'status': OrderStatus.CONFIRMED.value,  # Статус "подтвержден" для ручной обработки
-            'confirmed_at': now.isoformat(),
+            'confirmed_at': now,
             'confirmed_by_admin': telegram_id
         }
         
+        if SUPPLIER_ORDERS_ENABLED:
+            update_data['supplier_state'] = STATE_PENDING
+        
         if confirm_data.admin_comment:
             update_data['admin_comment'] = confirm_data.admin_comment
         
@@ -312,10 +440,12 @@ async def confirm_order(
             {"$set": update_data}
         )
         
-        logger.info(f"Order {order_id} confirmed by admin {telegram_id} for manual processing")
+        logger.info(
+            f"Order {order_id} confirmed by admin {telegram_id} "
+            f"{'for supplier ordering' if SUPPLIER_ORDERS_ENABLED else 'for manual processing'}"
+        )
         
         # Отправляем уведомление клиенту
-        notifier = get_telegram_notifier()
         await notifier.notify_user_order_confirmed(
             user_telegram_id=order['user_telegram_id'],
             order_id=order_id
@@ -327,15 +457,7 @@ async def confirm_order(
             {"_id": 0}
         )
         
-        # Конвертируем даты и статус
-        if isinstance(updated_order.get('created_at'), str):
-            updated_order['created_at'] = datetime.fromisoformat(updated_order['created_at'])
-        if isinstance(updated_order.get('confirmed_at'), str):
-            updated_order['confirmed_at'] = datetime.fromisoformat(updated_order['confirmed_at'])
-        if isinstance(updated_order.get('status'), str):
-            updated_order['status'] = OrderStatus(updated_order['status'])
-        
-        return Order(**updated_order)
+        return decode_order(updated_order)
         
     except HTTPException:
         raise
@@ -347,22 +469,14 @@ async def confirm_order(
 async def reject_order(
     order_id: str,
     reject_data: OrderReject,
-    telegram_id: str = Query(..., description="Telegram ID админа"),
-    db: AsyncIOMotorDatabase = Depends(get_db)
+    telegram_id: str = Depends(require_admin),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    notifier: TelegramNotifier = Depends(get_notifier)
 ):
     """
     Отклонить заказ (только для админа)
     """
     try:
-        # Проверяем, что пользователь админ
-        user = await db.users.find_one(
-            {"telegram_id": telegram_id},
-            {"_id": 0}
-        )
-        
-        if not user or not user.get('is_admin'):
-            raise HTTPException(status_code=403, detail="Access denied")
-        
         # Получаем заказ
         order = await db.orders.find_one(
             {"order_id": order_id},
@@ -390,7 +504,6 @@ async def reject_order(
         logger.info(f"Order {order_id} rejected by admin")
         
         # Отправляем уведомление клиенту
-        notifier = get_telegram_notifier()
         await notifier.notify_user_order_rejected(
             user_telegram_id=order['user_telegram_id'],
             order_id=order_id,
@@ -403,15 +516,7 @@ async def reject_order(
             {"_id": 0}
         )
         
-        # Конвертируем даты и статус
-        if isinstance(updated_order.get('created_at'), str):
-            updated_order['created_at'] = datetime.fromisoformat(updated_order['created_at'])
-        if isinstance(updated_order.get('confirmed_at'), str):
-            updated_order['confirmed_at'] = datetime.fromisoformat(updated_order['confirmed_at'])
-        if isinstance(updated_order.get('status'), str):
-            updated_order['status'] = OrderStatus(updated_order['status'])
-        
-        return Order(**updated_order)
+        return decode_order(updated_order)
         
     except HTTPException:
         raise
@@ -424,9 +529,10 @@ async def reject_order(
 async def update_order_status(
     order_id: str,
     new_status: OrderStatus,
-    telegram_id: str = Query(..., description="Telegram ID админа"),
+    telegram_id: str = Depends(require_admin),
     comment: Optional[str] = Query(None, description="Комментарий к изменению статуса"),
-    db: AsyncIOMotorDatabase = Depends(get_db)
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    notifier: TelegramNotifier = Depends(get_notifier)
 ):
     """
     Изменить статус заказа (только для админа)
@@ -439,15 +545,6 @@ async def update_order_status(
     - cancelled: Отменен
     """
     try:
-        # Проверяем, что пользователь админ
-        user = await db.users.find_one(
-            {"telegram_id": telegram_id},
-            {"_id": 0}
-        )
-        
-        if not user or not user.get('is_admin'):
-            raise HTTPException(status_code=403, detail="Access denied")
-        
         # Получаем заказ
         order = await db.orders.find_one(
             {"order_id": order_id},
@@ -467,7 +564,7 @@ async def update_order_status(
         # Обновляем статус
         update_data = {
             'status': new_status.value,
-            'updated_at': datetime.now(timezone.utc).isoformat()
+            'updated_at': datetime.now(timezone.utc)
         }
         
         if comment:
@@ -481,17 +578,7 @@ async def update_order_status(
         logger.info(f"Order {order_id} status changed to {new_status.value} by admin {telegram_id}")
         
         # Отправляем уведомление клиенту о изменении статуса
-        notifier = get_telegram_notifier()
-        status_messages = {
-            OrderStatus.AWAITING_PAYMENT: "Ожидает оплаты",
-            OrderStatus.IN_PROGRESS: "Принят в работу",
-            OrderStatus.DELIVERY: "Передан в доставку",
-            OrderStatus.DELAYED: "Задержан",
-            OrderStatus.COMPLETED: "Выполнен",
-            OrderStatus.CANCELLED: "Отменен"
-        }
-        
-        status_text = status_messages.get(new_status, new_status.value)
+        status_text = ORDER_STATUS_MESSAGES.get(new_status, new_status.value)
         await notifier.notify_user_order_status_changed(
             user_telegram_id=order['user_telegram_id'],
             order_id=order_id,
@@ -505,17 +592,7 @@ async def update_order_status(
             {"_id": 0}
         )
         
-        # Конвертируем даты и статус
-        if isinstance(updated_order.get('created_at'), str):
-            updated_order['created_at'] = datetime.fromisoformat(updated_order['created_at'])
-        if isinstance(updated_order.get('confirmed_at'), str):
-            updated_order['confirmed_at'] = datetime.fromisoformat(updated_order['confirmed_at'])
-        if isinstance(updated_order.get('updated_at'), str):
-            updated_order['updated_at'] = datetime.fromisoformat(updated_order['updated_at'])
-        if isinstance(updated_order.get('status'), str):
-            updated_order['status'] = OrderStatus(updated_order['status'])
-        
-        return Order(**updated_order)
+        return decode_order(updated_order)
         
     except HTTPException:
         raise
@@ -527,7 +604,7 @@ async def update_order_status(
 @router.delete("/{order_id}/hide")
 async def hide_order_from_admin(
     order_id: str,
-    telegram_id: str = Query(..., description="Telegram ID админа"),
+    telegram_id: str = Depends(require_admin),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """
@@ -535,15 +612,6 @@ async def hide_order_from_admin(
     Заказ остается в БД и виден клиенту
     """
     try:
-        # Проверяем, что пользователь админ
-        user = await db.users.find_one(
-            {"telegram_id": telegram_id},
-            {"_id": 0}
-        )
-        
-        if not user or not user.get('is_admin'):
-            raise HTTPException(status_code=403, detail="Access denied")
-        
         # Получаем заказ
         order = await db.orders.find_one(
             {"order_id": order_id},
@@ -1,16 +1,26 @@
-from fastapi import APIRouter, HTTPException, Query, Depends
+from fastapi import APIRouter, HTTPException, Query, Depends, Request
+from pydantic import BaseModel, Field
 from typing import List, Optional
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from datetime import datetime, timezone
+import asyncio
 import logging
 import os
+import re
 
-from services.fourthchki_client import get_fourthchki_client
+from services.fourthchki_client import FourthchkiClient
 from services.mock_data import (
     generate_mock_tires, 
     generate_mock_disks, 
     MOCK_WAREHOUSES
 )
-from services.brands_data import TIRE_BRANDS, DISK_BRANDS
+from services.brand_index import get_brand_index
+from services.search_analytics import record_activity
+from services.search_facets import DISK_FACETS, TIRE_FACETS, SearchFilters, facet_key, get_facet_cache
+from services.rate_limiter import search_cost
+from services.supplier_cache import disk_search_params, get_supplier_cache, tire_search_params
+from dependencies import charge_supplier_budget, get_db, get_fourthchki
+from utils import server_timing
 
 logger = logging.getLogger(__name__)
 
@@ -20,9 +30,22 @@ def use_mock_data() -> bool:
 
 router = APIRouter(prefix="/products", tags=["products"])
 
-def get_db():
-    from server import db
-    return db
+# Пакетный поиск шин: размеров в одном запросе и одновременных запросов к поставщику
+TIRE_BATCH_MAX_SIZES = int(os.environ.get('TIRE_BATCH_MAX_SIZES', '10'))
+TIRE_BATCH_CONCURRENCY = int(os.environ.get('TIRE_BATCH_CONCURRENCY', '4'))
+
+class TireSize(BaseModel):
+    width: int
+    height: int
+    diameter: int
+
+class TireBatchSearch(BaseModel):
+    sizes: List[TireSize] = Field(..., min_length=1)
+    season: Optional[str] = None
+    brand: Optional[str] = None
+    city: Optional[str] = None
+    sort_by: Optional[str] = None
+    telegram_id: Optional[str] = None
 
 def apply_markup(price: float, markup_data) -> float:
     """
@@ -77,7 +100,116 @@ async def get_markup_percentage(db: AsyncIOMotorDatabase) -> float:
         return settings.get('markup_percentage', 15.0)
     return 15.0  # Для ступенчатой наценки возвращаем дефолт
 
+# Маппинг городов к ID складов (склады с logistDays=0, самовывоз)
+# Для региональных городов включены все склады региона
+CITY_WAREHOUSES = {
+    'Тюмень': [42],  # Только основной склад Тюмень
+    '🏪 Тюмень': [42],  # С эмодзи
+    'Сургут': [1882, 525, 1948, 1131, 1456, 1694],  # Все склады Сургута
+    'Лянтор': [1477, 1212, 1824, 459, 1997, 1882, 525, 1948, 1131, 1456, 1694],  # Лянтор + Нефтеюганск + Белый Яр + Сургут (весь регион)
+    '🏪 Лянтор': [1477, 1212, 1824, 459, 1997, 1882, 525, 1948, 1131, 1456, 1694],  # С эмодзи
+    'Нефтеюганск': [1212, 459, 1824],  # Все склады Нефтеюганска
+    'Белый Яр': [1997],  # Белый Яр
+    'Екатеринбург': [1431],  # Екатеринбург
+    '🚚 Екатеринбург': [1431],  # С эмодзи
+    'Челябинск': [2017],  # Челябинск
+    '🚚 Челябинск': [2017],  # С эмодзи
+    'Москва': [1, 232],  # Москва
+    '🚚 Москва': [1, 232],  # С эмодзи
+    'Санкт-Петербург': [1655],  # Санкт-Петербург
+    '🚚 Санкт-Петербург': [1655]  # С эмодзи
+}
+TYUMEN_WAREHOUSE_ID = 42  # ID склада Тюмень по умолчанию
+
+def get_studded_filter(season: Optional[str]) -> Optional[bool]:
+    """Фильтр по шипам для сезонов winter-studded / winter-non-studded"""
+    if season == 'winter-studded':
+        return True
+    if season == 'winter-non-studded':
+        return False
+    return None
+
+def prepare_tire_items(response: dict, city: Optional[str], studded_filter: Optional[bool], markup_settings) -> List[dict]:
+    """
+    Шины из ответа поставщика: размер из названия, лучший склад выбранного города,
+    цена с наценкой. Товары без остатка в городе и не подходящие по шипам отбрасываются
+    """
+    # Extract tire data from nested structure
+    tire_data = []
+    price_rest_list = response.get('price_rest_list', {})
+    if isinstance(price_rest_list, dict) and 'TyrePriceRest' in price_rest_list:
+        tire_data = price_rest_list['TyrePriceRest']
+    elif isinstance(price_rest_list, list):
+        tire_data = price_rest_list
+    
+    # Определяем приоритетные склады на основе выбранного города
+    priority_warehouses = CITY_WAREHOUSES.get(city, [TYUMEN_WAREHOUSE_ID]) if city else [TYUMEN_WAREHOUSE_ID]
+
+    filtered_tire_data = []
+
+    for item in tire_data:
+        # Копия - ответ поставщика лежит в кэше и используется другими запросами
+        item = dict(item)
+
+        # Фильтрация по шипам (если указан фильтр)
+        if studded_filter is not None:
+            item_has_studs = item.get('thorn', False)
+            if item_has_studs != studded_filter:
+                continue  # Пропускаем товар если не соответствует фильтру
+
+        # Parse tire size from name (e.g., "185/60R15")
+        name = item.get('name', '')
+        size_match = re.match(r'(\d+)/(\d+)R(\d+)', name)
+        if size_match:
+            item['width'] = int(size_match.group(1))
+            item['height'] = int(size_match.group(2))
+            item['diameter'] = int(size_match.group(3))
+
+        # Extract brand and model if not present
+        if not item.get('brand'):
+            item['brand'] = item.get('marka', 'Неизвестно')
+
+
+        # Extract image URLs
+        item['img_small'] = item.get('img_small', '')
+        item['img_big_my'] = item.get('img_big_my', '')
+        item['img_big_pish'] = item.get('img_big_pish', '')
+        # Fallback: if img_big_my is empty, use img_big_pish
+        if not item['img_big_my']:
+            item['img_big_my'] = item['img_big_pish']
+        # Find the best price from warehouse data
+        if item.get('whpr') and item['whpr'].get('wh_price_rest'):
+            warehouses = item['whpr']['wh_price_rest']
+            if warehouses:
+                # ФИЛЬТРАЦИЯ: ищем склады только из выбранного города
+                city_warehouses = [w for w in warehouses if w.get('wrh') in priority_warehouses]
+
+                # Если в выбранном городе нет товара, пропускаем
+                if not city_warehouses and city:
+                    continue
+
+                # Выбираем лучший склад (из города или любой)
+                best_warehouse = city_warehouses[0] if city_warehouses else warehouses[0]
+
+                best_price = float(best_warehouse.get('price', 0))
+                item['price_original'] = best_price
+                item['price'] = apply_markup(best_price, markup_settings)
+
+                # Extract warehouse info for display
+                item['rest'] = best_warehouse.get('rest', 0)
+                wrh_id = best_warehouse.get('wrh', 0)
+                item['warehouse_name'] = f'Склад {wrh_id}'
+                item['warehouse_id'] = wrh_id
+
+                # Сохраняем все склады для отображения (опционально)
+                item['all_warehouses'] = warehouses
+
+                filtered_tire_data.append(item)
+    
+    return filtered_tire_data
+
 @router.get("/tires/search")
+@server_timing.timed_endpoint
 async def search_tires(
     width: Optional[int] = Query(None, description="Ширина шины (например, 185)"),
     height: Optional[int] = Query(None, description="Высота профиля (например, 60)"),
@@ -89,37 +221,42 @@ async def search_tires(
     page: int = Query(0, ge=0, description="Номер страницы"),
     page_size: int = Query(2000, ge=1, le=2000, description="Размер страницы"),
     telegram_id: Optional[str] = Query(None, description="Telegram ID пользователя для логирования"),
-    db: AsyncIOMotorDatabase = Depends(get_db)
+    brands: Optional[List[str]] = Query(None, description="Уточнение: бренды (можно несколько)"),
+    seasons: Optional[List[str]] = Query(None, description="Уточнение: сезоны s/w/u или summer/winter/all-season"),
+    studded: Optional[bool] = Query(None, description="Уточнение: шипованные"),
+    runflat: Optional[bool] = Query(None, description="Уточнение: RunFlat"),
+    load_index: Optional[List[str]] = Query(None, description="Уточнение: индексы нагрузки"),
+    speed_index: Optional[List[str]] = Query(None, description="Уточнение: индексы скорости"),
+    price_min: Optional[float] = Query(None, ge=0, description="Уточнение: цена от"),
+    price_max: Optional[float] = Query(None, ge=0, description="Уточнение: цена до"),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    client: Optional[FourthchkiClient] = Depends(get_fourthchki)
 ):
     """
     Поиск шин по параметрам
+    Фасеты считаются по базовому результату, уточняющие фильтры применяются после
     """
     try:
         markup_settings = await get_markup_settings(db)
-        
-        season_map = {
-            'summer': 's',
-            'winter': 'w',
-            'all-season': 'u',
-            'winter-studded': 'w',  # Зимние с шипами
-            'winter-non-studded': 'w'  # Зимние без шипов
-        }
+        server_timing.lap("markup")
         
         # Определяем фильтр по шипам
-        studded_filter = None
-        if season == 'winter-studded':
-            studded_filter = True
-        elif season == 'winter-non-studded':
-            studded_filter = False
-        
-        season_list = None
-        if season and season in season_map:
-            season_list = [season_map[season]]
+        studded_filter = get_studded_filter(season)
+        
+        search_params = tire_search_params(
+            width=width,
+            height=height,
+            diameter=diameter,
+            season=season,
+            brand=brand,
+            page=page,
+            page_size=page_size
+        )
         
         if use_mock_data():
             logger.info("Using MOCK data for tires search")
             response = generate_mock_tires(
-                season=season_list,
+                season=search_params['season_list'],
                 width=width,
                 height=height,
                 diameter=diameter,
@@ -128,21 +265,9 @@ async def search_tires(
                 page_size=page_size
             )
         else:
-            client = get_fourthchki_client()
-            brand_list = [brand] if brand else None
-            
-            response = client.search_tires(
-                season_list=season_list,
-                width_min=width,
-                width_max=width,
-                height_min=height,
-                height_max=height,
-                diameter_min=diameter,
-                diameter_max=diameter,
-                brand_list=brand_list,
-                page=page,
-                page_size=page_size
-            )
+            # Одинаковые поиски отвечаются из кэша, одновременные ждут один вызов SOAP
+            response = await get_supplier_cache().search_tires(client, search_params)
+        server_timing.lap("supplier")
         
         # Check if there's a meaningful error (not just empty error structure)
         error = response.get('error')
@@ -150,105 +275,35 @@ async def search_tires(
             error_msg = error.get('Message') or error.get('comment') or f"Error code: {error.get('code')}"
             raise HTTPException(status_code=400, detail=error_msg)
         
-        # Extract tire data from nested structure
-        tire_data = []
-        price_rest_list = response.get('price_rest_list', {})
-        if isinstance(price_rest_list, dict) and 'TyrePriceRest' in price_rest_list:
-            tire_data = price_rest_list['TyrePriceRest']
-        elif isinstance(price_rest_list, list):
-            tire_data = price_rest_list
-        
-        # Маппинг городов к ID складов (склады с logistDays=0, самовывоз)
-        # Для региональных городов включены все склады региона
-        CITY_WAREHOUSES = {
-            'Тюмень': [42],  # Только основной склад Тюмень
-            '🏪 Тюмень': [42],  # С эмодзи
-            'Сургут': [1882, 525, 1948, 1131, 1456, 1694],  # Все склады Сургута
-            'Лянтор': [1477, 1212, 1824, 459, 1997, 1882, 525, 1948, 1131, 1456, 1694],  # Лянтор + Нефтеюганск + Белый Яр + Сургут (весь регион)
-            '🏪 Лянтор': [1477, 1212, 1824, 459, 1997, 1882, 525, 1948, 1131, 1456, 1694],  # С эмодзи
-            'Нефтеюганск': [1212, 459, 1824],  # Все склады Нефтеюганска
-            'Белый Яр': [1997],  # Белый Яр
-            'Екатеринбург': [1431],  # Екатеринбург
-            '🚚 Екатеринбург': [1431],  # С эмодзи
-            'Челябинск': [2017],  # Челябинск
-            '🚚 Челябинск': [2017],  # С эмодзи
-            'Москва': [1, 232],  # Москва
-            '🚚 Москва': [1, 232],  # С эмодзи
-            'Санкт-Петербург': [1655],  # Санкт-Петербург
-            '🚚 Санкт-Петербург': [1655]  # С эмодзи
-        }
-        TYUMEN_WAREHOUSE_ID = 42  # ID склада Тюмень по умолчанию
-        
-        # Определяем приоритетные склады на основе выбранного города
-        priority_warehouses = CITY_WAREHOUSES.get(city, [TYUMEN_WAREHOUSE_ID]) if city else [TYUMEN_WAREHOUSE_ID]
-        
-        filtered_tire_data = []
-        
-        for item in tire_data:
-            # Фильтрация по шипам (если указан фильтр)
-            if studded_filter is not None:
-                item_has_studs = item.get('thorn', False)
-                if item_has_studs != studded_filter:
-                    continue  # Пропускаем товар если не соответствует фильтру
-            
-            # Parse tire size from name (e.g., "185/60R15")
-            import re
-            name = item.get('name', '')
-            size_match = re.match(r'(\d+)/(\d+)R(\d+)', name)
-            if size_match:
-                item['width'] = int(size_match.group(1))
-                item['height'] = int(size_match.group(2))
-                item['diameter'] = int(size_match.group(3))
-            
-            # Extract brand and model if not present
-            if not item.get('brand'):
-                item['brand'] = item.get('marka', 'Неизвестно')
-            
-            
-            # Extract image URLs
-            item['img_small'] = item.get('img_small', '')
-            item['img_big_my'] = item.get('img_big_my', '')
-            item['img_big_pish'] = item.get('img_big_pish', '')
-            # Fallback: if img_big_my is empty, use img_big_pish
-            if not item['img_big_my']:
-                item['img_big_my'] = item['img_big_pish']
-            # Find the best price from warehouse data
-            if item.get('whpr') and item['whpr'].get('wh_price_rest'):
-                warehouses = item['whpr']['wh_price_rest']
-                if warehouses:
-                    # ФИЛЬТРАЦИЯ: ищем склады только из выбранного города
-                    city_warehouses = [w for w in warehouses if w.get('wrh') in priority_warehouses]
-                    
-                    # Если в выбранном городе нет товара, пропускаем
-                    if not city_warehouses and city:
-                        continue
-                    
-                    # Выбираем лучший склад (из города или любой)
-                    best_warehouse = city_warehouses[0] if city_warehouses else warehouses[0]
-                    
-                    best_price = float(best_warehouse.get('price', 0))
-                    item['price_original'] = best_price
-                    item['price'] = apply_markup(best_price, markup_settings)
-                    
-                    # Extract warehouse info for display
-                    item['rest'] = best_warehouse.get('rest', 0)
-                    wrh_id = best_warehouse.get('wrh', 0)
-                    item['warehouse_name'] = f'Склад {wrh_id}'
-                    item['warehouse_id'] = wrh_id
-                    
-                    # Сохраняем все склады для отображения (опционально)
-                    item['all_warehouses'] = warehouses
-                    
-                    filtered_tire_data.append(item)
-        
-        # Заменяем tire_data на отфильтрованный список
-        tire_data = filtered_tire_data
+        tire_data = prepare_tire_items(response, city, studded_filter, markup_settings)
+        total_count = len(tire_data)
+        server_timing.lap("parse")
+        
+        # Фасеты базового запроса (без уточняющих фильтров) кэшируются
+        facets = await get_facet_cache().get_facets(
+            facet_key("tires", width, height, diameter, season, brand, city, page, page_size,
+                      markup_settings, use_mock_data()),
+            tire_data,
+            TIRE_FACETS,
+        )
+        server_timing.lap("facets")
+        tire_data = SearchFilters(
+            brands=brands,
+            seasons=seasons,
+            studded=studded,
+            runflat=runflat,
+            load_indexes=load_index,
+            speed_indexes=speed_index,
+            price_min=price_min,
+            price_max=price_max,
+        ).apply(tire_data)
         
         # Сортировка по цене
         if sort_by == 'price_asc':
             tire_data.sort(key=lambda x: x.get('price', 0))
         elif sort_by == 'price_desc':
             tire_data.sort(key=lambda x: x.get('price', 0), reverse=True)
+        server_timing.lap("filter")
         
         # Extract warehouse data
         warehouses = []
@@ -278,14 +333,18 @@ async def search_tires(
                     "brand": brand,
                     "city": city
                 },
-                "result_count": len(tire_data),
+                "result_count": total_count,
                 "timestamp": datetime.now(timezone.utc).isoformat()
             }
-            await db.activity_logs.insert_one(activity_log)
+            await record_activity(db, activity_log)
+        server_timing.lap("activity_log")
         
         return {
             "success": True,
             "data": tire_data,
+            "total_count": total_count,
+            "filtered_count": len(tire_data),
+            "facets": facets,
             "total_pages": response.get('totalPages', 0),
             "warehouses": warehouses,
             "currency": response.get('currencyRate', {}),
@@ -299,7 +358,134 @@ async def search_tires(
         logger.error(f"Error searching tires: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to search tires: {str(e)}")
 
+@router.post("/tires/search/batch")
+async def search_tires_batch(
+    request: TireBatchSearch,
+    http_request: Request,
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    client: Optional[FourthchkiClient] = Depends(get_fourthchki)
+):
+    """
+    Поиск шин сразу по нескольким размерам (разноширокая установка, альтернативные размеры)
+    Запросы к поставщику выполняются параллельно (не больше TIRE_BATCH_CONCURRENCY одновременно)
+    и проходят через кэш поиска; бюджет поставщика (services/rate_limiter.py) списывается
+    за каждый уникальный размер как за отдельный поиск. Товары отдаются один раз - в data, общим списком без дублей;
+    groups содержат по размеру только коды товаров (codes) в порядке сортировки и их число
+    """
+    try:
+        # Повторяющиеся размеры запрашиваем один раз, порядок сохраняем
+        sizes = list(dict.fromkeys((size.width, size.height, size.diameter) for size in request.sizes))
+        if len(sizes) > TIRE_BATCH_MAX_SIZES:
+            raise HTTPException(status_code=400, detail=f"Не больше {TIRE_BATCH_MAX_SIZES} размеров за запрос")
+        await charge_supplier_budget(http_request, len(sizes) * search_cost())
+
+        markup_settings = await get_markup_settings(db)
+        studded_filter = get_studded_filter(request.season)
+        semaphore = asyncio.Semaphore(TIRE_BATCH_CONCURRENCY)
+
+        async def search_size(width: int, height: int, diameter: int) -> dict:
+            group = {
+                "size": {"width": width, "height": height, "diameter": diameter},
+                "label": f"{width}/{height}R{diameter}",
+            }
+            search_params = tire_search_params(
+                width=width,
+                height=height,
+                diameter=diameter,
+                season=request.season,
+                brand=request.brand,
+            )
+            try:
+                async with semaphore:
+                    if use_mock_data():
+                        response = generate_mock_tires(
+                            season=search_params['season_list'],
+                            width=width,
+                            height=height,
+                            diameter=diameter,
+                            brand=request.brand,
+                            page=search_params['page'],
+                            page_size=search_params['page_size']
+                        )
+                    else:
+                        response = await get_supplier_cache().search_tires(client, search_params)
+
+                error = response.get('error')
+                if error and (error.get('code') or error.get('comment') or error.get('Message')):
+                    raise ValueError(error.get('Message') or error.get('comment') or f"Error code: {error.get('code')}")
+
+                group["data"] = prepare_tire_items(response, request.city, studded_filter, markup_settings)
+            except Exception as e:
+                # Ошибка одного размера не должна ронять весь поиск
+                logger.warning(f"Batch tire search failed for {group['label']}: {e}")
+                group["data"] = []
+                group["error"] = str(e)
+            group["count"] = len(group["data"])
+            return group
+
+        groups = await asyncio.gather(*(search_size(*size) for size in sizes))
+
+        merged = []
+        seen_codes = set()
+        for group in groups:
+            if request.sort_by == 'price_asc':
+                group["data"].sort(key=lambda x: x.get('price', 0))
+            elif request.sort_by == 'price_desc':
+                group["data"].sort(key=lambda x: x.get('price', 0), reverse=True)
+            for item in group["data"]:
+                code = item.get('code')
+                if code is not None and code in seen_codes:
+                    continue
+                seen_codes.add(code)
+                merged.append(item)
+            # Сами товары - только в общем списке data
+            group["codes"] = [item.get('code') for item in group.pop("data")]
+
+        if request.sort_by == 'price_asc':
+            merged.sort(key=lambda x: x.get('price', 0))
+        elif request.sort_by == 'price_desc':
+            merged.sort(key=lambda x: x.get('price', 0), reverse=True)
+
+        # Логируем каждый размер как отдельный поиск шин - они попадают в аналитику и прогрев кэша
+        if request.telegram_id:
+            telegram_id = request.telegram_id
+            user = await db.users.find_one({"telegram_id": telegram_id})
+            user_display = None
+            if user:
+                user_display = user.get("username") or user.get("first_name") or f"User_{telegram_id[-4:]}"
+            for group in groups:
+                await record_activity(db, {
+                    "telegram_id": telegram_id,
+                    "username": user_display,
+                    "activity_type": "tire_search",
+                    "search_params": {
+                        **group["size"],
+                        "season": request.season,
+                        "brand": request.brand,
+                        "city": request.city,
+                        "batch": True
+                    },
+                    "result_count": group["count"],
+                    "timestamp": datetime.now(timezone.utc).isoformat()
+                })
+
+        return {
+            "success": True,
+            "groups": groups,
+            "data": merged,
+            "total_count": len(merged),
+            "markup_percentage": await get_markup_percentage(db),
+            "mock_mode": use_mock_data()
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in batch tire search: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to search tires: {str(e)}")
+
 @router.get("/disks/search")
+@server_timing.timed_endpoint
 async def search_disks(
     diameter: Optional[int] = Query(None, description="Диаметр (например, 15)"),
     width: Optional[float] = Query(None, description="Ширина обода (например, 6.5)"),
@@ -316,13 +502,21 @@ async def search_disks(
     page: int = Query(0, ge=0, description="Номер страницы"),
     page_size: int = Query(2000, ge=1, le=2000, description="Размер страницы"),
     telegram_id: Optional[str] = Query(None, description="Telegram ID пользователя для логирования"),
-    db: AsyncIOMotorDatabase = Depends(get_db)
+    brands: Optional[List[str]] = Query(None, description="Уточнение: бренды (можно несколько)"),
+    colors: Optional[List[str]] = Query(None, description="Уточнение: цвета"),
+    pcds: Optional[List[str]] = Query(None, description="Уточнение: разболтовки"),
+    price_min: Optional[float] = Query(None, ge=0, description="Уточнение: цена от"),
+    price_max: Optional[float] = Query(None, ge=0, description="Уточнение: цена до"),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    client: Optional[FourthchkiClient] = Depends(get_fourthchki)
 ):
     """
     Поиск дисков по параметрам
+    Фасеты считаются по базовому результату, уточняющие фильтры применяются после
     """
     try:
         markup_settings = await get_markup_settings(db)
+        server_timing.lap("markup")
         
         if use_mock_data():
             logger.info("Using MOCK data for disks search")
@@ -334,40 +528,22 @@ async def search_disks(
                 page_size=page_size
             )
         else:
-            client = get_fourthchki_client()
-            brand_list = [brand] if brand else None
-            color_list = [color] if color else None
-            type_list = [disk_type] if disk_type is not None else None
-            
-            # Parse PCD (e.g., "5x114.3" -> bolts_count=5, bolts_spacing=114.3)
-            bolts_count = None
-            bolts_spacing = None
-            if pcd:
-                import re
-                pcd_match = re.match(r'(\d+)x([\d.]+)', pcd)
-                if pcd_match:
-                    bolts_count = int(pcd_match.group(1))
-                    bolts_spacing = float(pcd_match.group(2))
-            
-            response = client.search_disks(
-                diameter_min=diameter,
-                diameter_max=diameter,
-                width_min=width,
-                width_max=width,
-                brand_list=brand_list,
-                bolts_count_min=bolts_count,
-                bolts_count_max=bolts_count,
-                bolts_spacing_min=bolts_spacing,
-                bolts_spacing_max=bolts_spacing,
+            search_params = disk_search_params(
+                diameter=diameter,
+                width=width,
+                brand=brand,
+                pcd=pcd,
                 et_min=et_min,
                 et_max=et_max,
                 dia_min=dia_min,
                 dia_max=dia_max,
-                color_list=color_list,
-                type_list=type_list,
+                color=color,
+                disk_type=disk_type,
                 page=page,
                 page_size=page_size
             )
+            response = await get_supplier_cache().search_disks(client, search_params)
+        server_timing.lap("supplier")
         
         # Check if there's a meaningful error (not just empty error structure)
         error = response.get('error')
@@ -386,33 +562,15 @@ async def search_disks(
         elif isinstance(price_rest_list, list):
             disk_data = price_rest_list
         
-        # Маппинг городов к ID складов (склады с logistDays=0, самовывоз)
-        # Для региональных городов включены все склады региона
-        CITY_WAREHOUSES = {
-            'Тюмень': [42],  # Только основной склад Тюмень
-            '🏪 Тюмень': [42],  # С эмодзи
-            'Сургут': [1882, 525, 1948, 1131, 1456, 1694],  # Все склады Сургута
-            'Лянтор': [1477, 1212, 1824, 459, 1997, 1882, 525, 1948, 1131, 1456, 1694],  # Лянтор + Нефтеюганск + Белый Яр + Сургут (весь регион)
-            '🏪 Лянтор': [1477, 1212, 1824, 459, 1997, 1882, 525, 1948, 1131, 1456, 1694],  # С эмодзи
-            'Нефтеюганск': [1212, 459, 1824],  # Все склады Нефтеюганска
-            'Белый Яр': [1997],  # Белый Яр
-            'Екатеринбург': [1431],  # Екатеринбург
-            '🚚 Екатеринбург': [1431],  # С эмодзи
-            'Челябинск': [2017],  # Челябинск
-            '🚚 Челябинск': [2017],  # С эмодзи
-            'Москва': [1, 232],  # Москва
-            '🚚 Москва': [1, 232],  # С эмодзи
-            'Санкт-Петербург': [1655],  # Санкт-Петербург
-            '🚚 Санкт-Петербург': [1655]  # С эмодзи
-        }
-        TYUMEN_WAREHOUSE_ID = 42  # ID склада Тюмень по умолчанию
-        
         # Определяем приоритетные склады на основе выбранного города
         priority_warehouses = CITY_WAREHOUSES.get(city, [TYUMEN_WAREHOUSE_ID]) if city else [TYUMEN_WAREHOUSE_ID]
         
         filtered_disk_data = []
         
         for item in disk_data:
+            # Копия - ответ поставщика лежит в кэше и используется другими запросами
+            item = dict(item)
+            
             # Parse disk size from name (e.g., "7x16 5x114.3 ET45 DIA60.1")
             import re
             name = item.get('name', '')
@@ -489,12 +647,31 @@ async def search_disks(
         
         # Заменяем disk_data на отфильтрованный список
         disk_data = filtered_disk_data
+        total_count = len(disk_data)
+        server_timing.lap("parse")
+        
+        # Фасеты базового запроса (без уточняющих фильтров) кэшируются
+        facets = await get_facet_cache().get_facets(
+            facet_key("disks", diameter, width, brand, pcd, et_min, et_max, dia_min, dia_max, color,
+                      disk_type, city, page, page_size, markup_settings, use_mock_data()),
+            disk_data,
+            DISK_FACETS,
+        )
+        server_timing.lap("facets")
+        disk_data = SearchFilters(
+            brands=brands,
+            colors=colors,
+            pcds=pcds,
+            price_min=price_min,
+            price_max=price_max,
+        ).apply(disk_data)
         
         # Сортировка по цене
         if sort_by == 'price_asc':
             disk_data.sort(key=lambda x: x.get('price', 0))
         elif sort_by == 'price_desc':
             disk_data.sort(key=lambda x: x.get('price', 0), reverse=True)
+        server_timing.lap("filter")
         
         # Extract warehouse data
         warehouses = []
@@ -529,14 +706,18 @@ async def search_disks(
                     "disk_type": disk_type,
                     "city": city
                 },
-                "result_count": len(disk_data),
+                "result_count": total_count,
                 "timestamp": datetime.now(timezone.utc).isoformat()
             }
-            await db.activity_logs.insert_one(activity_log)
+            await record_activity(db, activity_log)
+        server_timing.lap("activity_log")
         
         return {
             "success": True,
             "data": disk_data,
+            "total_count": total_count,
+            "filtered_count": len(disk_data),
+            "facets": facets,
             "total_pages": response.get('totalPages', 0),
             "warehouses": warehouses,
             "currency": response.get('currencyRate', {}),
@@ -553,7 +734,8 @@ async def search_disks(
 @router.get("/info/{code}")
 async def get_product_info(
     code: str,
-    db: AsyncIOMotorDatabase = Depends(get_db)
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    client: Optional[FourthchkiClient] = Depends(get_fourthchki)
 ):
     """
     Получить подробную информацию о товаре по коду
@@ -577,8 +759,8 @@ async def get_product_info(
                 "mock_mode": True
             }
         
-        client = get_fourthchki_client()
-        response = client.get_goods_info(code)
+        # Копия - ответ поставщика лежит в кэше, а ниже в нем меняется цена
+        response = dict(await get_supplier_cache().call(client, 'get_goods_info', {'code': code}))
         
         # Check if there's a meaningful error (not just empty error structure)
         error = response.get('error')
@@ -605,7 +787,9 @@ async def get_product_info(
         raise HTTPException(status_code=500, detail=f"Failed to get product info: {str(e)}")
 
 @router.get("/warehouses")
-async def get_warehouses():
+async def get_warehouses(
+    client: Optional[FourthchkiClient] = Depends(get_fourthchki)
+):
     """
     Получить список доступных складов
     """
@@ -617,8 +801,7 @@ async def get_warehouses():
                 "mock_mode": True
             }
         
-        client = get_fourthchki_client()
-        response = client.get_warehouses()
+        response = await get_supplier_cache().call(client, 'get_warehouses')
         
         # Check if there's a meaningful error (not just empty error structure)
         error = response.get('error')
@@ -645,12 +828,13 @@ async def get_tire_brands(
 ):
     """
     Получить список брендов шин
-    Возвращает статический список брендов с сайта 4tochki.ru
+    Отдается из индекса брендов в памяти (до его построения - статический список)
     """
+    result = get_brand_index().get_brands('tyre')
     return {
         "success": True,
-        "brands": TIRE_BRANDS,
-        "total": len(TIRE_BRANDS)
+        **result,
+        "total": len(result["brands"])
     }
 
 @router.get("/brands/disks")
@@ -659,11 +843,12 @@ async def get_disk_brands(
 ):
     """
     Получить список брендов дисков
-    Возвращает статический список брендов с сайта 4tochki.ru
+    Отдается из индекса брендов в памяти (до его построения - статический список)
     """
+    result = get_brand_index().get_brands('disk')
     return {
         "success": True,
-        "brands": DISK_BRANDS,
-        "total": len(DISK_BRANDS)
+        **result,
+        "total": len(result["brands"])
     }
 
@@ -0,0 +1,42 @@
+from fastapi import APIRouter, HTTPException, Request, Header, Depends
+from typing import Optional
+import logging
+
+from services.telegram_bot import TelegramNotifier
+from dependencies import get_notifier
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/telegram", tags=["telegram"])
+
+@router.post("/webhook")
+async def telegram_webhook(
+    request: Request,
+    x_telegram_bot_api_secret_token: Optional[str] = Header(None),
+    telegram_notifier: TelegramNotifier = Depends(get_notifier)
+):
+    """
+    Прием обновлений от Telegram в режиме TELEGRAM_BOT_MODE=webhook
+    Обновление только ставится в очередь Application - отвечаем Telegram сразу
+    """
+    if not telegram_notifier.check_webhook_secret(x_telegram_bot_api_secret_token):
+        logger.warning("Telegram webhook request with invalid secret token")
+        raise HTTPException(status_code=403, detail="Invalid secret token")
+    
+    try:
+        data = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid update payload")
+    
+    try:
+        accepted = await telegram_notifier.process_webhook_update(data)
+    except Exception as e:
+        # Битое обновление не должно возвращаться Telegram повторно - подтверждаем и логируем
+        logger.error(f"Error processing Telegram webhook update: {e}")
+        return {"ok": False}
+    
+    if not accepted:
+        # Бот еще не запущен - пусть Telegram повторит доставку позже
+        raise HTTPException(status_code=503, detail="Bot is not ready")
+    
+    return {"ok": True}
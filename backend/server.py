@@ -1,28 +1,52 @@
-from fastapi import FastAPI, APIRouter, Request, HTTPException
+from fastapi import FastAPI, APIRouter, Request, HTTPException, Depends
+from fastapi.responses import PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from contextlib import asynccontextmanager
+from typing import Optional
 import os
+import hmac
+import math
+import time
 import logging
 from pathlib import Path
 
-# Import routers
-from routers import auth, products, cars, orders, admin, cart
-
 ROOT_DIR = Path(__file__).parent
+# .env загружаем до импорта роутеров и сервисов - они читают настройки при импорте
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Import routers
+from routers import auth, products, cars, orders, admin, cart, telegram
+from dependencies import AppResources, create_resources, close_resources, get_db, get_session, use_mock_data
+from services.supplier_cache import track_request_freshness, all_caches
+from services import rate_limiter
+from services.rate_limiter import get_rate_limiter
+from services import metrics
+from utils import server_timing
+from services.profiler import get_profiler
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Жизненный цикл воркера: пул MongoDB, WSDL поставщика и бот создаются до первого запроса
+    (после fork - при запуске через gunicorn у каждого воркера свои ресурсы)
+    """
+    resources = await create_resources()
+    app.state.resources = resources
+    await startup_event(resources)
+    try:
+        yield
+    finally:
+        await shutdown_db_client(resources)
 
 # Create the main app without a prefix
 app = FastAPI(
     title="Tires Shop API",
     description="API for tire and disk shop with Telegram Mini App",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Create a router with the /api prefix
@@ -38,7 +62,7 @@ async def root():
     }
 
 @api_router.get("/health")
-async def health_check():
+async def health_check(db: AsyncIOMotorDatabase = Depends(get_db)):
     """Health check endpoint"""
     try:
         # Test MongoDB connection
@@ -54,6 +78,44 @@ async def health_check():
             "error": str(e)
         }
 
+@api_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(request: Request):
+    """Метрики воркера в текстовом формате Prometheus"""
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    # Без METRICS_TOKEN метрики закрыты: они раскрывают трафик по маршрутам и очередь уведомлений
+    authorization = request.headers.get("authorization") or ""
+    if not metrics.METRICS_TOKEN or not hmac.compare_digest(authorization, f"Bearer {metrics.METRICS_TOKEN}"):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    lines = metrics.render_registry()
+
+    cache_requests = {}
+    cache_entries = {}
+    for cache in all_caches():
+        stats = cache.get_stats()
+        for result in ("hits", "stale", "coalesced", "misses", "bypass", "errors"):
+            cache_requests[(stats["name"], result)] = stats[result]
+        cache_entries[(stats["name"],)] = stats["entries"]
+    lines += metrics.render_samples(
+        "supplier_cache_requests_total", "counter", "Запросы к кэшам поставщика по результату",
+        ("cache", "result"), cache_requests
+    )
+    lines += metrics.render_samples(
+        "supplier_cache_entries", "gauge", "Записей в кэшах поставщика", ("cache",), cache_entries
+    )
+
+    try:
+        outbox = await request.app.state.resources.notifier.get_outbox_stats()
+        lines += metrics.render_samples(
+            "telegram_outbox_messages", "gauge", "Сообщения в очереди отправки бота по статусу",
+            ("status",), {(status,): count for status, count in outbox.items()}
+        )
+    except Exception as e:
+        logger.error(f"Error reading outbox stats for metrics: {e}")
+
+    return PlainTextResponse("\n".join(lines) + "\n", media_type=metrics.CONTENT_TYPE)
+
 # Include routers
 api_router.include_router(auth.router)
 api_router.include_router(products.router)
@@ -61,6 +123,7 @@ api_router.include_router(cars.router)
 api_router.include_router(orders.router)
 api_router.include_router(admin.router)
 api_router.include_router(cart.router)
+api_router.include_router(telegram.router)
 
 # Middleware для проверки блокировки пользователей
 from fastapi.responses import JSONResponse
@@ -68,7 +131,7 @@ from fastapi.responses import JSONResponse
 class BlockedUserMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
         # Пропускаем проверку для определенных путей
-        excluded_paths = ["/api/", "/api/health", "/api/auth/telegram", "/api/auth/me"]
+        excluded_paths = ["/api/", "/api/health", "/api/auth/telegram", "/api/auth/session", "/api/auth/me"]
         if request.url.path in excluded_paths or request.url.path == "/api":
             return await call_next(request)
         
@@ -76,7 +139,18 @@ class BlockedUserMiddleware(BaseHTTPMiddleware):
         telegram_id = request.query_params.get("telegram_id")
         
         if telegram_id and telegram_id != "None":
+            # Токен сессии этого пользователя уже содержит флаг блокировки - без запроса к базе
+            session = get_session(request)
+            if session and session["sub"] == telegram_id:
+                if session.get("blk"):
+                    return JSONResponse(
+                        status_code=403,
+                        content={"detail": "Слишком много запросов, подождите еще и вернитесь не скоро"}
+                    )
+                return await call_next(request)
+            
             try:
+                db = request.app.state.resources.db
                 user = await db.users.find_one({"telegram_id": telegram_id})
                 if user and user.get("is_blocked"):
                     return JSONResponse(
@@ -88,16 +162,120 @@ class BlockedUserMiddleware(BaseHTTPMiddleware):
         
         return await call_next(request)
 
+class RateLimitMiddleware(BaseHTTPMiddleware):
+    """
+    Token bucket на IP и telegram_id (services/rate_limiter.py), отдельный бюджет
+    для запросов к поставщику. Сверх лимита - 429 с Retry-After
+    """
+    async def dispatch(self, request: Request, call_next):
+        path = request.url.path
+        if request.method == "OPTIONS" or not path.startswith("/api") or path in rate_limiter.EXEMPT_PATHS:
+            return await call_next(request)
+
+        ip = request.client.host if request.client else None
+        session = get_session(request)
+        if session:
+            user_key = session["sub"]
+        else:
+            # telegram_id без токена не проверен - считаем его вместе с IP,
+            # чтобы чужой ID не расходовал бюджет настоящего пользователя
+            telegram_id = request.query_params.get("telegram_id")
+            user_key = f"{telegram_id}@{ip}" if telegram_id and telegram_id != "None" else None
+
+        client = rate_limiter.RateLimitClient(ip, user_key, exempt_user=bool(session and session.get("adm")))
+        # Эндпоинты, чья стоимость зависит от тела, досписывают бюджет поставщика по этим ключам
+        request.state.rate_limit_client = client
+
+        resources = getattr(request.app.state, "resources", None)
+        retry_after = await get_rate_limiter().check(
+            resources.db if resources else None,
+            client.ip,
+            client.user_key,
+            supplier_cost=rate_limiter.request_cost(path, request.query_params),
+            exempt_user=client.exempt_user,
+        )
+        if retry_after > 0:
+            seconds = max(1, math.ceil(retry_after))
+            logger.debug(f"Rate limit exceeded: {path} ip={ip} user={user_key}, retry in {seconds}s")
+            return JSONResponse(
+                status_code=429,
+                content={"detail": f"Слишком много запросов, повторите через {seconds} сек."},
+                headers={"Retry-After": str(seconds)}
+            )
+        return await call_next(request)
+
+class MetricsMiddleware(BaseHTTPMiddleware):
+    """Длительность и статус запросов по шаблону маршрута (services/metrics.py)"""
+    async def dispatch(self, request: Request, call_next):
+        started = time.perf_counter()
+        response = await call_next(request)
+        # Маршрут определяется при роутинге внутри call_next; без него - 404 или ответ middleware
+        route = request.scope.get("route")
+        path = route.path if route else "unmatched"
+        metrics.HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, request.method, path)
+        metrics.HTTP_REQUESTS.inc(request.method, path, str(response.status_code))
+        return response
+
+class ServerTimingMiddleware(BaseHTTPMiddleware):
+    """Заголовок Server-Timing с фазами запроса (utils/server_timing.py) и, по настройке, строка в логе"""
+    async def dispatch(self, request: Request, call_next):
+        timings = server_timing.begin_request()
+        response = await call_next(request)
+        total = timings.finish()
+        response.headers["Server-Timing"] = timings.header_value(total)
+        if server_timing.SERVER_TIMING_LOG:
+            timings.log(request.method, request.url.path, response.status_code, total)
+        return response
+
+class ProfiledRequestsMiddleware:
+    """
+    Счет запросов для замера "следующие N запросов" (services/profiler.py)
+    Чистый ASGI: пока замер не идет, запрос проходит без обертки
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # Сам запрос замера (и отказ в параллельном замере) не считаем
+        if scope["type"] != "http" or not get_profiler().busy or scope["path"] == "/api/admin/profile":
+            return await self.app(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            get_profiler().request_finished()
+
+class SupplierFreshnessMiddleware(BaseHTTPMiddleware):
+    """
+    Age и X-Cache для ответов с данными поставщика (насколько они свежие)
+    Запрос с Cache-Control: no-cache получает данные от поставщика в обход кэша
+    """
+    async def dispatch(self, request: Request, call_next):
+        no_cache = 'no-cache' in request.headers.get('cache-control', '').lower()
+        freshness = track_request_freshness(fresh_required=no_cache)
+        response = await call_next(request)
+        response.headers.update(freshness.headers())
+        return response
+
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(SupplierFreshnessMiddleware)
+app.add_middleware(ProfiledRequestsMiddleware)
 app.add_middleware(BlockedUserMiddleware)
+# Лимит проверяется до блокировки - лишние запросы не доходят до базы
+if rate_limiter.RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware)
+if metrics.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+if server_timing.SERVER_TIMING_ENABLED:
+    app.add_middleware(ServerTimingMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Age", "X-Cache", "Retry-After", "Server-Timing"],
 )
 
 # Configure logging
@@ -108,12 +286,58 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Import Telegram notifier
-from services.telegram_bot import get_telegram_notifier
+from services.telegram_bot import BOT_MODE_POLLING, BOT_MODE_WEBHOOK
+from services.leader_lease import LeaderLease
+from services import search_analytics
+from services import broadcast
+from services.broadcast import get_broadcast_runner
+from services.cache_prewarm import get_cache_prewarmer
+from services.brand_index import get_brand_index
+from services import date_migration
+from services import idempotency
+from services import supplier_orders
+from services.supplier_orders import get_supplier_order_worker
+
+# Аренда лидера для фоновых задач, которые должны работать в одном воркере
+BACKGROUND_JOBS_LEASE = "background-jobs"
+leader_lease: Optional[LeaderLease] = None
+
+async def start_leader_jobs(resources: AppResources):
+    """Лидер: polling бота или регистрация webhook, отправка outbox, рассылки, индекс брендов, миграции и заказы у поставщика"""
+    telegram_notifier = resources.notifier
+    if telegram_notifier.bot_mode == BOT_MODE_POLLING:
+        await telegram_notifier.start_bot_polling()
+    elif telegram_notifier.bot_mode == BOT_MODE_WEBHOOK:
+        # Регистрация webhook с текущими URL и секретом (после их смены - тоже)
+        await telegram_notifier.register_webhook()
+    # Фоновая отправка уведомлений из очереди notification_outbox
+    await telegram_notifier.start_outbox_dispatcher()
+    # Продолжаем рассылки, прерванные перезапуском, и подхватываем новые
+    await get_broadcast_runner().enable(resources.db)
+    # Перевод старых дат заказов и пользователей из строк в BSON datetime
+    date_migration.start_date_migration(resources.db)
+    # Ежедневное построение индекса брендов по каталогу поставщика
+    if not use_mock_data():
+        get_brand_index().start_refresh(resources.db, resources.load_fourthchki)
+    # Заказ подтвержденных заказов у поставщика и опрос их статусов
+    if supplier_orders.SUPPLIER_ORDERS_ENABLED and not use_mock_data():
+        get_supplier_order_worker().start(resources.db, resources.load_fourthchki, resources.notifier)
 
-@app.on_event("startup")
-async def startup_event():
+async def stop_leader_jobs(resources: AppResources):
+    telegram_notifier = resources.notifier
+    await get_supplier_order_worker().stop()
+    await get_brand_index().stop_refresh()
+    await date_migration.stop_date_migration()
+    await get_broadcast_runner().disable()
+    await telegram_notifier.stop_outbox_dispatcher()
+    if telegram_notifier.bot_mode == BOT_MODE_POLLING:
+        await telegram_notifier.stop_bot_polling()
+
+async def startup_event(resources: AppResources):
     """Запуск приложения - инициализация Telegram бота и БД"""
+    global leader_lease
     logger.info("Starting up application...")
+    db = resources.db
     
     # Создаем уникальный индекс на telegram_id для предотвращения дубликатов
     try:
@@ -122,15 +346,81 @@ async def startup_event():
     except Exception as e:
         logger.warning(f"Index creation warning (may already exist): {e}")
     
-    telegram_notifier = get_telegram_notifier()
-    await telegram_notifier.start_bot_polling()
+    # Уникальный индекс на order_id - защита от дубликатов номеров заказов
+    try:
+        await db.orders.create_index("order_id", unique=True)
+        logger.info("✅ Unique index on orders.order_id created/verified")
+    except Exception as e:
+        logger.warning(f"Order index creation warning (check for duplicate order_id): {e}")
+    
+    # Индексы для агрегатов аналитики поиска
+    try:
+        await search_analytics.ensure_indexes(db)
+    except Exception as e:
+        logger.warning(f"Analytics index creation warning: {e}")
+    
+    try:
+        await broadcast.ensure_indexes(db)
+    except Exception as e:
+        logger.warning(f"Broadcast index creation warning: {e}")
+    
+    # TTL индекс ключей идемпотентности
+    try:
+        await idempotency.ensure_indexes(db)
+    except Exception as e:
+        logger.warning(f"Idempotency index creation warning: {e}")
+    
+    try:
+        await supplier_orders.ensure_indexes(db)
+    except Exception as e:
+        logger.warning(f"Supplier order index creation warning: {e}")
+
+    # TTL индекс общих бакетов лимита запросов
+    if rate_limiter.RATE_LIMIT_BACKEND == rate_limiter.BACKEND_MONGO:
+        try:
+            await rate_limiter.ensure_indexes(db)
+        except Exception as e:
+            logger.warning(f"Rate limit index creation warning: {e}")
+
+    # Индексы заказов по дате создания
+    try:
+        await date_migration.ensure_indexes(db)
+    except Exception as e:
+        logger.warning(f"Order date index creation warning: {e}")
+    
+    telegram_notifier = resources.notifier
+    # В режиме webhook обновления может принять любой воркер
+    if telegram_notifier.bot_mode == BOT_MODE_WEBHOOK:
+        await telegram_notifier.start_bot()
+    
+    # Polling, outbox и рассылки - только в воркере-лидере
+    leader_lease = LeaderLease(db, BACKGROUND_JOBS_LEASE)
+    leader_lease.on_acquired(lambda: start_leader_jobs(resources))
+    leader_lease.on_lost(lambda: stop_leader_jobs(resources))
+    await leader_lease.start()
+    
+    # Индекс брендов каждый воркер держит в памяти
+    await get_brand_index().start(db)
+
+    if metrics.METRICS_ENABLED:
+        metrics.get_loop_lag_monitor().start()
+    
+    # Кэш поставщика у каждого воркера свой - прогреваем в каждом
+    if not use_mock_data():
+        get_cache_prewarmer().start(db, resources.load_fourthchki)
     logger.info("Application startup complete")
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
+async def shutdown_db_client(resources: AppResources):
     """Остановка приложения - закрытие соединений"""
     logger.info("Shutting down application...")
-    telegram_notifier = get_telegram_notifier()
-    await telegram_notifier.stop_bot_polling()
-    client.close()
-    logger.info("Application shutdown complete")
\ No newline at end of file
+    telegram_notifier = resources.notifier
+    await get_cache_prewarmer().stop()
+    await get_brand_index().stop()
+    await search_analytics.stop_rebuild()
+    await metrics.get_loop_lag_monitor().stop()
+    if leader_lease:
+        await leader_lease.stop()
+    if telegram_notifier.bot_mode == BOT_MODE_WEBHOOK:
+        await telegram_notifier.stop_bot()
+    await close_resources(resources)
+    logger.info("Application shutdown complete")
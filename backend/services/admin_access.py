@@ -0,0 +1,71 @@
+"""
+Проверка доступа к админским эндпоинтам без запроса к базе
+
+Множество telegram_id админов (users.is_admin) хранится в памяти воркера и
+перечитывается из базы не чаще раза в ADMIN_CACHE_RELOAD_SECONDS. ID, которого
+нет в множестве, проверяется по базе - новый админ получает доступ сразу;
+снятие флага is_admin вступает в силу после следующей перезагрузки множества
+(не позже ADMIN_CACHE_RELOAD_SECONDS). Приложение флаг не меняет - он задается
+при создании пользователя (ADMIN_TELEGRAM_ID) или вручную в базе, поэтому
+множество обновляется только перезагрузкой, а не по событию изменения
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Optional, Set
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+logger = logging.getLogger(__name__)
+
+ADMIN_CACHE_RELOAD_SECONDS = int(os.environ.get('ADMIN_CACHE_RELOAD_SECONDS', '30'))
+
+
+class AdminRegistry:
+    """ID админов в памяти воркера"""
+
+    def __init__(self, reload_seconds: int = ADMIN_CACHE_RELOAD_SECONDS):
+        self.reload_seconds = reload_seconds
+        self.admin_ids: Set[str] = set()
+        self.loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    def _is_stale(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at >= self.reload_seconds
+
+    async def reload(self, db: AsyncIOMotorDatabase):
+        """Перечитать ID админов (одновременные вызовы ждут одну загрузку)"""
+        async with self._lock:
+            if not self._is_stale():
+                return
+            cursor = db.users.find({"is_admin": True}, {"_id": 0, "telegram_id": 1})
+            self.admin_ids = {doc["telegram_id"] async for doc in cursor}
+            self.loaded_at = time.monotonic()
+
+    def add(self, telegram_id: str):
+        self.admin_ids.add(telegram_id)
+
+    async def is_admin(self, db: AsyncIOMotorDatabase, telegram_id: str) -> bool:
+        if self._is_stale():
+            await self.reload(db)
+        if telegram_id in self.admin_ids:
+            return True
+
+        # Админ мог появиться после загрузки (в том числе в другом воркере)
+        if await db.users.find_one({"telegram_id": telegram_id, "is_admin": True}, {"_id": 1}):
+            self.add(telegram_id)
+            return True
+        return False
+
+
+# Singleton instance
+admin_registry = None
+
+
+def get_admin_registry() -> AdminRegistry:
+    global admin_registry
+    if admin_registry is None:
+        admin_registry = AdminRegistry()
+    return admin_registry
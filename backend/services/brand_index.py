@@ -0,0 +1,250 @@
+"""
+Индекс брендов шин и дисков
+
+Список брендов строится полным постраничным обходом каталога поставщика
+(GetFindTyre / GetFindDisk без фильтров, страницы запрашиваются параллельно)
+и сохраняется в MongoDB (brand_index). Перестраивает индекс воркер-лидер раз
+в BRAND_INDEX_REFRESH_HOURS часов, остальные воркеры перечитывают его из базы
+и отдают из памяти - запрос списка брендов не обращается ни к поставщику, ни к базе.
+Пока индекс не построен, используются статические списки из brands_data
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from services.brands_data import DISK_BRANDS, TIRE_BRANDS
+from services.fourthchki_client import FourthchkiClient
+
+logger = logging.getLogger(__name__)
+
+INDEX_COLLECTION = "brand_index"
+
+BRAND_INDEX_REFRESH_HOURS = float(os.environ.get('BRAND_INDEX_REFRESH_HOURS', '24'))
+# Как часто воркеры перечитывают индекс из базы
+BRAND_INDEX_RELOAD_SECONDS = int(os.environ.get('BRAND_INDEX_RELOAD_SECONDS', '600'))
+BRAND_INDEX_PAGE_SIZE = int(os.environ.get('BRAND_INDEX_PAGE_SIZE', '2000'))
+BRAND_INDEX_MAX_PAGES = int(os.environ.get('BRAND_INDEX_MAX_PAGES', '200'))
+# Параллельных запросов страниц к поставщику
+BRAND_INDEX_CONCURRENCY = int(os.environ.get('BRAND_INDEX_CONCURRENCY', '4'))
+# Повтор после неудачного построения
+BRAND_INDEX_RETRY_SECONDS = int(os.environ.get('BRAND_INDEX_RETRY_SECONDS', '3600'))
+
+# Первый пункт списка в Mini App - "без фильтра по бренду"
+ANY_BRAND = "Любой"
+
+STATIC_BRANDS = {'tyre': TIRE_BRANDS, 'disk': DISK_BRANDS}
+
+# Метод клиента и ключ списка товаров в ответе
+_SCAN_METHODS = {
+    'tyre': ('search_tires', 'TyrePriceRest'),
+    'disk': ('search_disks', 'DiskPriceRest'),
+}
+
+
+def _extract_items(response: Dict, key: str) -> List[Dict]:
+    price_rest_list = response.get('price_rest_list', {})
+    if isinstance(price_rest_list, dict) and key in price_rest_list:
+        items = price_rest_list[key]
+        return [items] if isinstance(items, dict) else items or []
+    if isinstance(price_rest_list, list):
+        return price_rest_list
+    return []
+
+
+async def scan_brands(
+    client: FourthchkiClient,
+    product_type: str,
+    semaphore: Optional[asyncio.Semaphore] = None,
+) -> Dict[str, Any]:
+    """
+    Обойти весь каталог товаров одного типа и посчитать товары по брендам
+    Первая страница дает totalPages, остальные запрашиваются параллельно
+    """
+    method_name, key = _SCAN_METHODS[product_type]
+    method = getattr(client, method_name)
+    semaphore = semaphore or asyncio.Semaphore(BRAND_INDEX_CONCURRENCY)
+
+    async def fetch_page(page: int) -> Dict:
+        async with semaphore:
+            # zeep блокирующий - вызываем в отдельном потоке
+            return await asyncio.to_thread(method, page=page, page_size=BRAND_INDEX_PAGE_SIZE)
+
+    first = await fetch_page(0)
+    total_pages = min(int(first.get('totalPages') or 1), BRAND_INDEX_MAX_PAGES)
+    if first.get('totalPages') and int(first['totalPages']) > BRAND_INDEX_MAX_PAGES:
+        logger.warning(
+            f"Brand index {product_type}: {first['totalPages']} pages, scanning first {BRAND_INDEX_MAX_PAGES}"
+        )
+
+    # Ошибка одной страницы прерывает построение - неполный индекс не сохраняем
+    rest = await asyncio.gather(*(fetch_page(page) for page in range(1, total_pages)))
+
+    counts: Dict[str, int] = {}
+    items_scanned = 0
+    for response in [first, *rest]:
+        for item in _extract_items(response, key):
+            items_scanned += 1
+            brand = (item.get('brand') or item.get('marka') or '').strip()
+            if brand:
+                counts[brand] = counts.get(brand, 0) + 1
+
+    return {
+        "brands": sorted(counts, key=str.lower),
+        "counts": counts,
+        "pages_scanned": total_pages,
+        "items_scanned": items_scanned,
+    }
+
+
+class BrandIndex:
+    """Индекс брендов в памяти воркера"""
+
+    def __init__(self):
+        self.brands: Dict[str, List[str]] = {}
+        self.updated_at: Dict[str, str] = {}
+        self._reload_task: Optional[asyncio.Task] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def get_brands(self, product_type: str) -> Dict[str, Any]:
+        """Бренды для Mini App: из индекса, а пока он не построен - статический список"""
+        brands = self.brands.get(product_type)
+        if not brands:
+            return {"brands": STATIC_BRANDS[product_type], "source": "static", "updated_at": None}
+        return {
+            "brands": [ANY_BRAND, *brands],
+            "source": "index",
+            "updated_at": self.updated_at.get(product_type),
+        }
+
+    async def load(self, db: AsyncIOMotorDatabase):
+        """Перечитать индекс из базы"""
+        async for doc in db[INDEX_COLLECTION].find({}, {"counts": 0}):
+            if doc.get("brands"):
+                self.brands[doc["_id"]] = doc["brands"]
+                self.updated_at[doc["_id"]] = doc.get("updated_at")
+
+    async def rebuild(self, db: AsyncIOMotorDatabase, client: FourthchkiClient) -> Dict[str, Any]:
+        """Построить индекс заново (шины и диски параллельно) и сохранить в базу"""
+        started_at = datetime.now(timezone.utc)
+        # Общий лимит параллельных запросов на оба обхода
+        semaphore = asyncio.Semaphore(BRAND_INDEX_CONCURRENCY)
+        results = await asyncio.gather(
+            *(scan_brands(client, product_type, semaphore) for product_type in _SCAN_METHODS),
+            return_exceptions=True,
+        )
+
+        report = {}
+        for product_type, result in zip(_SCAN_METHODS, results):
+            if isinstance(result, Exception):
+                logger.error(f"Brand index {product_type} scan failed: {result}")
+                report[product_type] = {"error": str(result)}
+                continue
+            if not result["brands"]:
+                # Пустой ответ поставщика не должен затирать рабочий индекс
+                logger.warning(f"Brand index {product_type}: no brands found, keeping previous index")
+                report[product_type] = {"error": "no brands found"}
+                continue
+
+            updated_at = datetime.now(timezone.utc).isoformat()
+            await db[INDEX_COLLECTION].update_one(
+                {"_id": product_type},
+                {"$set": {**result, "updated_at": updated_at}},
+                upsert=True,
+            )
+            self.brands[product_type] = result["brands"]
+            self.updated_at[product_type] = updated_at
+            report[product_type] = {
+                "brands": len(result["brands"]),
+                "pages_scanned": result["pages_scanned"],
+                "items_scanned": result["items_scanned"],
+            }
+
+        duration = round((datetime.now(timezone.utc) - started_at).total_seconds(), 2)
+        logger.info(f"Brand index rebuilt in {duration}s: {report}")
+        return {"duration_seconds": duration, **report}
+
+    def _next_refresh_delay(self) -> float:
+        """Секунд до следующего построения: по возрасту самой старой части индекса"""
+        refresh = timedelta(hours=BRAND_INDEX_REFRESH_HOURS)
+        delays = []
+        for product_type in _SCAN_METHODS:
+            updated_at = self.updated_at.get(product_type)
+            if not updated_at:
+                return 0
+            due = datetime.fromisoformat(updated_at) + refresh
+            delays.append((due - datetime.now(timezone.utc)).total_seconds())
+        return max(0.0, min(delays))
+
+    async def _refresh_loop(self, db: AsyncIOMotorDatabase, load_client):
+        while True:
+            try:
+                # Индекс мог построить предыдущий лидер - не перестраиваем раньше срока
+                await self.load(db)
+                delay = self._next_refresh_delay()
+                if delay <= 0:
+                    await self.rebuild(db, await load_client())
+                    # Не удалось построить часть индекса - повторяем позже
+                    delay = self._next_refresh_delay() or BRAND_INDEX_RETRY_SECONDS
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Brand index refresh failed: {e}")
+                delay = BRAND_INDEX_RETRY_SECONDS
+            await asyncio.sleep(delay)
+
+    async def _reload_loop(self, db: AsyncIOMotorDatabase):
+        while True:
+            await asyncio.sleep(BRAND_INDEX_RELOAD_SECONDS)
+            try:
+                await self.load(db)
+            except Exception as e:
+                logger.warning(f"Brand index reload failed: {e}")
+
+    async def start(self, db: AsyncIOMotorDatabase):
+        """Каждый воркер: загрузить индекс и периодически перечитывать его"""
+        try:
+            await self.load(db)
+        except Exception as e:
+            logger.warning(f"Failed to load brand index: {e}")
+        if self._reload_task is None or self._reload_task.done():
+            self._reload_task = asyncio.create_task(self._reload_loop(db))
+
+    def start_refresh(self, db: AsyncIOMotorDatabase, load_client):
+        """Лидер: перестраивать индекс по расписанию; load_client - корутина, возвращающая SOAP клиент"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_loop(db, load_client))
+
+    async def stop_refresh(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    async def stop(self):
+        await self.stop_refresh()
+        if self._reload_task:
+            self._reload_task.cancel()
+            try:
+                await self._reload_task
+            except asyncio.CancelledError:
+                pass
+            self._reload_task = None
+
+
+# Singleton instance
+brand_index = None
+
+
+def get_brand_index() -> BrandIndex:
+    global brand_index
+    if brand_index is None:
+        brand_index = BrandIndex()
+    return brand_index
@@ -0,0 +1,391 @@
+"""
+Массовые рассылки клиентам через Telegram бота
+
+Рассылка - это документ в broadcasts и список получателей в broadcast_recipients.
+Отправка идет в фоне через token bucket (общий с outbox уведомлений), поэтому
+суммарно бот не превышает лимит Telegram (~30 сообщений в секунду).
+Прогресс хранится в MongoDB: после перезапуска рассылка продолжается
+с неотправленных получателей
+"""
+
+import asyncio
+import logging
+import re
+from html.parser import HTMLParser
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import BaseModel, field_validator, model_validator
+from pymongo import UpdateOne
+from telegram.error import RetryAfter, Forbidden, BadRequest
+
+from services.telegram_bot import TelegramNotifier, get_telegram_notifier
+
+logger = logging.getLogger(__name__)
+
+BROADCASTS_COLLECTION = "broadcasts"
+RECIPIENTS_COLLECTION = "broadcast_recipients"
+
+BROADCAST_BATCH_SIZE = 100
+BROADCAST_CONCURRENCY = 20
+BROADCAST_MAX_ATTEMPTS = 3
+BROADCAST_POLL_INTERVAL = 5.0  # как часто лидер проверяет новые/продолженные рассылки
+
+# Статусы рассылки
+STATUS_RUNNING = "running"
+STATUS_PAUSED = "paused"
+STATUS_COMPLETED = "completed"
+STATUS_CANCELLED = "cancelled"
+
+# Разметка текста рассылки: по умолчанию обычный текст (parse_mode не передается)
+PARSE_MODE_HTML = "HTML"
+
+# Теги, которые Telegram принимает в parse_mode=HTML
+TELEGRAM_HTML_TAGS = {
+    "b", "strong", "i", "em", "u", "ins", "s", "strike", "del", "a",
+    "code", "pre", "span", "tg-spoiler", "tg-emoji", "blockquote",
+}
+_BARE_AMPERSAND = re.compile(r"&(?!(?:lt|gt|amp|quot|#\d+|#x[0-9a-fA-F]+);)")
+
+
+class _TelegramHTMLChecker(HTMLParser):
+    """Проверка текста на разметку, которую Telegram отклонит (неизвестный тег, незакрытый тег, лишний <)"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.open_tags: List[str] = []
+        self.error: Optional[str] = None
+
+    def _fail(self, error: str):
+        if self.error is None:
+            self.error = error
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in TELEGRAM_HTML_TAGS:
+            self._fail(f"Unsupported tag <{tag}>")
+        self.open_tags.append(tag)
+
+    def handle_endtag(self, tag):
+        if not self.open_tags or self.open_tags[-1] != tag:
+            self._fail(f"Unexpected closing tag </{tag}>")
+        else:
+            self.open_tags.pop()
+
+    def handle_data(self, data):
+        if "<" in data or ">" in data:
+            self._fail("Unescaped < or > (use &lt; and &gt;)")
+
+
+def validate_telegram_html(text: str) -> Optional[str]:
+    """Текст ошибки, если Telegram не примет text с parse_mode=HTML, иначе None"""
+    if _BARE_AMPERSAND.search(text):
+        return "Unescaped & (use &amp;)"
+    checker = _TelegramHTMLChecker()
+    checker.feed(text)
+    checker.close()
+    if checker.error is None and checker.rawdata:
+        # Остаток, который парсер не смог разобрать (например, "<" в конце текста)
+        checker._fail("Unescaped < or > (use &lt; and &gt;)")
+    if checker.error is None and checker.open_tags:
+        checker._fail(f"Unclosed tag <{checker.open_tags[-1]}>")
+    return checker.error
+
+
+class BroadcastSegment(BaseModel):
+    """
+    Сегмент получателей рассылки
+    Без фильтров активности - все незаблокированные пользователи
+    """
+    searched_season: Optional[str] = None  # winter, summer, all-season (winter включает шипы/нешипы)
+    city: Optional[str] = None  # Город из параметров поиска
+    activity_types: Optional[List[str]] = None  # tire_search, disk_search, cart_add, ...
+    activity_days: int = 90  # За сколько последних дней учитывать активность
+    include_admins: bool = False
+
+
+class BroadcastCreate(BaseModel):
+    """
+    Текст рассылки отправляется как обычный текст; parse_mode="HTML" включает разметку
+    Telegram - она проверяется при создании, чтобы ошибка в тексте не провалила рассылку у всех
+    """
+    message_text: str
+    parse_mode: Optional[str] = None
+    segment: BroadcastSegment = BroadcastSegment()
+
+    @field_validator("parse_mode")
+    @classmethod
+    def check_parse_mode(cls, value: Optional[str]) -> Optional[str]:
+        if value is None:
+            return None
+        if value.upper() != PARSE_MODE_HTML:
+            raise ValueError("parse_mode must be HTML or omitted")
+        return PARSE_MODE_HTML
+
+    @model_validator(mode="after")
+    def check_markup(self):
+        if self.parse_mode == PARSE_MODE_HTML:
+            error = validate_telegram_html(self.message_text)
+            if error:
+                raise ValueError(f"Invalid HTML in message_text: {error}")
+        return self
+
+
+def _segment_activity_query(segment: BroadcastSegment) -> Optional[Dict]:
+    """Фильтр activity_logs для сегмента (None - сегмент без условий по активности)"""
+    if not (segment.searched_season or segment.city or segment.activity_types):
+        return None
+
+    since = datetime.now(timezone.utc) - timedelta(days=segment.activity_days)
+    query = {"timestamp": {"$gte": since.isoformat()}}
+
+    if segment.activity_types:
+        query["activity_type"] = {"$in": segment.activity_types}
+    elif segment.searched_season:
+        query["activity_type"] = "tire_search"
+
+    if segment.searched_season:
+        query["search_params.season"] = {"$regex": f"^{re.escape(segment.searched_season)}"}
+    if segment.city:
+        # В логах город может быть с эмодзи-префиксом ('🏪 Тюмень')
+        query["search_params.city"] = {"$regex": f"{re.escape(segment.city)}$"}
+    return query
+
+
+async def resolve_segment(db: AsyncIOMotorDatabase, segment: BroadcastSegment) -> List[str]:
+    """Получить telegram_id всех пользователей сегмента"""
+    user_query = {"is_blocked": {"$ne": True}}
+    if not segment.include_admins:
+        user_query["is_admin"] = {"$ne": True}
+
+    activity_query = _segment_activity_query(segment)
+    if activity_query is not None:
+        active_ids = await db.activity_logs.distinct("telegram_id", activity_query)
+        user_query["telegram_id"] = {"$in": active_ids}
+
+    return await db.users.distinct("telegram_id", user_query)
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase):
+    await db[BROADCASTS_COLLECTION].create_index("broadcast_id", unique=True)
+    await db[RECIPIENTS_COLLECTION].create_index(
+        [("broadcast_id", 1), ("telegram_id", 1)], unique=True
+    )
+    await db[RECIPIENTS_COLLECTION].create_index([("broadcast_id", 1), ("status", 1)])
+
+
+async def create_broadcast(
+    db: AsyncIOMotorDatabase,
+    data: BroadcastCreate,
+    created_by: str,
+) -> Dict:
+    """Создать рассылку и зафиксировать список получателей"""
+    recipients = await resolve_segment(db, data.segment)
+    broadcast_id = f"BC-{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    now = datetime.now(timezone.utc).isoformat()
+
+    broadcast = {
+        "broadcast_id": broadcast_id,
+        "message_text": data.message_text,
+        "parse_mode": data.parse_mode,
+        "segment": data.segment.model_dump(),
+        "status": STATUS_RUNNING,
+        "total": len(recipients),
+        "sent": 0,
+        "failed": 0,
+        "created_by": created_by,
+        "created_at": now,
+        "updated_at": now,
+        "finished_at": None,
+    }
+    await db[BROADCASTS_COLLECTION].insert_one(broadcast)
+
+    for start in range(0, len(recipients), 1000):
+        chunk = recipients[start:start + 1000]
+        await db[RECIPIENTS_COLLECTION].bulk_write(
+            [
+                UpdateOne(
+                    {"broadcast_id": broadcast_id, "telegram_id": telegram_id},
+                    {"$setOnInsert": {"status": "pending", "attempts": 0}},
+                    upsert=True,
+                )
+                for telegram_id in chunk
+            ],
+            ordered=False,
+        )
+
+    broadcast.pop("_id", None)
+    logger.info(f"Broadcast {broadcast_id} created by {created_by} for {len(recipients)} recipients")
+    return broadcast
+
+
+class BroadcastRunner:
+    """
+    Фоновый исполнитель рассылок внутри процесса
+    При нескольких воркерах рассылки выполняет только лидер (см. services/leader_lease.py):
+    остальные воркеры лишь создают документы, лидер подхватывает их в течение BROADCAST_POLL_INTERVAL
+    """
+
+    def __init__(self, notifier: TelegramNotifier):
+        self.notifier = notifier
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.enabled = False
+        self._watch_task: Optional[asyncio.Task] = None
+
+    def is_running(self, broadcast_id: str) -> bool:
+        task = self.tasks.get(broadcast_id)
+        return bool(task and not task.done())
+
+    def start(self, db: AsyncIOMotorDatabase, broadcast_id: str):
+        """Запустить рассылку сразу, если этот воркер - исполнитель рассылок"""
+        if not self.enabled or self.is_running(broadcast_id):
+            return
+        task = asyncio.create_task(self._run(db, broadcast_id))
+        self.tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(broadcast_id, None))
+
+    async def resume_unfinished(self, db: AsyncIOMotorDatabase):
+        """Продолжить рассылки, прерванные перезапуском"""
+        cursor = db[BROADCASTS_COLLECTION].find({"status": STATUS_RUNNING}, {"broadcast_id": 1})
+        async for broadcast in cursor:
+            logger.info(f"Resuming broadcast {broadcast['broadcast_id']}")
+            self.start(db, broadcast["broadcast_id"])
+
+    async def _watch(self, db: AsyncIOMotorDatabase):
+        while True:
+            try:
+                await self.resume_unfinished(db)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to resume broadcasts: {e}")
+            await asyncio.sleep(BROADCAST_POLL_INTERVAL)
+
+    async def enable(self, db: AsyncIOMotorDatabase):
+        """Сделать этот воркер исполнителем рассылок: продолжить прерванные и следить за новыми"""
+        self.enabled = True
+        if self._watch_task and not self._watch_task.done():
+            return
+        self._watch_task = asyncio.create_task(self._watch(db))
+
+    async def disable(self):
+        """Перестать выполнять рассылки (потеря лидерства или остановка)"""
+        self.enabled = False
+        if self._watch_task:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+        await self.stop_all()
+
+    async def stop_all(self):
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _send(self, chat_id: str, text: str, parse_mode: Optional[str] = None) -> Optional[str]:
+        """
+        Отправить одно сообщение
+        Возвращает None при успехе, иначе текст ошибки
+        """
+        bot = self.notifier.bot
+        limiter = self.notifier.global_rate_limiter
+        attempt = 0
+        while True:
+            await limiter.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+                return None
+            except RetryAfter as e:
+                # 429 - ждем сколько просит Telegram, попытку не считаем
+                retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else float(e.retry_after)
+                logger.warning(f"Broadcast rate limited, retry after {retry_after}s")
+                limiter.penalize(retry_after)
+            except (Forbidden, BadRequest) as e:
+                return str(e)
+            except Exception as e:
+                attempt += 1
+                if attempt >= BROADCAST_MAX_ATTEMPTS:
+                    return str(e)
+                await asyncio.sleep(2 ** attempt)
+
+    async def _run(self, db: AsyncIOMotorDatabase, broadcast_id: str):
+        broadcasts = db[BROADCASTS_COLLECTION]
+        recipients = db[RECIPIENTS_COLLECTION]
+
+        broadcast = await broadcasts.find_one({"broadcast_id": broadcast_id})
+        if not broadcast or not self.notifier.bot:
+            logger.warning(f"Broadcast {broadcast_id} cannot run (missing job or bot)")
+            return
+
+        text = broadcast["message_text"]
+        parse_mode = broadcast.get("parse_mode")
+        semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+        async def deliver(recipient):
+            async with semaphore:
+                error = await self._send(recipient["telegram_id"], text, parse_mode)
+            return recipient["_id"], error
+
+        try:
+            while True:
+                current = await broadcasts.find_one({"broadcast_id": broadcast_id}, {"status": 1})
+                if not current or current["status"] != STATUS_RUNNING:
+                    logger.info(f"Broadcast {broadcast_id} stopped with status {current and current['status']}")
+                    return
+
+                batch = await recipients.find(
+                    {"broadcast_id": broadcast_id, "status": "pending"}
+                ).limit(BROADCAST_BATCH_SIZE).to_list(BROADCAST_BATCH_SIZE)
+                if not batch:
+                    break
+
+                results = await asyncio.gather(*(deliver(r) for r in batch))
+                now = datetime.now(timezone.utc).isoformat()
+                updates = []
+                sent = failed = 0
+                for recipient_id, error in results:
+                    if error is None:
+                        sent += 1
+                        update = {"$set": {"status": "sent", "sent_at": now}, "$inc": {"attempts": 1}}
+                    else:
+                        failed += 1
+                        update = {"$set": {"status": "failed", "error": error}, "$inc": {"attempts": 1}}
+                    updates.append(UpdateOne({"_id": recipient_id}, update))
+                await recipients.bulk_write(updates, ordered=False)
+                await broadcasts.update_one(
+                    {"broadcast_id": broadcast_id},
+                    {"$inc": {"sent": sent, "failed": failed}, "$set": {"updated_at": now}},
+                )
+
+            now = datetime.now(timezone.utc).isoformat()
+            await broadcasts.update_one(
+                {"broadcast_id": broadcast_id, "status": STATUS_RUNNING},
+                {"$set": {"status": STATUS_COMPLETED, "finished_at": now, "updated_at": now}},
+            )
+            logger.info(f"Broadcast {broadcast_id} completed")
+        except asyncio.CancelledError:
+            # Остановка процесса - рассылка останется running и продолжится при старте
+            logger.info(f"Broadcast {broadcast_id} interrupted, will resume on restart")
+            raise
+        except Exception as e:
+            logger.error(f"Broadcast {broadcast_id} failed: {e}")
+            await broadcasts.update_one(
+                {"broadcast_id": broadcast_id},
+                {"$set": {"status": STATUS_PAUSED, "last_error": str(e)}},
+            )
+
+
+# Singleton instance
+broadcast_runner = None
+
+def get_broadcast_runner() -> BroadcastRunner:
+    global broadcast_runner
+    if broadcast_runner is None:
+        broadcast_runner = BroadcastRunner(get_telegram_notifier())
+    return broadcast_runner
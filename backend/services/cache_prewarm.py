@@ -0,0 +1,280 @@
+"""
+Прогрев кэша поставщика для популярных автомобилей и размеров
+
+По агрегатам аналитики (analytics_rollups) выбираются самые частые автомобили
+(car_selection) и размеры шин/дисков (tire_search/disk_search) за последние
+CACHE_PREWARM_DAYS дней, и их ответы заранее запрашиваются у поставщика.
+
+Прогрев выполняется при старте воркера и по расписанию: в окна пиковой нагрузки
+CACHE_PREWARM_WINDOWS (местное время CACHE_PREWARM_TZ) ответы обновляются
+каждые CACHE_PREWARM_INTERVAL секунд - раньше, чем истечет TTL кэша, поэтому
+покупатели в пик не попадают на истекшие записи. Кэш живет в памяти процесса,
+поэтому прогрев выполняет каждый воркер, а не только лидер.
+
+Каждый запуск записывается в cache_prewarm_runs вместе с долей ответов из кэша
+до прогрева и после него (до следующего запуска)
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime, time as dt_time, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from services import search_analytics
+from services.fourthchki_client import FourthchkiClient
+from services.leader_lease import make_worker_id
+from services.supplier_cache import (
+    FITMENT_GOODS_CACHE_TTL,
+    all_caches,
+    disk_search_params,
+    get_fitment_goods_cache,
+    get_supplier_cache,
+    tire_search_params,
+)
+
+logger = logging.getLogger(__name__)
+
+RUNS_COLLECTION = "cache_prewarm_runs"
+
+CACHE_PREWARM_ENABLED = os.environ.get('CACHE_PREWARM_ENABLED', 'true').lower() == 'true'
+CACHE_PREWARM_WINDOWS = os.environ.get('CACHE_PREWARM_WINDOWS', '09:00-13:00,17:00-21:00')
+CACHE_PREWARM_TZ = os.environ.get('CACHE_PREWARM_TZ', 'Asia/Yekaterinburg')  # Тюмень
+CACHE_PREWARM_INTERVAL = int(os.environ.get('CACHE_PREWARM_INTERVAL', str(int(FITMENT_GOODS_CACHE_TTL * 0.8))))
+CACHE_PREWARM_DAYS = int(os.environ.get('CACHE_PREWARM_DAYS', '14'))
+CACHE_PREWARM_TOP_VEHICLES = int(os.environ.get('CACHE_PREWARM_TOP_VEHICLES', '30'))
+CACHE_PREWARM_TOP_SIZES = int(os.environ.get('CACHE_PREWARM_TOP_SIZES', '20'))
+# Сезоны, для которых прогревается каждый популярный размер шин ('' - без фильтра по сезону)
+CACHE_PREWARM_TIRE_SEASONS = os.environ.get('CACHE_PREWARM_TIRE_SEASONS', ',summer,winter')
+# Параллельных запросов к поставщику при прогреве - не мешаем запросам покупателей
+CACHE_PREWARM_CONCURRENCY = int(os.environ.get('CACHE_PREWARM_CONCURRENCY', '2'))
+
+
+def parse_windows(value: str) -> List[Tuple[dt_time, dt_time]]:
+    """'09:00-13:00,17:00-21:00' -> [(09:00, 13:00), (17:00, 21:00)]"""
+    windows = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, end = part.split('-')
+        windows.append((dt_time.fromisoformat(start.strip()), dt_time.fromisoformat(end.strip())))
+    return sorted(windows)
+
+
+def next_run_delay(now: datetime, windows: List[Tuple[dt_time, dt_time]], interval: int) -> float:
+    """
+    Через сколько секунд следующий прогрев
+    Внутри окна - через interval, вне окна - к началу ближайшего окна
+    """
+    if not windows:
+        return float(interval)
+    for start, end in windows:
+        if start <= now.time() < end:
+            return float(interval)
+
+    for day_offset in (0, 1):
+        day = (now + timedelta(days=day_offset)).date()
+        for start, _ in windows:
+            candidate = datetime.combine(day, start, tzinfo=now.tzinfo)
+            if candidate > now:
+                return (candidate - now).total_seconds()
+    return float(interval)
+
+
+def _hit_rate(served_from_cache: int, total: int) -> Optional[float]:
+    return round(served_from_cache / total, 3) if total else None
+
+
+class CachePrewarmer:
+    """Прогрев кэша поставщика в одном воркере"""
+
+    def __init__(self):
+        self.worker_id = make_worker_id()
+        self.last_run: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        # Счетчики кэшей в момент окончания последнего прогрева
+        self._mark = self._counters()
+
+    @staticmethod
+    def _counters() -> Tuple[int, int]:
+        """(ответов из кэша, всего запросов покупателей) по всем кэшам поставщика"""
+        served = total = 0
+        for cache in all_caches():
+            cache_served, cache_total = cache.served_from_cache()
+            served += cache_served
+            total += cache_total
+        return served, total
+
+    def window_hit_rate(self) -> Dict[str, Any]:
+        """Доля ответов из кэша с момента последнего прогрева"""
+        served, total = self._counters()
+        served -= self._mark[0]
+        total -= self._mark[1]
+        return {"requests": total, "hit_rate": _hit_rate(served, total)}
+
+    async def collect_targets(self, db: AsyncIOMotorDatabase) -> Dict[str, List[Dict]]:
+        """Популярные автомобили и размеры из агрегатов аналитики"""
+        vehicles = await search_analytics.get_top_vehicles(
+            db, days=CACHE_PREWARM_DAYS, limit=CACHE_PREWARM_TOP_VEHICLES
+        )
+        sizes = await search_analytics.get_top_sizes(db, days=CACHE_PREWARM_DAYS, limit=CACHE_PREWARM_TOP_SIZES)
+        seasons = [season.strip() or None for season in CACHE_PREWARM_TIRE_SEASONS.split(',')]
+
+        tire_searches = []
+        for size in sizes["tires"]:
+            for season in seasons:
+                tire_searches.append(tire_search_params(
+                    width=size.get("width"),
+                    height=size.get("height"),
+                    diameter=size.get("diameter"),
+                    season=season,
+                ))
+
+        disk_searches = [
+            disk_search_params(diameter=size.get("diameter"), width=size.get("width"), pcd=size.get("pcd"))
+            for size in sizes["disks"]
+        ]
+        return {"vehicles": vehicles, "tire_searches": tire_searches, "disk_searches": disk_searches}
+
+    async def run(self, db: AsyncIOMotorDatabase, client: FourthchkiClient, reason: str = "manual") -> Dict[str, Any]:
+        """Прогреть кэш и записать отчет о запуске"""
+        async with self._lock:
+            before = self.window_hit_rate()
+            started_at = datetime.now(timezone.utc)
+            targets = await self.collect_targets(db)
+
+            goods_cache = get_fitment_goods_cache()
+            search_cache = get_supplier_cache()
+            semaphore = asyncio.Semaphore(CACHE_PREWARM_CONCURRENCY)
+            counts = {name: {"ok": 0, "failed": 0} for name in targets}
+
+            async def warm(kind: str, load):
+                async with semaphore:
+                    try:
+                        await load()
+                        counts[kind]["ok"] += 1
+                    except Exception as e:
+                        counts[kind]["failed"] += 1
+                        logger.warning(f"Cache prewarm {kind} failed: {e}")
+
+            jobs = []
+            for vehicle in targets["vehicles"]:
+                jobs.append(warm("vehicles", lambda v=vehicle: goods_cache.get_all_goods(
+                    client,
+                    brand=v["brand"],
+                    model=v["model"],
+                    year_begin=v.get("year_begin") or "",
+                    year_end=v.get("year_end") or "",
+                    modification=v.get("modification"),
+                    refresh=True,
+                )))
+            for params in targets["tire_searches"]:
+                jobs.append(warm("tire_searches", lambda p=params: search_cache.search_tires(client, p, refresh=True)))
+            for params in targets["disk_searches"]:
+                jobs.append(warm("disk_searches", lambda p=params: search_cache.search_disks(client, p, refresh=True)))
+            await asyncio.gather(*jobs)
+
+            finished_at = datetime.now(timezone.utc)
+            self._mark = self._counters()
+
+            report = {
+                "worker_id": self.worker_id,
+                "reason": reason,
+                "started_at": started_at.isoformat(),
+                "finished_at": finished_at.isoformat(),
+                "duration_seconds": round((finished_at - started_at).total_seconds(), 2),
+                "warmed": counts,
+                # Доля ответов из кэша между предыдущим прогревом и этим
+                "requests_before": before["requests"],
+                "hit_rate_before": before["hit_rate"],
+            }
+            try:
+                if self.last_run:
+                    # Окно "после" предыдущего запуска закончилось - фиксируем его итог
+                    await db[RUNS_COLLECTION].update_one(
+                        {"_id": self.last_run["_id"]},
+                        {"$set": {"requests_after": before["requests"], "hit_rate_after": before["hit_rate"]}},
+                    )
+                result = await db[RUNS_COLLECTION].insert_one(dict(report))
+                report["_id"] = result.inserted_id
+            except Exception as e:
+                logger.error(f"Failed to save cache prewarm report: {e}")
+
+            self.last_run = report
+            logger.info(
+                f"Cache prewarm ({reason}) done in {report['duration_seconds']}s: {counts}, "
+                f"hit rate before {before['hit_rate']}"
+            )
+            return report
+
+    def get_report(self) -> Dict[str, Any]:
+        """Последний прогрев этого воркера и доля ответов из кэша до и после него"""
+        after = self.window_hit_rate()
+        last_run = {k: v for k, v in (self.last_run or {}).items() if k != "_id"} or None
+        improvement = None
+        if last_run and last_run.get("hit_rate_before") is not None and after["hit_rate"] is not None:
+            improvement = round(after["hit_rate"] - last_run["hit_rate_before"], 3)
+        return {
+            "worker_id": self.worker_id,
+            "last_run": last_run,
+            "requests_after": after["requests"],
+            "hit_rate_after": after["hit_rate"],
+            "hit_rate_improvement": improvement,
+        }
+
+    async def _loop(self, db: AsyncIOMotorDatabase, load_client):
+        windows = parse_windows(CACHE_PREWARM_WINDOWS)
+        try:
+            tz = ZoneInfo(CACHE_PREWARM_TZ)
+        except Exception:
+            logger.warning(f"Unknown CACHE_PREWARM_TZ {CACHE_PREWARM_TZ}, using UTC")
+            tz = timezone.utc
+
+        reason = "startup"
+        while True:
+            try:
+                await self.run(db, await load_client(), reason=reason)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Cache prewarm failed: {e}")
+            reason = "schedule"
+            await asyncio.sleep(next_run_delay(datetime.now(tz), windows, CACHE_PREWARM_INTERVAL))
+
+    def start(self, db: AsyncIOMotorDatabase, load_client):
+        """Запустить прогрев по расписанию; load_client - корутина, возвращающая SOAP клиент"""
+        if not CACHE_PREWARM_ENABLED:
+            logger.info("Cache prewarm disabled")
+            return
+        if self._task and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._loop(db, load_client))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+async def get_recent_runs(db: AsyncIOMotorDatabase, limit: int = 20) -> List[Dict]:
+    """Последние запуски прогрева всех воркеров"""
+    return await db[RUNS_COLLECTION].find({}, {"_id": 0}).sort("started_at", -1).to_list(limit)
+
+
+# Singleton instance
+cache_prewarmer = None
+
+def get_cache_prewarmer() -> CachePrewarmer:
+    global cache_prewarmer
+    if cache_prewarmer is None:
+        cache_prewarmer = CachePrewarmer()
+    return cache_prewarmer
@@ -0,0 +1,144 @@
+"""
+Миграция дат заказов и пользователей из ISO строк в BSON datetime
+
+Раньше created_at / confirmed_at / updated_at заказов и created_at / last_activity
+пользователей сохранялись строками (.isoformat()). Новые документы пишутся
+с BSON датами; старые переводятся этой миграцией в фоне, пачками через bulk_write.
+Чтение работает и до окончания миграции - модели принимают оба формата.
+
+Миграция идемпотентна (берет только поля со строковым типом) и запускается
+воркером-лидером при старте; после завершения отметка в коллекции migrations
+отключает повторные запуски
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+from utils.mongo_codec import ORDER_DATE_FIELDS, USER_DATE_FIELDS
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_COLLECTION = "migrations"
+MIGRATION_ID = "bson_dates_v1"
+MIGRATION_BATCH_SIZE = 500
+
+# Коллекция -> поля-даты
+MIGRATION_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "orders": ORDER_DATE_FIELDS,
+    "users": USER_DATE_FIELDS,
+}
+
+
+def parse_iso_date(value: str) -> Optional[datetime]:
+    """ISO строка -> datetime в UTC (строки без часового пояса считаются UTC)"""
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+async def migrate_collection(db: AsyncIOMotorDatabase, collection: str, fields: Tuple[str, ...]) -> Dict[str, int]:
+    """Перевести строковые даты одной коллекции в BSON datetime"""
+    query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    projection = {field: 1 for field in fields}
+    migrated = invalid = 0
+
+    while True:
+        docs = await db[collection].find(query, projection).limit(MIGRATION_BATCH_SIZE).to_list(MIGRATION_BATCH_SIZE)
+        if not docs:
+            break
+
+        operations = []
+        for doc in docs:
+            update: Dict[str, Dict] = {"$set": {}, "$unset": {}}
+            for field in fields:
+                value = doc.get(field)
+                if not isinstance(value, str):
+                    continue
+                parsed = parse_iso_date(value) if value else None
+                if parsed is None:
+                    # Нечитаемую строку убираем - иначе документ попадал бы в выборку бесконечно
+                    logger.warning(f"Unparseable {collection}.{field} in {doc['_id']}: {value!r}")
+                    update["$unset"][field] = ""
+                    invalid += 1
+                else:
+                    update["$set"][field] = parsed
+            operations.append(UpdateOne({"_id": doc["_id"]}, {op: v for op, v in update.items() if v}))
+
+        await db[collection].bulk_write(operations, ordered=False)
+        migrated += len(operations)
+        # Не занимаем event loop и базу целиком - миграция фоновая
+        await asyncio.sleep(0)
+
+    return {"documents": migrated, "invalid_values": invalid}
+
+
+async def run_date_migration(db: AsyncIOMotorDatabase) -> Optional[Dict]:
+    """Выполнить миграцию, если она еще не завершена"""
+    if await db[MIGRATIONS_COLLECTION].find_one({"_id": MIGRATION_ID, "finished_at": {"$exists": True}}):
+        return None
+
+    started_at = datetime.now(timezone.utc)
+    report = {}
+    for collection, fields in MIGRATION_FIELDS.items():
+        report[collection] = await migrate_collection(db, collection, fields)
+
+    finished_at = datetime.now(timezone.utc)
+    await db[MIGRATIONS_COLLECTION].update_one(
+        {"_id": MIGRATION_ID},
+        {"$set": {"started_at": started_at, "finished_at": finished_at, "report": report}},
+        upsert=True,
+    )
+    logger.info(f"Date migration {MIGRATION_ID} finished in {(finished_at - started_at).total_seconds():.1f}s: {report}")
+    return report
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase):
+    """
+    Индексы для сортировки и выборок заказов по дате
+    order_id в ключе - второй компонент курсора keyset пагинации админки
+    """
+    await db.orders.create_index([("created_at", -1), ("order_id", -1)])
+    await db.orders.create_index([("user_telegram_id", 1), ("created_at", -1), ("order_id", -1)])
+    await db.orders.create_index([("status", 1), ("created_at", -1), ("order_id", -1)])
+
+
+# Фоновая задача миграции в воркере-лидере
+_migration_task: Optional[asyncio.Task] = None
+
+
+def start_date_migration(db: AsyncIOMotorDatabase):
+    """Запустить миграцию в фоне (лидер)"""
+    global _migration_task
+    if _migration_task is not None and not _migration_task.done():
+        return
+
+    async def run():
+        try:
+            await run_date_migration(db)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Повторится при следующем получении лидерства
+            logger.error(f"Date migration failed: {e}")
+
+    _migration_task = asyncio.create_task(run())
+
+
+async def stop_date_migration():
+    global _migration_task
+    if _migration_task is not None:
+        _migration_task.cancel()
+        try:
+            await _migration_task
+        except asyncio.CancelledError:
+            pass
+        _migration_task = None
@@ -1,13 +1,24 @@
-from zeep import Client
-from zeep.cache import SqliteCache
+from zeep import Client, Settings
 from zeep.transports import Transport
 from requests import Session
 import os
+import time
 import logging
 from typing import Dict, List, Optional, Any
 
+from services import metrics
+from utils import server_timing
+from services.wsdl_snapshot import get_snapshot_dir, get_schema_cache_path, get_http_cache, load_snapshot_document
+
 logger = logging.getLogger(__name__)
 
+class TimedTransport(Transport):
+    """Transport с замером сетевой части вызова - остальное время SOAP уходит на разбор ответа zeep"""
+    
+    def post(self, address, message, headers):
+        with server_timing.span("soap_http"):
+            return super().post(address, message, headers)
+
 class FourthchkiClient:
     def __init__(self):
         self.login = os.environ.get('FOURTHCHKI_LOGIN')
@@ -17,15 +28,39 @@ class FourthchkiClient:
         # Настройка транспорта с кэшированием
         session = Session()
         session.verify = False  # Отключаем проверку SSL если нужно
-        transport = Transport(session=session, cache=SqliteCache())
+        transport = TimedTransport(session=session, cache=get_http_cache())
+        settings = Settings()
         
         try:
-            self.client = Client(self.wsdl_url, transport=transport)
+            # Локальный снимок WSDL (services/wsdl_snapshot.py) - без загрузки схем по сети при старте
+            snapshot_dir = get_snapshot_dir()
+            if snapshot_dir:
+                wsdl = load_snapshot_document(snapshot_dir, transport, settings, get_schema_cache_path())
+            else:
+                wsdl = self.wsdl_url
+            self.client = Client(wsdl, transport=transport, settings=settings)
             logger.info("FourthchkiClient initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize SOAP client: {e}")
             raise
     
+    def _call(self, method: str, **kwargs):
+        """Вызов метода SOAP API с учетом длительности и ошибок в метриках"""
+        started = time.perf_counter()
+        try:
+            with server_timing.span("soap"):
+                return getattr(self.client.service, method)(**kwargs)
+        except Exception:
+            metrics.SUPPLIER_CALL_ERRORS.inc(method)
+            raise
+        finally:
+            metrics.SUPPLIER_CALL_DURATION.observe(time.perf_counter() - started, method)
+    
+    def _to_dict(self, response) -> Dict:
+        """Ответ zeep -> словари (отдельная фаза в Server-Timing)"""
+        with server_timing.span("zeep_to_dict"):
+            return self._serialize_zeep_object(response)
+    
     def _serialize_zeep_object(self, obj):
         """Конвертирует Zeep объекты в обычные Python словари"""
         if hasattr(obj, '__values__'):
@@ -74,7 +109,8 @@ class FourthchkiClient:
             if brand_list:
                 filter_data['brand_list'] = brand_list
             
-            response = self.client.service.GetFindTyre(
+            response = self._call(
+                'GetFindTyre',
                 login=self.login,
                 password=self.password,
                 filter=filter_data if filter_data else None,
@@ -82,7 +118,7 @@ class FourthchkiClient:
                 pageSize=page_size
             )
             
-            return self._serialize_zeep_object(response)
+            return self._to_dict(response)
         except Exception as e:
             logger.error(f"Error searching tires: {e}")
             raise
@@ -142,7 +178,8 @@ class FourthchkiClient:
             if type_list:
                 filter_data['type_list'] = type_list
             
-            response = self.client.service.GetFindDisk(
+            response = self._call(
+                'GetFindDisk',
                 login=self.login,
                 password=self.password,
                 filter=filter_data if filter_data else None,
@@ -150,7 +187,7 @@ class FourthchkiClient:
                 pageSize=page_size
             )
             
-            return self._serialize_zeep_object(response)
+            return self._to_dict(response)
         except Exception as e:
             logger.error(f"Error searching disks: {e}")
             raise
@@ -158,11 +195,12 @@ class FourthchkiClient:
     def get_car_brands(self) -> Dict:
         """Получить список марок автомобилей"""
         try:
-            response = self.client.service.GetMarkaAvto(
+            response = self._call(
+                'GetMarkaAvto',
                 login=self.login,
                 password=self.password
             )
-            return self._serialize_zeep_object(response)
+            return self._to_dict(response)
         except Exception as e:
             logger.error(f"Error getting car brands: {e}")
             raise
@@ -170,12 +208,13 @@ class FourthchkiClient:
     def get_car_models(self, brand: str) -> Dict:
         """Получить список моделей автомобиля"""
         try:
-            response = self.client.service.GetModelAvto(
+            response = self._call(
+                'GetModelAvto',
                 login=self.login,
                 password=self.password,
                 marka=brand
             )
-            return self._serialize_zeep_object(response)
+            return self._to_dict(response)
         except Exception as e:
             logger.error(f"Error getting car models: {e}")
             raise
@@ -183,13 +222,14 @@ class FourthchkiClient:
     def get_car_years(self, brand: str, model: str) -> Dict:
         """Получить список годов выпуска"""
         try:
-            response = self.client.service.GetYearAvto(
+            response = self._call(
+                'GetYearAvto',
                 login=self.login,
                 password=self.password,
                 marka=brand,
                 model=model
             )
-            return self._serialize_zeep_object(response)
+            return self._to_dict(response)
         except Exception as e:
             logger.error(f"Error getting car years: {e}")
             raise
@@ -203,7 +243,8 @@ class FourthchkiClient:
     ) -> Dict:
         """Получить список модификаций автомобиля"""
         try:
-            response = self.client.service.GetModificationAvto(
+            response = self._call(
+                'GetModificationAvto',
                 login=self.login,
                 password=self.password,
                 marka=brand,
@@ -211,7 +252,7 @@ class FourthchkiClient:
                 year_beg=year_begin,
                 year_end=year_end
             )
-            return self._serialize_zeep_object(response)
+            return self._to_dict(response)
         except Exception as e:
             logger.error(f"Error getting car modifications: {e}")
             raise
@@ -238,13 +279,14 @@ class FourthchkiClient:
                 'podbor_type': podbor_type
             }
             
-            response = self.client.service.GetGoodsByCar(
+            response = self._call(
+                'GetGoodsByCar',
                 login=self.login,
                 password=self.password,
                 filter=filter_data
             )
             
-            return self._serialize_zeep_object(response)
+            return self._to_dict(response)
         except Exception as e:
             logger.error(f"Error getting goods by car: {e}")
             raise
@@ -256,13 +298,14 @@ class FourthchkiClient:
                 'code_list': code_list
             }
             
-            response = self.client.service.GetGoodsPriceRestByCode(
+            response = self._call(
+                'GetGoodsPriceRestByCode',
                 login=self.login,
                 password=self.password,
                 filter=filter_data
             )
             
-            return self._serialize_zeep_object(response)
+            return self._to_dict(response)
         except Exception as e:
             logger.error(f"Error getting goods price/rest: {e}")
             raise
@@ -270,13 +313,14 @@ class FourthchkiClient:
     def get_goods_info(self, code: str) -> Dict:
         """Получить подробную информацию о товаре"""
         try:
-            response = self.client.service.GetGoodsInfo(
+            response = self._call(
+                'GetGoodsInfo',
                 login=self.login,
                 password=self.password,
                 code=code
             )
             
-            return self._serialize_zeep_object(response)
+            return self._to_dict(response)
         except Exception as e:
             logger.error(f"Error getting goods info: {e}")
             raise
@@ -291,13 +335,14 @@ class FourthchkiClient:
                 'product_list': order_items
             }
             
-            response = self.client.service.CreateOrder(
+            response = self._call(
+                'CreateOrder',
                 login=self.login,
                 password=self.password,
                 order=order_data
             )
             
-            return self._serialize_zeep_object(response)
+            return self._to_dict(response)
         except Exception as e:
             logger.error(f"Error creating order: {e}")
             raise
@@ -305,13 +350,14 @@ class FourthchkiClient:
     def get_order_info(self, order_id: int) -> Dict:
         """Получить информацию о заказе"""
         try:
-            response = self.client.service.GetOrderInfo2(
+            response = self._call(
+                'GetOrderInfo2',
                 login=self.login,
                 password=self.password,
                 orderId=order_id
             )
             
-            return self._serialize_zeep_object(response)
+            return self._to_dict(response)
         except Exception as e:
             logger.error(f"Error getting order info: {e}")
             raise
@@ -319,115 +365,17 @@ class FourthchkiClient:
     def get_warehouses(self) -> Dict:
         """Получить список доступных складов"""
         try:
-            response = self.client.service.GetWarehouses(
+            response = self._call(
+                'GetWarehouses',
                 login=self.login,
                 password=self.password
             )
             
-            return self._serialize_zeep_object(response)
+            return self._to_dict(response)
         except Exception as e:
             logger.error(f"Error getting warehouses: {e}")
             raise
 
-    
-    def get_tire_brands(self, limit: int = 200) -> List[str]:
-        """
-        Получить список брендов шин
-        Делает несколько запросов с разными параметрами для получения максимального списка брендов
-        """
-        brands = set()
-        
-        # Запросы с разными размерами для получения большего количества брендов
-        size_ranges = [
-            {'diameter_min': 13, 'diameter_max': 14},
-            {'diameter_min': 15, 'diameter_max': 16},
-            {'diameter_min': 17, 'diameter_max': 18},
-            {'diameter_min': 19, 'diameter_max': 22},
-        ]
-        
-        try:
-            # Запросы с разными размерами
-            for size_filter in size_ranges:
-                try:
-                    response = self.search_tires(page=0, page_size=100, **size_filter)
-                    
-                    # Извлекаем tire_data из вложенной структуры
-                    tire_data = []
-                    price_rest_list = response.get('price_rest_list', {})
-                    if isinstance(price_rest_list, dict) and 'TyrePriceRest' in price_rest_list:
-                        tire_data = price_rest_list['TyrePriceRest']
-                    elif isinstance(price_rest_list, list):
-                        tire_data = price_rest_list
-                    
-                    if tire_data:
-                        for tyre in tire_data:
-                            # Используем поле 'marka' из API
-                            brand = tyre.get('brand') or tyre.get('marka')
-                            if brand:
-                                brands.add(brand)
-                        logger.info(f"Found {len([t for t in tire_data if t.get('marka') or t.get('brand')])} brands in range {size_filter}")
-                                
-                    if len(brands) >= limit:
-                        break
-                except Exception as e:
-                    logger.warning(f"Error in tire brands query with filter {size_filter}: {e}")
-                    continue
-            
-            logger.info(f"Found total {len(brands)} tire brands")
-            return sorted(list(brands))
-        except Exception as e:
-            logger.error(f"Error getting tire brands: {e}")
-            return []
-    
-    def get_disk_brands(self, limit: int = 200) -> List[str]:
-        """
-        Получить список брендов дисков
-        Делает несколько запросов с разными параметрами для получения максимального списка брендов
-        """
-        brands = set()
-        
-        # Запросы с разными размерами
-        size_ranges = [
-            {'diameter_min': 13, 'diameter_max': 14},
-            {'diameter_min': 15, 'diameter_max': 16},
-            {'diameter_min': 17, 'diameter_max': 18},
-            {'diameter_min': 19, 'diameter_max': 22},
-        ]
-        
-        try:
-            # Запросы с разными размерами
-            for size_filter in size_ranges:
-                try:
-                    response = self.search_disks(page=0, page_size=100, **size_filter)
-                    
-                    # Извлекаем disk_data из вложенной структуры
-                    disk_data = []
-                    price_rest_list = response.get('price_rest_list', {})
-                    if isinstance(price_rest_list, dict) and 'DiskPriceRest' in price_rest_list:
-                        disk_data = price_rest_list['DiskPriceRest']
-                    elif isinstance(price_rest_list, list):
-                        disk_data = price_rest_list
-                    
-                    if disk_data:
-                        for disk in disk_data:
-                            # Используем поле 'marka' из API
-                            brand = disk.get('brand') or disk.get('marka')
-                            if brand:
-                                brands.add(brand)
-                        logger.info(f"Found {len([d for d in disk_data if d.get('marka') or d.get('brand')])} brands in range {size_filter}")
-                                
-                    if len(brands) >= limit:
-                        break
-                except Exception as e:
-                    logger.warning(f"Error in disk brands query with filter {size_filter}: {e}")
-                    continue
-            
-            logger.info(f"Found total {len(brands)} disk brands")
-            return sorted(list(brands))
-        except Exception as e:
-            logger.error(f"Error getting disk brands: {e}")
-            return []
-
 # Singleton instance
 fourthchki_client = None
 
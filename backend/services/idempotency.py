@@ -0,0 +1,125 @@
+"""
+Ключи идемпотентности для запросов, создающих данные (POST /orders)
+
+Клиент отправляет заголовок Idempotency-Key - один и тот же для всех повторов
+одной попытки (двойное нажатие, повтор после таймаута). Первый запрос захватывает
+ключ вставкой документа в idempotency_keys (_id уникален), выполняет работу
+и сохраняет результат. Повторы с тем же ключом получают сохраненный результат
+без повторной проверки, вставок и уведомлений; конкурентный повтор ждет, пока
+первый запрос закончит. Ключи удаляются TTL индексом через IDEMPOTENCY_KEY_TTL_HOURS
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_COLLECTION = "idempotency_keys"
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+# Через сколько секунд незавершенный запрос (упавший воркер) можно перехватить
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '30'))
+# Сколько повтор ждет завершения первого запроса
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '10'))
+IDEMPOTENCY_POLL_INTERVAL = 0.1
+
+STATUS_PROCESSING = "processing"
+STATUS_COMPLETED = "completed"
+
+
+class IdempotencyKeyReused(Exception):
+    """Ключ уже использован для запроса с другими данными"""
+
+
+class IdempotencyInProgress(Exception):
+    """Первый запрос с этим ключом еще выполняется"""
+
+
+def request_fingerprint(payload: Any) -> str:
+    """Отпечаток тела запроса - ключ нельзя переиспользовать для другого заказа"""
+    raw = json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _key_id(scope: str, key: str) -> str:
+    # Ключ уникален в пределах пользователя и операции
+    return f"{scope}:{key}"
+
+
+async def begin_request(
+    db: AsyncIOMotorDatabase,
+    scope: str,
+    key: str,
+    fingerprint: str,
+) -> Optional[Dict[str, Any]]:
+    """
+    Захватить ключ перед выполнением запроса
+    None - ключ захвачен, запрос нужно выполнить и вызвать complete_request/release_request;
+    словарь - результат уже выполненного запроса с этим ключом
+    """
+    key_id = _key_id(scope, key)
+    deadline = asyncio.get_running_loop().time() + IDEMPOTENCY_WAIT_SECONDS
+
+    while True:
+        now = datetime.now(timezone.utc)
+        try:
+            await db[IDEMPOTENCY_COLLECTION].insert_one({
+                "_id": key_id,
+                "fingerprint": fingerprint,
+                "status": STATUS_PROCESSING,
+                "created_at": now,
+                "locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS),
+            })
+            return None
+        except DuplicateKeyError:
+            pass
+
+        doc = await db[IDEMPOTENCY_COLLECTION].find_one({"_id": key_id})
+        if doc is not None:
+            if doc["fingerprint"] != fingerprint:
+                raise IdempotencyKeyReused(key)
+            if doc["status"] == STATUS_COMPLETED:
+                return doc["result"]
+
+            # Запрос, захвативший ключ, не завершился вовремя - перехватываем
+            takeover = await db[IDEMPOTENCY_COLLECTION].update_one(
+                {"_id": key_id, "status": STATUS_PROCESSING, "locked_until": {"$lt": now}},
+                {"$set": {"locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}},
+            )
+            if takeover.modified_count:
+                logger.warning(f"Idempotency key {key_id} lock expired, taking over")
+                return None
+
+        if asyncio.get_running_loop().time() >= deadline:
+            raise IdempotencyInProgress(key)
+        await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+
+async def complete_request(db: AsyncIOMotorDatabase, scope: str, key: str, result: Dict[str, Any]):
+    """Сохранить результат - повторы получат его вместо выполнения запроса"""
+    await db[IDEMPOTENCY_COLLECTION].update_one(
+        {"_id": _key_id(scope, key)},
+        {"$set": {"status": STATUS_COMPLETED, "result": result, "completed_at": datetime.now(timezone.utc)},
+         "$unset": {"locked_until": ""}},
+    )
+
+
+async def release_request(db: AsyncIOMotorDatabase, scope: str, key: str):
+    """Запрос завершился ошибкой - освобождаем ключ, чтобы повтор выполнился заново"""
+    await db[IDEMPOTENCY_COLLECTION].delete_one({"_id": _key_id(scope, key), "status": STATUS_PROCESSING})
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase):
+    await db[IDEMPOTENCY_COLLECTION].create_index(
+        "created_at", expireAfterSeconds=IDEMPOTENCY_KEY_TTL_HOURS * 3600
+    )
@@ -0,0 +1,146 @@
+"""
+Выбор лидера между воркерами через аренду (lease) в MongoDB
+
+При запуске в несколько воркеров (gunicorn) фоновые задачи, которые должны
+работать в единственном экземпляре (polling бота, отправка outbox, рассылки),
+запускаются только в воркере, который держит аренду. Аренда продлевается
+каждые LEASE_TTL_SECONDS / 3 секунд; если лидер упал, через LEASE_TTL_SECONDS
+ее забирает другой воркер
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+LEASES_COLLECTION = "leases"
+LEASE_TTL_SECONDS = float(os.environ.get('LEADER_LEASE_TTL_SECONDS', '30'))
+
+Callback = Callable[[], Awaitable[None]]
+
+
+def make_worker_id() -> str:
+    """Идентификатор воркера: хост, pid и случайный суффикс (pid может повториться после рестарта)"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class LeaderLease:
+    """
+    Аренда с именем name: документ {_id: name, holder, expires_at} в коллекции leases
+    on_acquired вызывается при получении лидерства, on_lost - при его потере или остановке
+    """
+
+    def __init__(
+        self,
+        db: AsyncIOMotorDatabase,
+        name: str,
+        worker_id: Optional[str] = None,
+        ttl_seconds: float = LEASE_TTL_SECONDS,
+    ):
+        self.db = db
+        self.name = name
+        self.worker_id = worker_id or make_worker_id()
+        self.ttl_seconds = ttl_seconds
+        self.is_leader = False
+        self._on_acquired: List[Callback] = []
+        self._on_lost: List[Callback] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def on_acquired(self, callback: Callback):
+        self._on_acquired.append(callback)
+
+    def on_lost(self, callback: Callback):
+        self._on_lost.append(callback)
+
+    async def try_acquire(self) -> bool:
+        """Получить или продлить аренду. True - этот воркер лидер"""
+        now = datetime.now(timezone.utc)
+        try:
+            # Условие совпало (аренда наша или истекла) или документа нет и он создан upsert'ом
+            await self.db[LEASES_COLLECTION].find_one_and_update(
+                {
+                    "_id": self.name,
+                    "$or": [
+                        {"holder": self.worker_id},
+                        {"expires_at": {"$lt": now}},
+                    ],
+                },
+                {
+                    "$set": {
+                        "holder": self.worker_id,
+                        "expires_at": now + timedelta(seconds=self.ttl_seconds),
+                        "renewed_at": now,
+                    }
+                },
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # Аренду держит другой воркер - upsert наткнулся на существующий _id
+            return False
+        return True
+
+    async def release(self):
+        """Отдать аренду, чтобы другой воркер забрал ее сразу, а не через TTL"""
+        await self.db[LEASES_COLLECTION].delete_one({"_id": self.name, "holder": self.worker_id})
+
+    async def _run_callbacks(self, callbacks: List[Callback]):
+        for callback in callbacks:
+            try:
+                await callback()
+            except Exception as e:
+                logger.error(f"Lease '{self.name}' callback {callback.__qualname__} failed: {e}")
+
+    async def _set_leader(self, is_leader: bool):
+        if is_leader == self.is_leader:
+            return
+        self.is_leader = is_leader
+        if is_leader:
+            logger.info(f"Worker {self.worker_id} became leader for '{self.name}'")
+            await self._run_callbacks(self._on_acquired)
+        else:
+            logger.info(f"Worker {self.worker_id} lost leadership for '{self.name}'")
+            await self._run_callbacks(self._on_lost)
+
+    async def _run(self):
+        interval = self.ttl_seconds / 3
+        while True:
+            try:
+                acquired = await self.try_acquire()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Нет связи с MongoDB - не можем подтвердить аренду, считаем что ее потеряли
+                logger.error(f"Lease '{self.name}' renewal failed: {e}")
+                acquired = False
+            await self._set_leader(acquired)
+            await asyncio.sleep(interval)
+
+    async def start(self):
+        """Запустить фоновое получение/продление аренды (первая попытка - сразу)"""
+        if self._task and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить продление, выполнить on_lost и освободить аренду"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_leader:
+            await self._set_leader(False)
+            try:
+                await self.release()
+            except Exception as e:
+                logger.warning(f"Failed to release lease '{self.name}': {e}")
@@ -0,0 +1,259 @@
+"""
+Метрики приложения в текстовом формате Prometheus (GET /api/metrics)
+
+Счетчики и гистограммы агрегируются в памяти воркера: наблюдение - поиск серии
+по меткам и увеличение счетчика корзины, без хранения отдельных значений.
+Собираются:
+- длительность HTTP запросов по маршруту (шаблону пути) и их количество по статусу
+- длительность команд MongoDB по коллекции и команде (CommandListener pymongo)
+- длительность и ошибки вызовов SOAP API 4tochki по методу
+- задержка event loop (насколько позже просыпается периодическая задача)
+Кэши поставщика и очередь outbox читаются в момент запроса метрик.
+
+При запуске через gunicorn у каждого воркера свои метрики - запрос попадает
+в один из воркеров (метка worker - его pid)
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+# /api/metrics требует заголовок Authorization: Bearer <METRICS_TOKEN>; без токена - 403 всем
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# Как часто измеряется задержка event loop
+METRICS_LOOP_LAG_INTERVAL = float(os.environ.get('METRICS_LOOP_LAG_INTERVAL', '0.5'))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Поиск у поставщика может занимать десятки секунд
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+SOAP_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """
+    Серии метрики по значениям меток
+    Наблюдения приходят и из потоков (motor и zeep выполняются в пуле потоков) - под блокировкой
+    """
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def _new_series(self) -> List[float]:
+        raise NotImplementedError
+
+    def _get_series(self, labels: Tuple[str, ...]) -> List[float]:
+        series = self._series.get(labels)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(labels, self._new_series())
+        return series
+
+    def _samples(self, labels: Tuple[str, ...], series: List[float]) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            snapshot = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in snapshot:
+            lines.extend(self._samples(labels, series))
+        return lines
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_series(self) -> List[float]:
+        return [0]
+
+    def inc(self, *labels: str, amount: float = 1):
+        series = self._get_series(labels)
+        with self._lock:
+            series[0] += amount
+
+    def _samples(self, labels, series):
+        yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(series[0])}"
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными корзинами; серия - [счетчики корзин..., +Inf, сумма]"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = HTTP_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_series(self) -> List[float]:
+        return [0] * (len(self.buckets) + 2)
+
+    def observe(self, value: float, *labels: str):
+        series = self._get_series(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series[index] += 1
+            series[-1] += value
+
+    def _samples(self, labels, series):
+        cumulative = 0
+        for bound, count in zip((*self.buckets, float("inf")), series):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+        label_str = _format_labels(self.labelnames, labels)
+        yield f"{self.name}_sum{label_str} {_format_value(series[-1])}"
+        yield f"{self.name}_count{label_str} {cumulative}"
+
+
+def render_samples(name: str, type_name: str, documentation: str, labelnames: Sequence[str],
+                   samples: Dict[Tuple[str, ...], float]) -> List[str]:
+    """Метрика, значения которой читаются в момент запроса (кэши, outbox)"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {type_name}"]
+    for labels, value in samples.items():
+        lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+    return lines
+
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Длительность обработки HTTP запросов",
+    ("method", "route"), HTTP_BUCKETS,
+)
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP запросы по статусу ответа", ("method", "route", "status"),
+)
+MONGO_COMMAND_DURATION = Histogram(
+    "mongodb_command_duration_seconds", "Длительность команд MongoDB",
+    ("collection", "command"), MONGO_BUCKETS,
+)
+MONGO_COMMAND_ERRORS = Counter(
+    "mongodb_command_errors_total", "Команды MongoDB, завершившиеся ошибкой", ("collection", "command"),
+)
+SUPPLIER_CALL_DURATION = Histogram(
+    "supplier_soap_call_duration_seconds", "Длительность вызовов SOAP API 4tochki (с разбором ответа)",
+    ("method",), SOAP_BUCKETS,
+)
+SUPPLIER_CALL_ERRORS = Counter(
+    "supplier_soap_call_errors_total", "Вызовы SOAP API 4tochki, завершившиеся ошибкой", ("method",),
+)
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "Задержка event loop", (), LOOP_LAG_BUCKETS,
+)
+
+REGISTRY = (
+    HTTP_REQUEST_DURATION, HTTP_REQUESTS,
+    MONGO_COMMAND_DURATION, MONGO_COMMAND_ERRORS,
+    SUPPLIER_CALL_DURATION, SUPPLIER_CALL_ERRORS,
+    EVENT_LOOP_LAG,
+)
+
+
+def render_registry() -> List[str]:
+    lines = render_samples("process_worker_info", "gauge", "PID воркера, отдавшего метрики", ("worker",), {(str(os.getpid()),): 1})
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return lines
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Длительность команд MongoDB по коллекции (передается в AsyncIOMotorClient(event_listeners=...))"""
+
+    def __init__(self):
+        # request_id -> коллекция; события succeeded/failed имени коллекции не содержат
+        self._collections: Dict[int, str] = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if not isinstance(target, str):
+            # getMore содержит id курсора, коллекция - в отдельном поле
+            target = event.command.get("collection", "")
+        self._collections[event.request_id] = target
+
+    def succeeded(self, event):
+        collection = self._collections.pop(event.request_id, "")
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, collection, event.command_name)
+
+    def failed(self, event):
+        collection = self._collections.pop(event.request_id, "")
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, collection, event.command_name)
+        MONGO_COMMAND_ERRORS.inc(collection, event.command_name)
+
+
+class LoopLagMonitor:
+    """Фоновая задача: засыпает на интервал и измеряет, насколько позже проснулась"""
+
+    def __init__(self, interval: float = METRICS_LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self._task:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG.observe(max(0.0, time.perf_counter() - started - self.interval))
+
+
+# Singleton instance
+mongo_command_listener = None
+loop_lag_monitor = None
+
+
+def get_mongo_command_listener() -> MongoCommandListener:
+    global mongo_command_listener
+    if mongo_command_listener is None:
+        mongo_command_listener = MongoCommandListener()
+    return mongo_command_listener
+
+
+def get_loop_lag_monitor() -> LoopLagMonitor:
+    global loop_lag_monitor
+    if loop_lag_monitor is None:
+        loop_lag_monitor = LoopLagMonitor()
+    return loop_lag_monitor
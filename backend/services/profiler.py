@@ -0,0 +1,238 @@
+"""
+Профилирование работающего воркера по запросу админа (POST /api/admin/profile)
+
+cpu - выборочный профилировщик: отдельный поток каждые interval мс снимает стек
+потока event loop (sys._current_frames) и считает одинаковые стеки. Результат -
+свернутые стеки (collapsed: "f1;f2;f3 count"), которые открываются в speedscope
+или flamegraph.pl. Ожидание event loop в select не считается (кроме include_idle).
+
+memory - tracemalloc: снимок в начале и в конце, разница по строкам кода
+(что выделило и удерживает память за время замера) и свернутые стеки с
+весом в байтах.
+
+Замер идет seconds секунд или до завершения requests следующих запросов
+(тогда seconds - предельное время). Одновременно - один замер на воркер;
+при запуске в несколько воркеров профилируется воркер, принявший запрос
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Ответ приходит после замера - держим его короче proxy_read_timeout Nginx (60 с)
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', '50'))
+PROFILE_MAX_REQUESTS = int(os.environ.get('PROFILE_MAX_REQUESTS', '1000'))
+# Глубина стека выделений памяти (больше - точнее, но дороже)
+PROFILE_TRACEMALLOC_FRAMES = int(os.environ.get('PROFILE_TRACEMALLOC_FRAMES', '25'))
+
+BACKEND_DIR = str(Path(__file__).resolve().parent.parent)
+
+# Листовые функции, в которых поток ждет, а не работает
+IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+class ProfilerBusy(Exception):
+    """Замер уже идет"""
+
+
+def _short_path(filename: str) -> str:
+    """Путь относительно backend, для библиотек - начиная с пакета"""
+    if filename.startswith(BACKEND_DIR):
+        return filename[len(BACKEND_DIR) + 1:]
+    marker = "site-packages" + os.sep
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    return os.path.basename(filename)
+
+
+def _frame_label(filename: str, name: str, lineno: int) -> str:
+    return f"{name} ({_short_path(filename)}:{lineno})"
+
+
+def _collapsed(stacks: Counter) -> str:
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+
+
+class _StackSampler(threading.Thread):
+    """Поток, снимающий стеки выбранных потоков"""
+
+    def __init__(self, thread_ids: Optional[set], interval: float, include_idle: bool):
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.thread_ids = thread_ids
+        self.interval = interval
+        self.include_idle = include_idle
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.idle_samples = 0
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                code = frame.f_code
+                if not self.include_idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAVES:
+                    self.idle_samples += 1
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(_frame_label(code.co_filename, code.co_name, code.co_firstlineno))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+
+class Profiler:
+    """Один замер за раз; request_finished() вызывается middleware после каждого запроса"""
+
+    def __init__(self):
+        self.mode: Optional[str] = None
+        self._requests_target = 0
+        self._requests_done = 0
+        self._requests_reached: Optional[asyncio.Event] = None
+
+    @property
+    def busy(self) -> bool:
+        return self.mode is not None
+
+    def request_finished(self):
+        if not self.busy:
+            return
+        self._requests_done += 1
+        if self._requests_reached is not None and self._requests_done >= self._requests_target:
+            self._requests_reached.set()
+
+    async def _wait(self, seconds: float, requests: int) -> float:
+        """Дождаться конца замера; возвращает его длительность"""
+        started = time.perf_counter()
+        self._requests_done = 0
+        if requests:
+            self._requests_target = requests
+            self._requests_reached = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._requests_reached.wait(), timeout=seconds)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._requests_reached = None
+        else:
+            await asyncio.sleep(seconds)
+        return time.perf_counter() - started
+
+    def _claim(self, mode: str):
+        if self.busy:
+            raise ProfilerBusy(self.mode)
+        self.mode = mode
+
+    async def profile_cpu(
+        self,
+        seconds: float,
+        requests: int = 0,
+        interval_ms: float = 5,
+        all_threads: bool = False,
+        include_idle: bool = False,
+    ) -> Dict[str, Any]:
+        """Свернутые стеки потока event loop (all_threads - и потоков to_thread)"""
+        self._claim("cpu")
+        try:
+            thread_ids = None if all_threads else {threading.get_ident()}
+            sampler = _StackSampler(thread_ids, interval_ms / 1000, include_idle)
+            sampler.start()
+            try:
+                duration = await self._wait(seconds, requests)
+            finally:
+                sampler.stop()
+            logger.info(f"CPU profile finished: {sampler.samples} samples in {duration:.1f}s")
+            return {
+                "mode": "cpu",
+                "worker": os.getpid(),
+                "duration_seconds": round(duration, 3),
+                "requests": self._requests_done,
+                "interval_ms": interval_ms,
+                "samples": sampler.samples,
+                "idle_samples": sampler.idle_samples,
+                "collapsed": _collapsed(sampler.stacks),
+            }
+        finally:
+            self.mode = None
+
+    async def profile_memory(self, seconds: float, requests: int = 0, limit: int = 30) -> Dict[str, Any]:
+        """Разница снимков tracemalloc за время замера"""
+        self._claim("memory")
+        was_tracing = tracemalloc.is_tracing()
+        try:
+            if not was_tracing:
+                tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            snapshot_filters = [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ]
+            before = tracemalloc.take_snapshot().filter_traces(snapshot_filters)
+            duration = await self._wait(seconds, requests)
+            after = tracemalloc.take_snapshot().filter_traces(snapshot_filters)
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if not was_tracing:
+                tracemalloc.stop()
+            self.mode = None
+
+        top: List[Dict[str, Any]] = []
+        for stat in after.compare_to(before, "lineno")[:limit]:
+            frame = stat.traceback[0]
+            top.append({
+                "location": f"{_short_path(frame.filename)}:{frame.lineno}",
+                "size_diff_kb": round(stat.size_diff / 1024, 1),
+                "size_kb": round(stat.size / 1024, 1),
+                "count_diff": stat.count_diff,
+            })
+
+        # Выросшие стеки выделений с весом в байтах - для flame graph
+        stacks: Counter = Counter()
+        for stat in after.compare_to(before, "traceback"):
+            if stat.size_diff > 0:
+                stack = ";".join(f"{_short_path(f.filename)}:{f.lineno}" for f in stat.traceback)
+                stacks[stack] += stat.size_diff
+
+        logger.info(f"Memory profile finished in {duration:.1f}s, traced {current / 1048576:.1f} MiB")
+        return {
+            "mode": "memory",
+            "worker": os.getpid(),
+            "duration_seconds": round(duration, 3),
+            "requests": self._requests_done,
+            "traced_current_mb": round(current / 1048576, 2),
+            "traced_peak_mb": round(peak / 1048576, 2),
+            "top": top,
+            "collapsed": _collapsed(stacks),
+        }
+
+
+# Singleton instance
+profiler = None
+
+
+def get_profiler() -> Profiler:
+    global profiler
+    if profiler is None:
+        profiler = Profiler()
+    return profiler
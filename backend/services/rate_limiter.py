@@ -0,0 +1,289 @@
+"""
+Ограничение частоты запросов к API (token bucket на пользователя и на IP)
+
+Каждый запрос к /api списывает токены из бакетов клиента: по IP и по telegram_id.
+Запросы, которые уходят к поставщику (поиск, подбор по авто, карточка товара),
+дополнительно списывают токены из отдельного, более строгого бюджета - своего
+у каждого клиента и общего на все приложение. Когда токенов не хватает, клиент
+получает 429 с Retry-After вместо ручной блокировки is_blocked.
+
+Бакеты хранятся в памяти воркера (RATE_LIMIT_BACKEND=memory) - при запуске в
+несколько воркеров лимиты фактически умножаются на их число. RATE_LIMIT_BACKEND=mongo
+хранит бакеты в коллекции rate_limits, общей для всех воркеров (один запрос к базе
+на бакет); при ошибке базы проверка выполняется по бакетам в памяти.
+
+Запрос списывает токены из всех своих бакетов или ни из одного: отклоненный
+запрос (в том числе по бюджету поставщика) не расходует общий бюджет клиента
+"""
+
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+
+from utils.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMITS_COLLECTION = "rate_limits"
+
+BACKEND_MEMORY = "memory"
+BACKEND_MONGO = "mongo"
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', BACKEND_MEMORY).lower()
+
+# Все запросы к API: токенов в секунду и запас на всплеск
+RATE_LIMIT_USER_RATE = float(os.environ.get('RATE_LIMIT_USER_RATE', '5'))
+RATE_LIMIT_USER_BURST = float(os.environ.get('RATE_LIMIT_USER_BURST', '40'))
+# С одного IP могут заходить несколько пользователей (мобильный NAT, офис)
+RATE_LIMIT_IP_RATE = float(os.environ.get('RATE_LIMIT_IP_RATE', '20'))
+RATE_LIMIT_IP_BURST = float(os.environ.get('RATE_LIMIT_IP_BURST', '100'))
+
+# Запросы к поставщику: отдельный бюджет клиента и общий на приложение (0 - без общего)
+RATE_LIMIT_SUPPLIER_USER_RATE = float(os.environ.get('RATE_LIMIT_SUPPLIER_USER_RATE', '1'))
+RATE_LIMIT_SUPPLIER_USER_BURST = float(os.environ.get('RATE_LIMIT_SUPPLIER_USER_BURST', '30'))
+RATE_LIMIT_SUPPLIER_IP_RATE = float(os.environ.get('RATE_LIMIT_SUPPLIER_IP_RATE', '2'))
+RATE_LIMIT_SUPPLIER_IP_BURST = float(os.environ.get('RATE_LIMIT_SUPPLIER_IP_BURST', '60'))
+RATE_LIMIT_SUPPLIER_GLOBAL_RATE = float(os.environ.get('RATE_LIMIT_SUPPLIER_GLOBAL_RATE', '20'))
+RATE_LIMIT_SUPPLIER_GLOBAL_BURST = float(os.environ.get('RATE_LIMIT_SUPPLIER_GLOBAL_BURST', '100'))
+# Поиск с большим page_size дороже: токен за каждые RATE_LIMIT_SUPPLIER_PAGE_UNIT позиций
+RATE_LIMIT_SUPPLIER_PAGE_UNIT = int(os.environ.get('RATE_LIMIT_SUPPLIER_PAGE_UNIT', '1000'))
+
+# page_size по умолчанию в /products/*/search
+SEARCH_DEFAULT_PAGE_SIZE = 2000
+
+# Бакеты в памяти: когда их больше, удаляем полностью восстановившиеся
+RATE_LIMIT_MAX_BUCKETS = int(os.environ.get('RATE_LIMIT_MAX_BUCKETS', '50000'))
+
+# Эндпоинты, которые обращаются к API 4tochki
+SUPPLIER_PATH_PREFIXES = (
+    "/api/products/tires/search",
+    "/api/products/disks/search",
+    "/api/products/info/",
+    "/api/cars/",
+)
+
+# Пакетный поиск: число запросов к поставщику известно только из тела, поэтому
+# бюджет поставщика списывает сам эндпоинт - search_cost() за каждый размер
+SUPPLIER_BATCH_PATHS = {"/api/products/tires/search/batch"}
+
+# Служебные пути без ограничения (webhook вызывают серверы Telegram, метрики - Prometheus)
+EXEMPT_PATHS = {"/api", "/api/", "/api/health", "/api/metrics", "/api/telegram/webhook"}
+
+
+@dataclass(frozen=True)
+class Budget:
+    """Параметры бакета: пополнение rate токенов в секунду, не больше burst"""
+    name: str
+    rate: float
+    burst: float
+
+
+USER_BUDGET = Budget("user", RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST)
+IP_BUDGET = Budget("ip", RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST)
+SUPPLIER_USER_BUDGET = Budget("supplier_user", RATE_LIMIT_SUPPLIER_USER_RATE, RATE_LIMIT_SUPPLIER_USER_BURST)
+SUPPLIER_IP_BUDGET = Budget("supplier_ip", RATE_LIMIT_SUPPLIER_IP_RATE, RATE_LIMIT_SUPPLIER_IP_BURST)
+SUPPLIER_GLOBAL_BUDGET = Budget("supplier_global", RATE_LIMIT_SUPPLIER_GLOBAL_RATE, RATE_LIMIT_SUPPLIER_GLOBAL_BURST)
+
+
+def is_supplier_path(path: str) -> bool:
+    return path.startswith(SUPPLIER_PATH_PREFIXES)
+
+
+@dataclass(frozen=True)
+class RateLimitClient:
+    """Ключи клиента, по которым middleware проверило запрос (request.state.rate_limit_client)"""
+    ip: Optional[str]
+    user_key: Optional[str]
+    exempt_user: bool = False
+
+
+def search_cost(page_size: int = SEARCH_DEFAULT_PAGE_SIZE) -> float:
+    """Стоимость одного поиска у поставщика: токен за каждые RATE_LIMIT_SUPPLIER_PAGE_UNIT позиций"""
+    return max(1, math.ceil(page_size / RATE_LIMIT_SUPPLIER_PAGE_UNIT))
+
+
+def request_cost(path: str, query_params) -> float:
+    """Сколько токенов бюджета поставщика стоит запрос (пакетные пути списывают сами)"""
+    if not is_supplier_path(path) or path in SUPPLIER_BATCH_PATHS:
+        return 0
+    try:
+        default_page_size = SEARCH_DEFAULT_PAGE_SIZE if "/search" in path else 0
+        page_size = int(query_params.get("page_size") or default_page_size)
+    except ValueError:
+        page_size = 0
+    return search_cost(page_size)
+
+
+class RateLimiter:
+    """Бакеты клиентов; check() возвращает 0 или через сколько секунд повторить запрос"""
+
+    def __init__(self, backend: str = RATE_LIMIT_BACKEND, max_buckets: int = RATE_LIMIT_MAX_BUCKETS):
+        self.backend = backend
+        self.max_buckets = max_buckets
+        self.buckets: Dict[str, TokenBucket] = {}
+
+    def _bucket(self, budget: Budget, key: str) -> TokenBucket:
+        bucket_key = f"{budget.name}:{key}"
+        bucket = self.buckets.get(bucket_key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_buckets:
+                self._sweep()
+            bucket = self.buckets[bucket_key] = TokenBucket(budget.rate, budget.burst)
+        return bucket
+
+    def _sweep(self):
+        """Удалить бакеты, которые успели пополниться до конца - они равны новым"""
+        now = time.monotonic()
+        self.buckets = {
+            key: bucket for key, bucket in self.buckets.items()
+            if bucket.tokens + (now - bucket.updated_at) * bucket.rate < bucket.capacity
+        }
+        if len(self.buckets) >= self.max_buckets:
+            # Все бакеты активны (поток с множества адресов) - забываем старшую половину
+            items = list(self.buckets.items())
+            self.buckets = dict(items[len(items) // 2:])
+
+    def _check_memory(self, checks: List[Tuple[Budget, str, float]]) -> float:
+        """Проверить все бакеты и списать, только если хватает во всех (без await - атомарно)"""
+        buckets = [(self._bucket(budget, key), cost) for budget, key, cost in checks]
+        wait = max((bucket.wait_time(cost) for bucket, cost in buckets), default=0.0)
+        if wait > 0:
+            return wait
+        for bucket, cost in buckets:
+            bucket.try_acquire(cost)
+        return 0.0
+
+    async def _take_mongo(self, db: AsyncIOMotorDatabase, budget: Budget, key: str, cost: float) -> float:
+        """Атомарно пополнить и списать бакет в rate_limits (один запрос)"""
+        now = datetime.now(timezone.utc)
+        elapsed_ms = {"$max": [0, {"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}]}
+        refilled = {"$min": [
+            budget.burst,
+            {"$add": [{"$ifNull": ["$tokens", budget.burst]}, {"$multiply": [budget.rate / 1000, elapsed_ms]}]},
+        ]}
+        doc = await db[RATE_LIMITS_COLLECTION].find_one_and_update(
+            {"_id": f"{budget.name}:{key}"},
+            [
+                {"$set": {"tokens": refilled, "updated_at": now}},
+                {"$set": {"allowed": {"$gte": ["$tokens", cost]}}},
+                {"$set": {
+                    "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]},
+                    # Бакет полностью восстановится - документ больше не нужен
+                    "expires_at": now + timedelta(seconds=budget.burst / budget.rate),
+                }},
+            ],
+            projection={"_id": 0, "tokens": 1, "allowed": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc["allowed"]:
+            return 0.0
+        return (cost - doc["tokens"]) / budget.rate
+
+    async def _refund_mongo(self, db: AsyncIOMotorDatabase, budget: Budget, key: str, cost: float):
+        await db[RATE_LIMITS_COLLECTION].update_one(
+            {"_id": f"{budget.name}:{key}"},
+            [{"$set": {"tokens": {"$min": [budget.burst, {"$add": [{"$ifNull": ["$tokens", budget.burst]}, cost]}]}}}],
+        )
+
+    async def _check_mongo(self, db: AsyncIOMotorDatabase, checks: List[Tuple[Budget, str, float]]) -> float:
+        """
+        Списать бакеты по очереди; если какой-то отклонил запрос, вернуть токены уже списанным
+        При ошибке базы бакет проверяется в памяти
+        """
+        taken: List[Tuple[Budget, str, float, bool]] = []
+        for budget, key, cost in checks:
+            try:
+                wait = await self._take_mongo(db, budget, key, cost)
+                in_mongo = True
+            except Exception as e:
+                logger.error(f"Rate limit check in MongoDB failed, using in-memory buckets: {e}")
+                wait = self._bucket(budget, key).try_acquire(cost)
+                in_mongo = False
+            if wait > 0:
+                for taken_budget, taken_key, taken_cost, taken_in_mongo in taken:
+                    try:
+                        if taken_in_mongo:
+                            await self._refund_mongo(db, taken_budget, taken_key, taken_cost)
+                        else:
+                            self._bucket(taken_budget, taken_key).refund(taken_cost)
+                    except Exception as e:
+                        logger.error(f"Rate limit refund in MongoDB failed: {e}")
+                return wait
+            taken.append((budget, key, cost, in_mongo))
+        return 0.0
+
+    def _supplier_checks(
+        self, ip: Optional[str], user_key: Optional[str], cost: float, exempt_user: bool
+    ) -> List[Tuple[Budget, str, float]]:
+        checks: List[Tuple[Budget, str, float]] = []
+        if ip:
+            checks.append((SUPPLIER_IP_BUDGET, ip, cost))
+        if user_key and not exempt_user:
+            checks.append((SUPPLIER_USER_BUDGET, user_key, cost))
+        if SUPPLIER_GLOBAL_BUDGET.rate > 0:
+            checks.append((SUPPLIER_GLOBAL_BUDGET, "all", cost))
+        return checks
+
+    async def _check_all(self, db: Optional[AsyncIOMotorDatabase], checks: List[Tuple[Budget, str, float]]) -> float:
+        # Запрос дороже всего бакета иначе не прошел бы никогда
+        checks = [(budget, key, min(cost, budget.burst)) for budget, key, cost in checks if budget.rate > 0]
+        if self.backend == BACKEND_MONGO and db is not None:
+            return await self._check_mongo(db, checks)
+        return self._check_memory(checks)
+
+    async def check(
+        self,
+        db: Optional[AsyncIOMotorDatabase],
+        ip: Optional[str],
+        user_key: Optional[str],
+        supplier_cost: float = 0,
+        exempt_user: bool = False,
+    ) -> float:
+        """
+        Списать токены запроса; 0 - запрос разрешен, иначе секунды до повтора
+        Токены списываются из всех бакетов запроса или (при отказе любого) ни из одного
+        """
+        checks: List[Tuple[Budget, str, float]] = []
+        if ip:
+            checks.append((IP_BUDGET, ip, 1))
+        if user_key and not exempt_user:
+            checks.append((USER_BUDGET, user_key, 1))
+        if supplier_cost:
+            checks.extend(self._supplier_checks(ip, user_key, supplier_cost, exempt_user))
+        return await self._check_all(db, checks)
+
+    async def check_supplier(
+        self,
+        db: Optional[AsyncIOMotorDatabase],
+        ip: Optional[str],
+        user_key: Optional[str],
+        cost: float,
+        exempt_user: bool = False,
+    ) -> float:
+        """Дополнительно списать бюджет поставщика, когда стоимость запроса известна только после разбора тела"""
+        if not cost:
+            return 0.0
+        return await self._check_all(db, self._supplier_checks(ip, user_key, cost, exempt_user))
+
+# Singleton instance
+rate_limiter = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    global rate_limiter
+    if rate_limiter is None:
+        rate_limiter = RateLimiter()
+    return rate_limiter
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase):
+    await db[RATE_LIMITS_COLLECTION].create_index("expires_at", expireAfterSeconds=0)
@@ -0,0 +1,597 @@
+"""
+Аналитика спроса по поисковой активности
+Каждое событие activity_logs сразу раскладывается в документы-агрегаты (rollups)
+по дням, поэтому отчеты читают готовые счетчики, а не сканируют сырые логи
+
+Пересчет агрегатов идет в фоне: строит их во временных коллекциях и подменяет ими
+рабочие, ход пересчета виден в документе analytics_rebuild. На время пересчета запись
+агрегатов приостанавливается во всех воркерах: события попадают в activity_logs с
+пометкой rollup_pending и применяются после подмены
+"""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from models.activity import ActivityType
+
+logger = logging.getLogger(__name__)
+
+ROLLUPS_COLLECTION = "analytics_rollups"
+USER_DAYS_COLLECTION = "analytics_user_days"
+# Состояние последнего пересчета агрегатов (документ "rebuild")
+REBUILD_STATE_COLLECTION = "analytics_rebuild"
+REBUILD_STATE_ID = "rebuild"
+
+# Статусы пересчета: running - запись агрегатов приостановлена, finishing - агрегаты
+# подменены, применяются события, отложенные воркерами с устаревшим признаком пересчета
+REBUILD_RUNNING = "running"
+REBUILD_FINISHING = "finishing"
+REBUILD_DONE = "done"
+REBUILD_FAILED = "failed"
+
+# Как часто воркеры перечитывают признак пересчета (пересчет ждет вдвое дольше,
+# чтобы все воркеры успели приостановить запись агрегатов)
+ANALYTICS_REBUILD_CHECK_SECONDS = float(os.environ.get('ANALYTICS_REBUILD_CHECK_SECONDS', '1'))
+# Пересчет, который столько времени не отмечал прогресс (упал воркер), считается брошенным
+ANALYTICS_REBUILD_STALE_SECONDS = 600
+# Логов активности на одну пачку bulk_write при пересчете
+ANALYTICS_REBUILD_BATCH_SIZE = int(os.environ.get('ANALYTICS_REBUILD_BATCH_SIZE', '1000'))
+
+# Метрики, хранимые в analytics_rollups
+METRIC_TIRE_SIZE = "tire_size"
+METRIC_DISK_SIZE = "disk_size"
+METRIC_ZERO_RESULT = "zero_result"
+METRIC_BRAND_CITY = "brand_city"
+METRIC_FUNNEL = "funnel"
+METRIC_CAR = "car"
+
+# Этапы воронки: поиск -> корзина -> заказ
+FUNNEL_STAGES = {
+    ActivityType.TIRE_SEARCH.value: "search",
+    ActivityType.DISK_SEARCH.value: "search",
+    ActivityType.CART_ADD.value: "cart",
+    ActivityType.ORDER_CREATED.value: "order",
+}
+
+
+def _normalize_city(city: Optional[str]) -> Optional[str]:
+    """Убираем эмодзи-префиксы ('🏪 Тюмень' -> 'Тюмень')"""
+    if not city:
+        return None
+    return city.lstrip("🏪🚚 ").strip() or None
+
+
+def _activity_day(timestamp) -> str:
+    """День события в формате YYYY-MM-DD (UTC)"""
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if not isinstance(timestamp, datetime):
+        timestamp = datetime.now(timezone.utc)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc)
+    return timestamp.strftime("%Y-%m-%d")
+
+
+def _rollup_id(metric: str, day: str, key: Dict[str, Any]) -> str:
+    key_part = "|".join(f"{k}={key[k]}" for k in sorted(key))
+    return f"{metric}|{day}|{key_part}"
+
+
+RollupIncrement = Tuple[str, str, Dict[str, Any], Dict[str, int]]
+
+
+def _rollup_upsert(metric: str, day: str, key: Dict[str, Any], inc: Dict[str, int]) -> UpdateOne:
+    return UpdateOne(
+        {"_id": _rollup_id(metric, day, key)},
+        {
+            "$setOnInsert": {"metric": metric, "day": day, "key": key},
+            "$inc": inc,
+        },
+        upsert=True,
+    )
+
+
+def build_rollup_updates(activity: Dict[str, Any]) -> List[UpdateOne]:
+    """
+    Разложить одно событие активности в список upsert-операций над агрегатами
+    """
+    return [_rollup_upsert(*increment) for increment in _rollup_increments(activity)]
+
+
+def _rollup_increments(activity: Dict[str, Any]) -> List[RollupIncrement]:
+    """Приращения агрегатов от одного события: (метрика, день, ключ, счетчики)"""
+    activity_type = activity.get("activity_type")
+    if isinstance(activity_type, ActivityType):
+        activity_type = activity_type.value
+
+    day = _activity_day(activity.get("timestamp"))
+    params = activity.get("search_params") or {}
+    result_count = activity.get("result_count")
+    zero = 1 if result_count == 0 else 0
+
+    updates = []
+
+    if activity_type == ActivityType.TIRE_SEARCH.value:
+        if params.get("width") or params.get("height") or params.get("diameter"):
+            key = {
+                "width": params.get("width"),
+                "height": params.get("height"),
+                "diameter": params.get("diameter"),
+            }
+            updates.append((METRIC_TIRE_SIZE, day, key, {"searches": 1, "zero_results": zero}))
+    elif activity_type == ActivityType.DISK_SEARCH.value:
+        if params.get("diameter") or params.get("width") or params.get("pcd"):
+            key = {
+                "diameter": params.get("diameter"),
+                "width": params.get("width"),
+                "pcd": params.get("pcd"),
+            }
+            updates.append((METRIC_DISK_SIZE, day, key, {"searches": 1, "zero_results": zero}))
+    elif activity_type == ActivityType.CAR_SELECTION.value:
+        if params.get("brand") and params.get("model"):
+            key = {
+                "brand": params.get("brand"),
+                "model": params.get("model"),
+                "year_begin": params.get("year_begin"),
+                "year_end": params.get("year_end"),
+                "modification": params.get("modification"),
+            }
+            updates.append((METRIC_CAR, day, key, {"selections": 1, "zero_results": zero}))
+
+    if activity_type in (ActivityType.TIRE_SEARCH.value, ActivityType.DISK_SEARCH.value):
+        city = _normalize_city(params.get("city"))
+
+        if zero:
+            key = {"type": activity_type}
+            key.update({k: v for k, v in params.items() if v is not None and k != "city"})
+            key["city"] = city
+            updates.append((METRIC_ZERO_RESULT, day, key, {"count": 1}))
+
+        if params.get("brand"):
+            key = {"type": activity_type, "brand": params["brand"], "city": city}
+            updates.append((METRIC_BRAND_CITY, day, key, {"searches": 1, "zero_results": zero}))
+
+    stage = FUNNEL_STAGES.get(activity_type)
+    if stage:
+        updates.append((METRIC_FUNNEL, day, {}, {f"events.{stage}": 1}))
+
+    return updates
+
+
+async def _mark_user_stage(
+    db: AsyncIOMotorDatabase, day: str, telegram_id: str, stage: str, collection: str = USER_DAYS_COLLECTION
+) -> bool:
+    """
+    Отметить, что пользователь дошел до этапа воронки в этот день
+    Возвращает True только для первой отметки (для подсчета уникальных пользователей)
+    """
+    try:
+        result = await db[collection].update_one(
+            {"_id": f"{day}|{telegram_id}", f"stages.{stage}": {"$ne": True}},
+            {"$set": {f"stages.{stage}": True, "day": day, "telegram_id": telegram_id}},
+            upsert=True,
+        )
+        return bool(result.upserted_id or result.modified_count)
+    except DuplicateKeyError:
+        # Документ уже есть и этап уже отмечен
+        return False
+
+
+async def apply_activity(
+    db: AsyncIOMotorDatabase,
+    activity: Dict[str, Any],
+    rollups_collection: str = ROLLUPS_COLLECTION,
+    user_days_collection: str = USER_DAYS_COLLECTION,
+):
+    """Применить событие к агрегатам (без записи в activity_logs)"""
+    updates = build_rollup_updates(activity)
+
+    activity_type = activity.get("activity_type")
+    if isinstance(activity_type, ActivityType):
+        activity_type = activity_type.value
+    stage = FUNNEL_STAGES.get(activity_type)
+    telegram_id = activity.get("telegram_id")
+    if stage and telegram_id:
+        day = _activity_day(activity.get("timestamp"))
+        if await _mark_user_stage(db, day, telegram_id, stage, user_days_collection):
+            updates.append(_rollup_upsert(METRIC_FUNNEL, day, {}, {f"users.{stage}": 1}))
+
+    if updates:
+        await db[rollups_collection].bulk_write(updates, ordered=False)
+
+
+class _RebuildFlag:
+    """Идет ли пересчет агрегатов (id пересчета); читается из базы не чаще раза в ANALYTICS_REBUILD_CHECK_SECONDS"""
+
+    def __init__(self):
+        self.rebuild_id: Optional[str] = None
+        self.checked_at = 0.0
+
+    async def get(self, db: AsyncIOMotorDatabase) -> Optional[str]:
+        now = time.monotonic()
+        if now - self.checked_at >= ANALYTICS_REBUILD_CHECK_SECONDS:
+            state = await db[REBUILD_STATE_COLLECTION].find_one(
+                {"_id": REBUILD_STATE_ID, "status": REBUILD_RUNNING}, {"rebuild_id": 1}
+            )
+            self.rebuild_id = state["rebuild_id"] if state else None
+            self.checked_at = now
+        return self.rebuild_id
+
+
+_rebuild_flag = _RebuildFlag()
+
+
+async def record_activity(db: AsyncIOMotorDatabase, activity: Dict[str, Any]):
+    """
+    Записать событие в activity_logs и обновить агрегаты
+    Во время пересчета агрегатов событие только помечается rollup_pending - его применит пересчет.
+    Ошибка агрегации не должна ломать основной запрос
+    """
+    try:
+        rebuild_id = await _rebuild_flag.get(db)
+    except Exception as e:
+        logger.error(f"Failed to check analytics rebuild state: {e}")
+        rebuild_id = None
+    if rebuild_id:
+        await db.activity_logs.insert_one({**activity, "rollup_pending": rebuild_id})
+        return
+    await db.activity_logs.insert_one(activity)
+    try:
+        await apply_activity(db, activity)
+    except Exception as e:
+        logger.error(f"Failed to update analytics rollups: {e}")
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase):
+    """Индексы для чтения агрегатов по метрике и диапазону дней"""
+    await db[ROLLUPS_COLLECTION].create_index([("metric", 1), ("day", 1)])
+    await db[USER_DAYS_COLLECTION].create_index("day")
+
+
+async def reset_rollups(db: AsyncIOMotorDatabase):
+    """Удалить все агрегаты (при сбросе активности)"""
+    await db[ROLLUPS_COLLECTION].delete_many({})
+    await db[USER_DAYS_COLLECTION].delete_many({})
+
+
+class RebuildInProgress(Exception):
+    """Пересчет агрегатов уже идет"""
+
+
+async def _apply_pending(db: AsyncIOMotorDatabase, rebuild_id: str) -> int:
+    """Применить к рабочим агрегатам события, отложенные пересчетом (каждое - ровно один раз)"""
+    applied = 0
+    while True:
+        activity = await db.activity_logs.find_one_and_update(
+            {"rollup_pending": rebuild_id}, {"$unset": {"rollup_pending": ""}}, projection={"_id": 0}
+        )
+        if activity is None:
+            return applied
+        activity.pop("rollup_pending", None)
+        await apply_activity(db, activity)
+        applied += 1
+
+
+async def _rebuild_batch(db: AsyncIOMotorDatabase, activities: List[Dict[str, Any]], rollups: str, user_days: str):
+    """
+    Учесть пачку логов во временных агрегатах: одинаковые агрегаты суммируются в памяти,
+    отметки пользователей пишутся одним bulk_write (users.* воронки считаются после всех пачек)
+    """
+    increments: Dict[str, RollupIncrement] = {}
+    marks: Dict[str, Dict[str, Any]] = {}
+    for activity in activities:
+        for metric, day, key, inc in _rollup_increments(activity):
+            rollup_id = _rollup_id(metric, day, key)
+            if rollup_id not in increments:
+                increments[rollup_id] = (metric, day, key, {})
+            total = increments[rollup_id][3]
+            for field, value in inc.items():
+                total[field] = total.get(field, 0) + value
+
+        activity_type = activity.get("activity_type")
+        if isinstance(activity_type, ActivityType):
+            activity_type = activity_type.value
+        stage = FUNNEL_STAGES.get(activity_type)
+        telegram_id = activity.get("telegram_id")
+        if stage and telegram_id:
+            day = _activity_day(activity.get("timestamp"))
+            mark = marks.setdefault(f"{day}|{telegram_id}", {"day": day, "telegram_id": telegram_id})
+            mark[f"stages.{stage}"] = True
+
+    if increments:
+        await db[rollups].bulk_write([_rollup_upsert(*increment) for increment in increments.values()], ordered=False)
+    if marks:
+        await db[user_days].bulk_write(
+            [UpdateOne({"_id": mark_id}, {"$set": mark}, upsert=True) for mark_id, mark in marks.items()],
+            ordered=False,
+        )
+
+
+async def _rebuild_funnel_users(db: AsyncIOMotorDatabase, rollups: str, user_days: str):
+    """Уникальные пользователи этапов воронки по дням - из отметок пользователей"""
+    stages = ("search", "cart", "order")
+    updates = []
+    async for row in db[user_days].aggregate([
+        {"$group": {
+            "_id": "$day",
+            **{stage: {"$sum": {"$cond": [{"$eq": [f"$stages.{stage}", True]}, 1, 0]}} for stage in stages},
+        }},
+    ]):
+        users = {f"users.{stage}": row[stage] for stage in stages if row[stage]}
+        if users:
+            updates.append(_rollup_upsert(METRIC_FUNNEL, row["_id"], {}, users))
+        if len(updates) >= ANALYTICS_REBUILD_BATCH_SIZE:
+            await db[rollups].bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        await db[rollups].bulk_write(updates, ordered=False)
+
+
+async def _run_rebuild(db: AsyncIOMotorDatabase, rebuild_id: str) -> int:
+    """
+    Пересчитать агрегаты с нуля по существующим activity_logs (пересчет уже заявлен в analytics_rebuild)
+    Агрегаты строятся во временных коллекциях и подменяют рабочие; события, пришедшие
+    во время пересчета, откладываются (rollup_pending) и применяются после подмены
+    """
+    state = db[REBUILD_STATE_COLLECTION]
+    state_filter = {"_id": REBUILD_STATE_ID, "rebuild_id": rebuild_id}
+    rollups_tmp = f"{ROLLUPS_COLLECTION}_{rebuild_id}"
+    user_days_tmp = f"{USER_DAYS_COLLECTION}_{rebuild_id}"
+    processed = 0
+    pending = 0
+    try:
+        # Ждем, пока все воркеры увидят пересчет: дальше новые события только откладываются
+        await asyncio.sleep(ANALYTICS_REBUILD_CHECK_SECONDS * 2)
+
+        # События, отложенные прошлым пересчетом и не примененные (воркер упал), учитываются здесь же
+        cursor = db.activity_logs.find({"rollup_pending": {"$ne": rebuild_id}}, {"_id": 0, "rollup_pending": 0})
+        batch = []
+        async for activity in cursor.batch_size(ANALYTICS_REBUILD_BATCH_SIZE):
+            batch.append(activity)
+            if len(batch) < ANALYTICS_REBUILD_BATCH_SIZE:
+                continue
+            await _rebuild_batch(db, batch, rollups_tmp, user_days_tmp)
+            processed += len(batch)
+            batch = []
+            await state.update_one(
+                state_filter, {"$set": {"processed": processed, "heartbeat_at": datetime.now(timezone.utc)}}
+            )
+        if batch:
+            await _rebuild_batch(db, batch, rollups_tmp, user_days_tmp)
+            processed += len(batch)
+        await _rebuild_funnel_users(db, rollups_tmp, user_days_tmp)
+        await db.activity_logs.update_many(
+            {"rollup_pending": {"$exists": True, "$ne": rebuild_id}}, {"$unset": {"rollup_pending": ""}}
+        )
+
+        await db[rollups_tmp].create_index([("metric", 1), ("day", 1)])
+        await db[user_days_tmp].create_index("day")
+        await db[rollups_tmp].rename(ROLLUPS_COLLECTION, dropTarget=True)
+        await db[user_days_tmp].rename(USER_DAYS_COLLECTION, dropTarget=True)
+
+        pending = await _apply_pending(db, rebuild_id)
+        # Запись агрегатов возобновляется; воркеры еще могли отложить события, пока не перечитали признак
+        await state.update_one(
+            state_filter,
+            {"$set": {
+                "status": REBUILD_FINISHING,
+                "processed": processed,
+                "pending": pending,
+                "heartbeat_at": datetime.now(timezone.utc),
+            }},
+        )
+        await asyncio.sleep(ANALYTICS_REBUILD_CHECK_SECONDS * 2)
+        pending += await _apply_pending(db, rebuild_id)
+    except BaseException as e:
+        await db[rollups_tmp].drop()
+        await db[user_days_tmp].drop()
+        await state.update_one(
+            state_filter,
+            {"$set": {
+                "status": REBUILD_FAILED,
+                "error": str(e) or type(e).__name__,
+                "processed": processed,
+                "finished_at": datetime.now(timezone.utc),
+            }},
+        )
+        raise
+
+    await state.update_one(
+        state_filter,
+        {"$set": {
+            "status": REBUILD_DONE,
+            "processed": processed,
+            "pending": pending,
+            "finished_at": datetime.now(timezone.utc),
+        }},
+    )
+    logger.info(f"Analytics rollups rebuilt from {processed} activity logs, {pending} applied after swap")
+    return processed + pending
+
+
+# Фоновая задача пересчета в воркере, принявшем запрос
+_rebuild_task: Optional[asyncio.Task] = None
+
+
+async def start_rebuild(db: AsyncIOMotorDatabase, requested_by: Optional[str] = None) -> str:
+    """
+    Заявить пересчет агрегатов и запустить его в фоне; возвращает rebuild_id
+    Ход пересчета - get_rebuild_state(). RebuildInProgress - пересчет уже идет
+    """
+    global _rebuild_task
+    rebuild_id = uuid.uuid4().hex
+    now = datetime.now(timezone.utc)
+    stale = now - timedelta(seconds=ANALYTICS_REBUILD_STALE_SECONDS)
+    try:
+        await db[REBUILD_STATE_COLLECTION].replace_one(
+            {
+                "_id": REBUILD_STATE_ID,
+                "$or": [
+                    {"status": {"$nin": [REBUILD_RUNNING, REBUILD_FINISHING]}},
+                    {"heartbeat_at": {"$lt": stale}},
+                ],
+            },
+            {
+                "rebuild_id": rebuild_id,
+                "status": REBUILD_RUNNING,
+                "requested_by": requested_by,
+                "processed": 0,
+                "pending": 0,
+                "started_at": now,
+                "heartbeat_at": now,
+                "finished_at": None,
+                "error": None,
+            },
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        raise RebuildInProgress()
+
+    async def run():
+        try:
+            await _run_rebuild(db, rebuild_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Analytics rebuild {rebuild_id} failed: {e}")
+
+    _rebuild_task = asyncio.create_task(run())
+    return rebuild_id
+
+
+async def stop_rebuild():
+    """Прервать пересчет этого воркера (остановка приложения); временные агрегаты удаляются"""
+    global _rebuild_task
+    if _rebuild_task is not None:
+        _rebuild_task.cancel()
+        try:
+            await _rebuild_task
+        except asyncio.CancelledError:
+            pass
+        _rebuild_task = None
+
+
+async def get_rebuild_state(db: AsyncIOMotorDatabase) -> Optional[Dict[str, Any]]:
+    """Состояние последнего пересчета агрегатов (None - пересчетов не было)"""
+    return await db[REBUILD_STATE_COLLECTION].find_one({"_id": REBUILD_STATE_ID}, {"_id": 0})
+
+
+def _day_range(days: int) -> Dict[str, str]:
+    since = datetime.now(timezone.utc) - timedelta(days=days - 1)
+    return {"$gte": since.strftime("%Y-%m-%d")}
+
+
+async def _top_keys(
+    db: AsyncIOMotorDatabase,
+    metric: str,
+    days: int,
+    limit: int,
+    sum_fields: List[str],
+    sort_field: str,
+    extra_match: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    match = {"metric": metric, "day": _day_range(days)}
+    if extra_match:
+        match.update(extra_match)
+    group = {"_id": "$key"}
+    for field in sum_fields:
+        group[field] = {"$sum": f"${field}"}
+    pipeline = [
+        {"$match": match},
+        {"$group": group},
+        {"$sort": {sort_field: -1}},
+        {"$limit": limit},
+    ]
+    rows = await db[ROLLUPS_COLLECTION].aggregate(pipeline).to_list(limit)
+    return [{**row.pop("_id"), **row} for row in rows]
+
+
+async def get_top_sizes(db: AsyncIOMotorDatabase, days: int = 30, limit: int = 20) -> Dict[str, List]:
+    """Самые запрашиваемые размеры шин и дисков"""
+    fields = ["searches", "zero_results"]
+    return {
+        "tires": await _top_keys(db, METRIC_TIRE_SIZE, days, limit, fields, "searches"),
+        "disks": await _top_keys(db, METRIC_DISK_SIZE, days, limit, fields, "searches"),
+    }
+
+
+async def get_top_vehicles(db: AsyncIOMotorDatabase, days: int = 30, limit: int = 20) -> List[Dict]:
+    """Самые частые автомобили в подборе по авто"""
+    return await _top_keys(db, METRIC_CAR, days, limit, ["selections", "zero_results"], "selections")
+
+
+async def get_zero_result_searches(db: AsyncIOMotorDatabase, days: int = 30, limit: int = 50) -> List[Dict]:
+    """Поиски без результатов, сгруппированные по параметрам"""
+    return await _top_keys(db, METRIC_ZERO_RESULT, days, limit, ["count"], "count")
+
+
+async def get_brand_demand(
+    db: AsyncIOMotorDatabase,
+    days: int = 30,
+    limit: int = 100,
+    city: Optional[str] = None,
+) -> List[Dict]:
+    """Спрос на бренды в разрезе городов"""
+    extra_match = {"key.city": _normalize_city(city)} if city else None
+    return await _top_keys(
+        db, METRIC_BRAND_CITY, days, limit, ["searches", "zero_results"], "searches", extra_match
+    )
+
+
+async def _period_unique_users(db: AsyncIOMotorDatabase, days: int) -> Dict[str, int]:
+    """Уникальные пользователи этапов воронки за период (а не сумма уникальных по дням)"""
+    # В отметках, записанных до появления поля telegram_id, он есть только в _id ("день|telegram_id")
+    telegram_id = {"$ifNull": ["$telegram_id", {"$arrayElemAt": [{"$split": ["$_id", "|"]}, 1]}]}
+    stages = ("search", "cart", "order")
+    rows = await db[USER_DAYS_COLLECTION].aggregate([
+        {"$match": {"day": _day_range(days)}},
+        {"$group": {"_id": telegram_id, **{stage: {"$max": f"$stages.{stage}"} for stage in stages}}},
+        {"$group": {"_id": None, **{stage: {"$sum": {"$cond": [f"${stage}", 1, 0]}} for stage in stages}}},
+    ]).to_list(1)
+    if not rows:
+        return {}
+    return {stage: rows[0][stage] for stage in stages}
+
+
+async def get_conversion(db: AsyncIOMotorDatabase, days: int = 30) -> Dict[str, Any]:
+    """
+    Воронка поиск -> корзина -> заказ по дням и в сумме за период
+    totals.users - уникальные пользователи за период (по ним считаются конверсии),
+    totals.user_days - сумма уникальных пользователей по дням
+    """
+    rows = await db[ROLLUPS_COLLECTION].find(
+        {"metric": METRIC_FUNNEL, "day": _day_range(days)},
+        {"_id": 0, "day": 1, "events": 1, "users": 1},
+    ).sort("day", 1).to_list(days)
+
+    totals = {"events": {}, "user_days": {}}
+    daily = []
+    for row in rows:
+        events = row.get("events", {})
+        users = row.get("users", {})
+        for stage in ("search", "cart", "order"):
+            totals["events"][stage] = totals["events"].get(stage, 0) + events.get(stage, 0)
+            totals["user_days"][stage] = totals["user_days"].get(stage, 0) + users.get(stage, 0)
+        daily.append({"day": row["day"], "events": events, "users": users})
+    totals["users"] = await _period_unique_users(db, days)
+
+    def _rate(numerator: int, denominator: int) -> float:
+        return round(numerator / denominator * 100, 2) if denominator else 0.0
+
+    users = totals["users"]
+    return {
+        "totals": totals,
+        "search_to_cart": _rate(users.get("cart", 0), users.get("search", 0)),
+        "cart_to_order": _rate(users.get("order", 0), users.get("cart", 0)),
+        "search_to_order": _rate(users.get("order", 0), users.get("search", 0)),
+        "daily": daily,
+    }
@@ -0,0 +1,189 @@
+"""
+Фасеты и уточняющие фильтры для результатов поиска шин и дисков
+
+Фасеты (количество товаров по брендам, сезонам, шипам, runflat, индексам
+нагрузки/скорости, гистограмма цен) считаются за один проход по базовому
+результату поиска - после фильтра по городу, до уточняющих фильтров - и
+кэшируются по базовому запросу. Уточнение (несколько брендов, диапазон цен
+и т.д.) применяется на сервере, поэтому клиенту не нужно скачивать все 2000
+товаров, чтобы отфильтровать их у себя
+"""
+
+import json
+import math
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from services.supplier_cache import SUPPLIER_SEARCH_CACHE_TTL, TIRE_SEASONS
+from utils.ttl_cache import SingleFlightCache
+
+PRICE_HISTOGRAM_BUCKETS = 10
+
+
+def _flag(name: str) -> Callable[[Dict], Optional[bool]]:
+    return lambda item: bool(item[name]) if item.get(name) is not None else None
+
+
+def _text(name: str) -> Callable[[Dict], Optional[str]]:
+    return lambda item: str(item[name]).strip() if item.get(name) not in (None, '') else None
+
+
+# Фасет -> значение товара (None - товар в фасете не учитывается)
+TIRE_FACETS: Dict[str, Callable[[Dict], Any]] = {
+    "brand": _text("brand"),
+    "season": lambda item: (item.get("season") or "").lower() or None,
+    "studded": _flag("thorn"),
+    "runflat": _flag("runflat"),
+    "load_index": _text("load_index"),
+    "speed_index": _text("speed_index"),
+}
+
+DISK_FACETS: Dict[str, Callable[[Dict], Any]] = {
+    "brand": _text("brand"),
+    "color": _text("color"),
+    "pcd": _text("pcd"),
+    "diameter": lambda item: item.get("diameter"),
+    "width": lambda item: item.get("width"),
+    "et": _text("et"),
+    "dia": _text("dia"),
+}
+
+
+def _season_code(season: str) -> str:
+    """'winter' / 'w' -> 'w'"""
+    season = season.strip().lower()
+    return TIRE_SEASONS.get(season, season)
+
+
+@dataclass
+class SearchFilters:
+    """Уточняющие фильтры; пустой список или None - фильтр не задан"""
+    brands: List[str] = field(default_factory=list)
+    seasons: List[str] = field(default_factory=list)
+    studded: Optional[bool] = None
+    runflat: Optional[bool] = None
+    load_indexes: List[str] = field(default_factory=list)
+    speed_indexes: List[str] = field(default_factory=list)
+    colors: List[str] = field(default_factory=list)
+    pcds: List[str] = field(default_factory=list)
+    price_min: Optional[float] = None
+    price_max: Optional[float] = None
+
+    def __post_init__(self):
+        # Сравнение без учета регистра
+        self.brands = [value.strip().lower() for value in self.brands or [] if value.strip()]
+        self.seasons = [_season_code(value) for value in self.seasons or [] if value.strip()]
+        self.load_indexes = [value.strip() for value in self.load_indexes or [] if value.strip()]
+        self.speed_indexes = [value.strip().upper() for value in self.speed_indexes or [] if value.strip()]
+        self.colors = [value.strip().lower() for value in self.colors or [] if value.strip()]
+        self.pcds = [value.strip().lower() for value in self.pcds or [] if value.strip()]
+
+    def is_empty(self) -> bool:
+        return not any([
+            self.brands, self.seasons, self.load_indexes, self.speed_indexes, self.colors, self.pcds,
+            self.studded is not None, self.runflat is not None,
+            self.price_min is not None, self.price_max is not None,
+        ])
+
+    def matches(self, item: Dict) -> bool:
+        if self.brands and str(item.get("brand", "")).lower() not in self.brands:
+            return False
+        if self.seasons and (item.get("season") or "").lower() not in self.seasons:
+            return False
+        if self.studded is not None and bool(item.get("thorn")) != self.studded:
+            return False
+        if self.runflat is not None and bool(item.get("runflat")) != self.runflat:
+            return False
+        if self.load_indexes and str(item.get("load_index", "")) not in self.load_indexes:
+            return False
+        if self.speed_indexes and str(item.get("speed_index", "")).upper() not in self.speed_indexes:
+            return False
+        if self.colors and str(item.get("color", "")).lower() not in self.colors:
+            return False
+        if self.pcds and str(item.get("pcd", "")).lower() not in self.pcds:
+            return False
+        price = item.get("price", 0)
+        if self.price_min is not None and price < self.price_min:
+            return False
+        if self.price_max is not None and price > self.price_max:
+            return False
+        return True
+
+    def apply(self, items: List[Dict]) -> List[Dict]:
+        if self.is_empty():
+            return items
+        return [item for item in items if self.matches(item)]
+
+
+def _price_histogram(prices: List[float], buckets: int = PRICE_HISTOGRAM_BUCKETS) -> List[Dict]:
+    """Гистограмма цен с шагом, округленным до 100 ₽"""
+    if not prices:
+        return []
+    low, high = min(prices), max(prices)
+    step = max(100, math.ceil((high - low) / buckets / 100) * 100)
+    start = math.floor(low / step) * step
+    counts: Dict[int, int] = {}
+    for price in prices:
+        index = int((price - start) // step)
+        counts[index] = counts.get(index, 0) + 1
+    return [
+        {"from": start + index * step, "to": start + (index + 1) * step, "count": counts.get(index, 0)}
+        for index in range(max(counts) + 1)
+    ]
+
+
+def compute_facets(items: List[Dict], facets: Dict[str, Callable[[Dict], Any]]) -> Dict[str, Any]:
+    """Фасеты за один проход по товарам"""
+    counters: Dict[str, Dict[Any, int]] = {name: {} for name in facets}
+    prices = []
+    for item in items:
+        for name, value_of in facets.items():
+            value = value_of(item)
+            if value is not None:
+                counters[name][value] = counters[name].get(value, 0) + 1
+        if item.get("price") is not None:
+            prices.append(float(item["price"]))
+
+    result: Dict[str, Any] = {
+        name: [
+            {"value": value, "count": count}
+            for value, count in sorted(values.items(), key=lambda pair: (-pair[1], str(pair[0])))
+        ]
+        for name, values in counters.items()
+    }
+    result["price"] = {
+        "min": min(prices) if prices else None,
+        "max": max(prices) if prices else None,
+        "histogram": _price_histogram(prices),
+    }
+    result["total"] = len(items)
+    return result
+
+
+def facet_key(kind: str, *parts: Any) -> str:
+    """Ключ кэша фасетов по базовому запросу"""
+    return kind + ":" + json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+
+
+class FacetCache:
+    """Фасеты базовых запросов поиска (живут столько же, сколько ответы поставщика)"""
+
+    def __init__(self, ttl: int = SUPPLIER_SEARCH_CACHE_TTL, max_entries: int = 500):
+        self.cache = SingleFlightCache("search_facets", ttl=ttl, max_entries=max_entries)
+
+    async def get_facets(self, key: str, items: List[Dict], facets: Dict[str, Callable[[Dict], Any]]) -> Dict:
+        async def build():
+            return compute_facets(items, facets)
+
+        return await self.cache.get_or_load(key, build)
+
+
+# Singleton instance
+facet_cache = None
+
+
+def get_facet_cache() -> FacetCache:
+    global facet_cache
+    if facet_cache is None:
+        facet_cache = FacetCache()
+    return facet_cache
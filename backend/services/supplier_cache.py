@@ -0,0 +1,468 @@
+"""
+Кэш ответов поставщика 4tochki (stale-while-revalidate)
+
+Все read-методы FourthchkiClient, которые вызывают роутеры products и cars,
+идут через кэш. Запись свежая TTL секунд, после этого еще SUPPLIER_STALE_GRACE
+секунд она отдается сразу, а обновление у поставщика запускается в фоне -
+покупатель не ждет SOAP ради цены, устаревшей на несколько минут. Одновременные
+запросы одного ключа ждут один вызов SOAP.
+
+Подбор по автомобилю (GetGoodsByCar): Mini App запрашивает шины и диски
+отдельными запросами, поэтому у поставщика всегда запрашиваются оба типа сразу
+(['tyre', 'disk']), а ответ делится по типам - выбор автомобиля стоит не больше
+одного обращения к поставщику за время жизни кэша.
+
+Поиск шин и дисков кэшируется по параметрам запроса к поставщику. Параметры
+строятся функциями tire_search_params/disk_search_params - ими же пользуется
+прогрев кэша.
+
+Возраст данных каждого ответа учитывается в RequestFreshness текущего HTTP
+запроса (заголовки Age и X-Cache). Запрос с Cache-Control: no-cache (middleware
+в server.py) всегда получает данные от поставщика - так клиент перечитывает цену
+и остаток перед оформлением заказа; методы кэша с fresh=True делают то же для
+одного вызова
+"""
+
+import asyncio
+import logging
+import os
+import re
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from services.fourthchki_client import FourthchkiClient
+from utils.ttl_cache import CACHE_HIT, CACHE_STALE, CacheResult, SingleFlightCache
+
+logger = logging.getLogger(__name__)
+
+FITMENT_GOODS_CACHE_TTL = int(os.environ.get('FITMENT_GOODS_CACHE_TTL', '600'))
+FITMENT_GOODS_CACHE_SIZE = int(os.environ.get('FITMENT_GOODS_CACHE_SIZE', '2000'))
+SUPPLIER_SEARCH_CACHE_TTL = int(os.environ.get('SUPPLIER_SEARCH_CACHE_TTL', '600'))
+SUPPLIER_SEARCH_CACHE_SIZE = int(os.environ.get('SUPPLIER_SEARCH_CACHE_SIZE', '500'))
+SUPPLIER_INFO_CACHE_TTL = int(os.environ.get('SUPPLIER_INFO_CACHE_TTL', '300'))
+SUPPLIER_WAREHOUSES_CACHE_TTL = int(os.environ.get('SUPPLIER_WAREHOUSES_CACHE_TTL', '3600'))
+# Марки, модели, годы и модификации авто почти не меняются
+SUPPLIER_CATALOG_CACHE_TTL = int(os.environ.get('SUPPLIER_CATALOG_CACHE_TTL', '86400'))
+# Сколько еще секунд после TTL отдавать устаревший ответ, обновляя его в фоне
+SUPPLIER_STALE_GRACE = int(os.environ.get('SUPPLIER_STALE_GRACE', '900'))
+
+# Размер страницы, который запрашивает Mini App (все товары одним ответом)
+SEARCH_PAGE_SIZE = 2000
+
+TIRE_SEASONS = {
+    'summer': 's',
+    'winter': 'w',
+    'all-season': 'u',
+    'winter-studded': 'w',  # Зимние с шипами
+    'winter-non-studded': 'w'  # Зимние без шипов
+}
+
+PRODUCT_TYPES = ('tyre', 'disk')
+
+# Типы подбора GetGoodsByCar: заводская комплектация и допустимая замена
+FITMENT_TYPES = {'original': 1, 'replacement': 2}
+
+# Ключи списка товаров в ответе GetGoodsByCar
+_PRICE_REST_KEYS = {'TyrePriceRest': 'tyre', 'DiskPriceRest': 'disk'}
+
+_TYRE_SIZE = re.compile(r'\d+/\d+R\d+')
+_DISK_SIZE = re.compile(r'\d+\.?\d*x\d+')
+
+
+class RequestFreshness:
+    """Свежесть данных поставщика, использованных в ответе на один HTTP запрос"""
+
+    def __init__(self, fresh_required: bool = False):
+        self.fresh_required = fresh_required
+        self.age: Optional[float] = None
+        self.status: Optional[str] = None
+
+    def note(self, result: CacheResult):
+        self.age = max(self.age or 0.0, result.age)
+        # Итог по худшему источнику: stale > загрузка > свежий кэш
+        if result.status == CACHE_STALE or self.status == CACHE_STALE:
+            self.status = CACHE_STALE
+        elif result.status != CACHE_HIT or self.status not in (None, CACHE_HIT):
+            self.status = "miss"
+        else:
+            self.status = CACHE_HIT
+
+    def headers(self) -> Dict[str, str]:
+        """Age (секунды с загрузки у поставщика) и X-Cache: HIT/STALE/MISS"""
+        if self.status is None:
+            return {}
+        return {"Age": str(int(self.age)), "X-Cache": self.status.upper()}
+
+
+_request_freshness: ContextVar[Optional[RequestFreshness]] = ContextVar("supplier_request_freshness", default=None)
+
+
+def track_request_freshness(fresh_required: bool = False) -> RequestFreshness:
+    """Начать учет свежести для текущего HTTP запроса (вызывается из middleware)"""
+    freshness = RequestFreshness(fresh_required)
+    _request_freshness.set(freshness)
+    return freshness
+
+
+def _fresh_required(fresh: bool) -> bool:
+    freshness = _request_freshness.get()
+    return fresh or bool(freshness and freshness.fresh_required)
+
+
+def _note(result: CacheResult):
+    freshness = _request_freshness.get()
+    if freshness is not None:
+        freshness.note(result)
+
+
+def _item_type(item: Dict, default: str) -> str:
+    """Тип товара: поле type, если поставщик его вернул, иначе по размеру в названии"""
+    item_type = str(item.get('type') or '').lower()
+    if item_type in PRODUCT_TYPES:
+        return item_type
+    name = item.get('name', '')
+    if _TYRE_SIZE.search(name):
+        return 'tyre'
+    if _DISK_SIZE.search(name):
+        return 'disk'
+    return default
+
+
+def split_goods_by_type(response: Dict) -> Dict[str, Dict]:
+    """
+    Разделить ответ GetGoodsByCar по типам товаров
+    Возвращает {'tyre': ответ, 'disk': ответ}; price_rest_list в них - список,
+    склады, курс валют и ошибка общие
+    """
+    groups: Dict[str, List[Dict]] = {product_type: [] for product_type in PRODUCT_TYPES}
+    price_rest_list = response.get('price_rest_list') or {}
+
+    if isinstance(price_rest_list, dict):
+        sections = [
+            (_PRICE_REST_KEYS.get(key, 'tyre'), items)
+            for key, items in price_rest_list.items()
+        ]
+    else:
+        sections = [('tyre', price_rest_list)]
+
+    for default, items in sections:
+        if isinstance(items, dict):
+            items = [items]
+        for item in items or []:
+            groups[_item_type(item, default)].append(item)
+
+    return {
+        product_type: {**response, 'price_rest_list': items}
+        for product_type, items in groups.items()
+    }
+
+
+def _is_cacheable(split: Dict[str, Dict]) -> bool:
+    # Ответ с ошибкой (кроме предупреждения 52) не кэшируем - она может быть временной
+    error = split['tyre'].get('error')
+    return not (error and error.get('code') and error.get('code') not in [52])
+
+
+class FitmentGoodsCache:
+    """Подбор товаров по автомобилю с кэшем и объединением одновременных запросов"""
+
+    def __init__(self, ttl: int = FITMENT_GOODS_CACHE_TTL, max_entries: int = FITMENT_GOODS_CACHE_SIZE):
+        self.cache = SingleFlightCache("fitment_goods", ttl=ttl, max_entries=max_entries, stale_ttl=SUPPLIER_STALE_GRACE)
+
+    @staticmethod
+    def make_key(brand: str, model: str, year_begin: str, year_end: str,
+                 modification: Optional[str], podbor_type: List[int]) -> tuple:
+        return (
+            brand.strip(),
+            model.strip(),
+            str(year_begin).strip(),
+            str(year_end).strip(),
+            (modification or '').strip(),
+            tuple(podbor_type),
+        )
+
+    async def get_goods(
+        self,
+        client: FourthchkiClient,
+        brand: str,
+        model: str,
+        year_begin: str,
+        year_end: str,
+        modification: Optional[str] = None,
+        product_type: Optional[str] = 'tyre',
+        podbor_type: Optional[List[int]] = None,
+        fresh: bool = False,
+    ) -> Dict:
+        """Ответ GetGoodsByCar для одного типа товаров (tyre или disk); пустой тип - шины и диски вместе"""
+        split = await self.get_all_goods(
+            client, brand, model, year_begin, year_end, modification, podbor_type, fresh=fresh
+        )
+        if product_type:
+            return split[product_type]
+        return {
+            **split['tyre'],
+            'price_rest_list': [item for goods_type in PRODUCT_TYPES for item in split[goods_type]['price_rest_list']],
+        }
+
+    async def get_goods_by_fitment(
+        self,
+        client: FourthchkiClient,
+        brand: str,
+        model: str,
+        year_begin: str,
+        year_end: str,
+        modification: Optional[str] = None,
+        product_type: Optional[str] = 'tyre',
+        fitments: tuple = ('original', 'replacement'),
+        fresh: bool = False,
+    ) -> Dict[str, object]:
+        """
+        Ответы GetGoodsByCar для нескольких типов подбора, запрошенные параллельно
+        Каждый тип подбора кэшируется отдельно; вместо ответа с ошибкой возвращается исключение
+        """
+        results = await asyncio.gather(
+            *(
+                self.get_goods(
+                    client, brand, model, year_begin, year_end, modification,
+                    product_type=product_type,
+                    podbor_type=[FITMENT_TYPES[fitment]],
+                    fresh=fresh,
+                )
+                for fitment in fitments
+            ),
+            return_exceptions=True,
+        )
+        return dict(zip(fitments, results))
+
+    async def get_all_goods(
+        self,
+        client: FourthchkiClient,
+        brand: str,
+        model: str,
+        year_begin: str,
+        year_end: str,
+        modification: Optional[str] = None,
+        podbor_type: Optional[List[int]] = None,
+        refresh: bool = False,
+        fresh: bool = False,
+    ) -> Dict[str, Dict]:
+        """
+        Шины и диски для автомобиля одним вызовом поставщика: {'tyre': ответ, 'disk': ответ}
+        refresh=True - прогрев: обновить запись, не учитывая в статистике запросов
+        fresh=True - ответ только от поставщика, без кэша
+        """
+        podbor_type = podbor_type or [1]
+        key = self.make_key(brand, model, year_begin, year_end, modification, podbor_type)
+
+        async def load():
+            logger.info(f"GetGoodsByCar {key[:5]} podbor_type={podbor_type}")
+            # zeep блокирующий - вызываем в отдельном потоке
+            response = await asyncio.to_thread(
+                client.get_goods_by_car,
+                brand=brand,
+                model=model,
+                year_begin=year_begin,
+                year_end=year_end,
+                modification=modification or "",
+                product_type=list(PRODUCT_TYPES),
+                podbor_type=podbor_type,
+            )
+            return split_goods_by_type(response)
+
+        if refresh:
+            return await self.cache.refresh(key, load, should_cache=_is_cacheable)
+        result = await self.cache.fetch(key, load, should_cache=_is_cacheable, fresh=_fresh_required(fresh))
+        _note(result)
+        return result.value
+
+    def get_stats(self) -> Dict:
+        return self.cache.get_stats()
+
+    def clear(self):
+        self.cache.clear()
+
+
+def tire_search_params(
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    diameter: Optional[int] = None,
+    season: Optional[str] = None,
+    brand: Optional[str] = None,
+    page: int = 0,
+    page_size: int = SEARCH_PAGE_SIZE,
+) -> Dict:
+    """Параметры FourthchkiClient.search_tires для поиска шин из Mini App"""
+    return {
+        'season_list': [TIRE_SEASONS[season]] if season in TIRE_SEASONS else None,
+        'width_min': width,
+        'width_max': width,
+        'height_min': height,
+        'height_max': height,
+        'diameter_min': diameter,
+        'diameter_max': diameter,
+        'brand_list': [brand] if brand else None,
+        'page': page,
+        'page_size': page_size,
+    }
+
+
+def disk_search_params(
+    diameter: Optional[int] = None,
+    width: Optional[float] = None,
+    brand: Optional[str] = None,
+    pcd: Optional[str] = None,
+    et_min: Optional[float] = None,
+    et_max: Optional[float] = None,
+    dia_min: Optional[float] = None,
+    dia_max: Optional[float] = None,
+    color: Optional[str] = None,
+    disk_type: Optional[int] = None,
+    page: int = 0,
+    page_size: int = SEARCH_PAGE_SIZE,
+) -> Dict:
+    """Параметры FourthchkiClient.search_disks для поиска дисков из Mini App"""
+    # PCD "5x114.3" -> bolts_count=5, bolts_spacing=114.3
+    bolts_count = None
+    bolts_spacing = None
+    if pcd:
+        pcd_match = re.match(r'(\d+)x([\d.]+)', pcd)
+        if pcd_match:
+            bolts_count = int(pcd_match.group(1))
+            bolts_spacing = float(pcd_match.group(2))
+
+    return {
+        'diameter_min': diameter,
+        'diameter_max': diameter,
+        'width_min': width,
+        'width_max': width,
+        'brand_list': [brand] if brand else None,
+        'bolts_count_min': bolts_count,
+        'bolts_count_max': bolts_count,
+        'bolts_spacing_min': bolts_spacing,
+        'bolts_spacing_max': bolts_spacing,
+        'et_min': et_min,
+        'et_max': et_max,
+        'dia_min': dia_min,
+        'dia_max': dia_max,
+        'color_list': [color] if color else None,
+        'type_list': [disk_type] if disk_type is not None else None,
+        'page': page,
+        'page_size': page_size,
+    }
+
+
+def _freeze(params: Dict) -> tuple:
+    """Ключ кэша из параметров запроса (списки -> кортежи)"""
+    return tuple(
+        (name, tuple(value) if isinstance(value, list) else value)
+        for name, value in sorted(params.items())
+    )
+
+
+def _response_is_cacheable(response: Dict) -> bool:
+    # Ответ с ошибкой не кэшируем - она может быть временной
+    error = response.get('error')
+    return not (error and (error.get('code') or error.get('comment') or error.get('Message')))
+
+
+# Read-методы FourthchkiClient -> кэш, в котором хранятся их ответы
+_METHOD_CACHES = {
+    'search_tires': 'search',
+    'search_disks': 'search',
+    'get_goods_info': 'goods_info',
+    'get_warehouses': 'warehouses',
+    'get_car_brands': 'car_catalog',
+    'get_car_models': 'car_catalog',
+    'get_car_years': 'car_catalog',
+    'get_car_modifications': 'car_catalog',
+}
+
+
+class SupplierCache:
+    """Read-методы поставщика с кэшем, stale-while-revalidate и объединением одновременных запросов"""
+
+    def __init__(self):
+        self.caches = {
+            'search': SingleFlightCache(
+                "supplier_search", ttl=SUPPLIER_SEARCH_CACHE_TTL,
+                max_entries=SUPPLIER_SEARCH_CACHE_SIZE, stale_ttl=SUPPLIER_STALE_GRACE,
+            ),
+            'goods_info': SingleFlightCache(
+                "supplier_goods_info", ttl=SUPPLIER_INFO_CACHE_TTL,
+                max_entries=2000, stale_ttl=SUPPLIER_STALE_GRACE,
+            ),
+            'warehouses': SingleFlightCache(
+                "supplier_warehouses", ttl=SUPPLIER_WAREHOUSES_CACHE_TTL,
+                max_entries=10, stale_ttl=SUPPLIER_WAREHOUSES_CACHE_TTL,
+            ),
+            'car_catalog': SingleFlightCache(
+                "supplier_car_catalog", ttl=SUPPLIER_CATALOG_CACHE_TTL,
+                max_entries=5000, stale_ttl=7 * SUPPLIER_CATALOG_CACHE_TTL,
+            ),
+        }
+
+    async def call(
+        self,
+        client: FourthchkiClient,
+        method: str,
+        params: Optional[Dict] = None,
+        refresh: bool = False,
+        fresh: bool = False,
+    ) -> Dict:
+        """
+        Вызвать read-метод FourthchkiClient через кэш
+        refresh=True - прогрев: обновить запись, не учитывая в статистике запросов
+        fresh=True - ответ только от поставщика, без кэша
+        """
+        params = params or {}
+        cache = self.caches[_METHOD_CACHES[method]]
+        key = (method, _freeze(params))
+
+        async def load():
+            # zeep блокирующий - вызываем в отдельном потоке
+            return await asyncio.to_thread(getattr(client, method), **params)
+
+        if refresh:
+            return await cache.refresh(key, load, should_cache=_response_is_cacheable)
+        result = await cache.fetch(key, load, should_cache=_response_is_cacheable, fresh=_fresh_required(fresh))
+        _note(result)
+        return result.value
+
+    async def search_tires(self, client: FourthchkiClient, params: Dict, refresh: bool = False) -> Dict:
+        """GetFindTyre; params - результат tire_search_params"""
+        return await self.call(client, 'search_tires', params, refresh=refresh)
+
+    async def search_disks(self, client: FourthchkiClient, params: Dict, refresh: bool = False) -> Dict:
+        """GetFindDisk; params - результат disk_search_params"""
+        return await self.call(client, 'search_disks', params, refresh=refresh)
+
+    def get_stats(self) -> List[Dict]:
+        return [cache.get_stats() for cache in self.caches.values()]
+
+    def clear(self):
+        for cache in self.caches.values():
+            cache.clear()
+
+
+# Singleton instance
+fitment_goods_cache = None
+supplier_cache = None
+
+
+def get_fitment_goods_cache() -> FitmentGoodsCache:
+    global fitment_goods_cache
+    if fitment_goods_cache is None:
+        fitment_goods_cache = FitmentGoodsCache()
+    return fitment_goods_cache
+
+
+def get_supplier_cache() -> SupplierCache:
+    global supplier_cache
+    if supplier_cache is None:
+        supplier_cache = SupplierCache()
+    return supplier_cache
+
+
+def all_caches() -> List[SingleFlightCache]:
+    """Все кэши ответов поставщика (для статистики)"""
+    return [get_fitment_goods_cache().cache, *get_supplier_cache().caches.values()]
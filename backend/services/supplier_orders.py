@@ -0,0 +1,502 @@
+"""
+Автоматический заказ у поставщика (4tochki) и отслеживание статусов
+
+Воркер-лидер периодически:
+1. Берет заказы, подтвержденные при включенном воркере (supplier_state=pending), группирует позиции по складам и отправляет
+   их пачками - один CreateOrder на склад и до SUPPLIER_ORDER_BATCH_SIZE заказов
+   клиентов. Номера заказов поставщика сохраняются в supplier_orders заказа,
+   заказ переходит в in_progress, клиент получает уведомление
+2. Опрашивает GetOrderInfo2 по всем открытым заказам поставщика параллельно
+   (не больше SUPPLIER_ORDER_CONCURRENCY запросов одновременно и
+   SUPPLIER_API_RATE в секунду), переводит заказы в delivery / delayed /
+   completed / cancelled и ставит уведомления клиентам в outbox
+
+Выключен по умолчанию (SUPPLIER_ORDERS_ENABLED) - включает реальные заказы у поставщика.
+Заказы, подтвержденные до включения, воркер не трогает - они остаются для ручной обработки.
+Ручная смена статусов в админке продолжает работать: воркер меняет статус,
+только если админ не изменил его с момента опроса
+"""
+
+import asyncio
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+from models.order import ORDER_STATUS_MESSAGES, OrderStatus
+from services.fourthchki_client import FourthchkiClient
+from services.telegram_bot import TelegramNotifier
+from utils.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+SUPPLIER_ORDERS_ENABLED = os.environ.get('SUPPLIER_ORDERS_ENABLED', 'false').lower() == 'true'
+SUPPLIER_ORDER_PLACE_INTERVAL = int(os.environ.get('SUPPLIER_ORDER_PLACE_INTERVAL', '60'))
+SUPPLIER_ORDER_POLL_INTERVAL = int(os.environ.get('SUPPLIER_ORDER_POLL_INTERVAL', '600'))
+# Заказов клиентов в одном CreateOrder
+SUPPLIER_ORDER_BATCH_SIZE = int(os.environ.get('SUPPLIER_ORDER_BATCH_SIZE', '20'))
+# Заказов клиентов за один проход размещения
+SUPPLIER_ORDER_PLACE_LIMIT = int(os.environ.get('SUPPLIER_ORDER_PLACE_LIMIT', '500'))
+# Заказов клиентов в одной пачке опроса статусов
+SUPPLIER_ORDER_POLL_CHUNK = int(os.environ.get('SUPPLIER_ORDER_POLL_CHUNK', '500'))
+SUPPLIER_ORDER_MAX_ATTEMPTS = int(os.environ.get('SUPPLIER_ORDER_MAX_ATTEMPTS', '3'))
+SUPPLIER_ORDER_CONCURRENCY = int(os.environ.get('SUPPLIER_ORDER_CONCURRENCY', '4'))
+# Общий лимит запросов к API поставщика в секунду (размещение + опрос)
+SUPPLIER_API_RATE = float(os.environ.get('SUPPLIER_API_RATE', '5'))
+# Через сколько секунд размещение, прерванное перезапуском, считается зависшим
+SUPPLIER_ORDER_LOCK_SECONDS = 600
+
+# Состояние автоматического заказа (поле supplier_state, только для воркера)
+# pending ставит confirm_order; заказы без supplier_state обрабатываются вручную
+STATE_PENDING = "pending"
+STATE_PLACING = "placing"
+STATE_RETRY = "retry"
+STATE_PLACED = "placed"
+STATE_FAILED = "failed"
+
+# Статусы заказа, которые еще отслеживаются у поставщика
+OPEN_STATUSES = [OrderStatus.IN_PROGRESS, OrderStatus.DELAYED, OrderStatus.DELIVERY]
+# Порядок статусов: заказ со складами в разных статусах получает наименее продвинутый
+_STATUS_RANK = {OrderStatus.IN_PROGRESS: 0, OrderStatus.DELIVERY: 1, OrderStatus.COMPLETED: 2}
+
+# Статус поставщика (в нижнем регистре) -> статус заказа
+SUPPLIER_STATUS_MAP: Dict[str, OrderStatus] = {
+    **dict.fromkeys(
+        ["новый", "принят", "в обработке", "в работе", "подтвержден", "собран", "резерв",
+         "new", "accepted", "processing", "confirmed", "reserved"],
+        OrderStatus.IN_PROGRESS
+    ),
+    **dict.fromkeys(
+        ["отгружен", "в пути", "доставка", "передан в доставку", "shipped", "delivery", "in transit"],
+        OrderStatus.DELIVERY
+    ),
+    **dict.fromkeys(["задержан", "задержка", "delayed"], OrderStatus.DELAYED),
+    **dict.fromkeys(
+        ["выполнен", "доставлен", "получен", "завершен", "completed", "delivered", "done"],
+        OrderStatus.COMPLETED
+    ),
+    **dict.fromkeys(
+        ["отменен", "отклонен", "аннулирован", "cancelled", "canceled", "rejected"],
+        OrderStatus.CANCELLED
+    ),
+}
+# Дополнения и переопределения: {"статус поставщика": "delivery", ...}
+SUPPLIER_STATUS_MAP.update({
+    key.lower(): OrderStatus(value)
+    for key, value in json.loads(os.environ.get('SUPPLIER_ORDER_STATUS_MAP', '{}')).items()
+})
+
+_ORDER_ID_KEYS = ("orderID", "orderId", "order_id", "OrderID", "OrderId")
+_STATUS_KEYS = ("status", "statusName", "status_name", "state", "orderStatus", "OrderStatus")
+_ERROR_KEYS = ("error", "errorMessage", "error_message")
+
+
+def _find_value(data: Any, keys: Iterable[str]) -> Any:
+    """Первое непустое значение по одному из ключей в ответе SOAP (с вложенными объектами)"""
+    if isinstance(data, dict):
+        for key in keys:
+            if data.get(key) not in (None, ""):
+                return data[key]
+        for value in data.values():
+            found = _find_value(value, keys)
+            if found is not None:
+                return found
+    elif isinstance(data, list):
+        for value in data:
+            found = _find_value(value, keys)
+            if found is not None:
+                return found
+    return None
+
+
+def parse_create_order_response(response: Dict) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Ответ CreateOrder -> (номер заказа поставщика, текст ошибки)
+    Любая ошибка в ответе - неудача, даже если в нем есть номер: повторный заказ
+    админ проверит вручную, а принятый за успех неудачный заказ не отследить.
+    Номер ищется только в явных полях верхнего уровня - вложенные id товаров
+    и ошибок номером заказа не считаются
+    """
+    error = _find_value(response, _ERROR_KEYS)
+    if isinstance(error, dict):
+        # Пустой объект ошибки (все поля null) ошибкой не считается
+        error = error.get("comment") or error.get("message") or error.get("code") or (
+            error if any(value not in (None, "") for value in error.values()) else None
+        )
+    if error is not None:
+        return None, str(error)
+    order_id = None
+    if isinstance(response, dict):
+        order_id = next((response[key] for key in _ORDER_ID_KEYS if response.get(key) not in (None, "")), None)
+    if order_id in (None, 0, "0"):
+        return None, f"No order id in supplier response: {response}"
+    return str(order_id), None
+
+
+def parse_order_status(response: Dict) -> Tuple[Optional[str], Optional[OrderStatus]]:
+    """Ответ GetOrderInfo2 -> (статус поставщика, статус заказа или None, если статус неизвестен)"""
+    status = _find_value(response, _STATUS_KEYS)
+    if isinstance(status, dict):
+        status = status.get("name") or status.get("value") or status.get("code")
+    if status is None:
+        return None, None
+    raw = str(status).strip()
+    return raw, SUPPLIER_STATUS_MAP.get(raw.lower())
+
+
+def aggregate_status(statuses: List[Optional[OrderStatus]]) -> Optional[OrderStatus]:
+    """
+    Статус заказа клиента по статусам его заказов у поставщика (по складам)
+    None - статус не меняем: есть неизвестный статус или отменена только часть складов
+    """
+    if not statuses or any(status is None for status in statuses):
+        return None
+    if all(status == OrderStatus.CANCELLED for status in statuses):
+        return OrderStatus.CANCELLED
+    if OrderStatus.CANCELLED in statuses:
+        return None
+    if OrderStatus.DELAYED in statuses:
+        return OrderStatus.DELAYED
+    return min(statuses, key=lambda status: _STATUS_RANK[status])
+
+
+def build_product_list(orders: List[Dict], warehouse_id: int) -> List[Dict]:
+    """Позиции одного склада из нескольких заказов - одинаковые товары суммируются"""
+    quantities: Dict[str, int] = {}
+    for order in orders:
+        for item in order["items"]:
+            if item["warehouse_id"] == warehouse_id:
+                quantities[item["code"]] = quantities.get(item["code"], 0) + item["quantity"]
+    return [{"code": code, "quantity": quantity, "wrh": warehouse_id} for code, quantity in quantities.items()]
+
+
+def group_by_warehouse(orders: List[Dict]) -> Dict[int, List[Dict]]:
+    """Склад -> заказы, у которых есть еще не заказанные позиции с этого склада"""
+    groups: Dict[int, List[Dict]] = {}
+    for order in orders:
+        placed = {ref["warehouse_id"] for ref in order.get("supplier_orders") or []}
+        for warehouse_id in sorted({item["warehouse_id"] for item in order["items"]} - placed):
+            groups.setdefault(warehouse_id, []).append(order)
+    return groups
+
+
+class SupplierOrderWorker:
+    """Размещение заказов у поставщика и опрос их статусов (только воркер-лидер)"""
+
+    def __init__(self):
+        self.limiter = TokenBucket(rate=SUPPLIER_API_RATE, capacity=max(SUPPLIER_API_RATE, 1))
+        self.semaphore = asyncio.Semaphore(SUPPLIER_ORDER_CONCURRENCY)
+        self.stats: Dict[str, Any] = {
+            "placed_orders": 0, "supplier_orders": 0, "place_errors": 0,
+            "polled": 0, "poll_errors": 0, "status_changes": 0,
+            "last_place_at": None, "last_poll_at": None,
+        }
+        self._tasks: List[asyncio.Task] = []
+
+    async def _call(self, method, *args):
+        """Запрос к поставщику под общим лимитом (zeep блокирующий - в отдельном потоке)"""
+        async with self.semaphore:
+            await self.limiter.acquire()
+            return await asyncio.to_thread(method, *args)
+
+    # Размещение заказов
+
+    async def _recover_stuck(self, db: AsyncIOMotorDatabase, notifier: TelegramNotifier):
+        """
+        Размещение, прерванное перезапуском: CreateOrder мог пройти, поэтому
+        автоматически не повторяем - заказ помечается failed для проверки админом
+        """
+        stale = datetime.now(timezone.utc) - timedelta(seconds=SUPPLIER_ORDER_LOCK_SECONDS)
+        async for order in db.orders.find(
+            {"supplier_state": STATE_PLACING, "supplier_locked_at": {"$lt": stale}},
+            {"_id": 0, "order_id": 1}
+        ):
+            error = "Размещение прервано - проверьте заказ у поставщика"
+            result = await db.orders.update_one(
+                {"order_id": order["order_id"], "supplier_state": STATE_PLACING},
+                {"$set": {"supplier_state": STATE_FAILED, "supplier_error": error}}
+            )
+            if result.modified_count:
+                logger.warning(f"Supplier placement of {order['order_id']} was interrupted, marked failed")
+                await notifier.enqueue_message(notifier.admin_id, f"⚠️ Заказ #{order['order_id']}: {error}")
+
+    async def _claim_orders(self, db: AsyncIOMotorDatabase) -> List[Dict]:
+        """Забрать подтвержденные заказы, ожидающие размещения"""
+        candidates = await db.orders.find(
+            {
+                "status": OrderStatus.CONFIRMED.value,
+                "supplier_state": {"$in": [STATE_PENDING, STATE_RETRY]},
+                "hidden_in_admin": {"$ne": True},
+            },
+            {"_id": 0, "order_id": 1}
+        ).sort("confirmed_at", 1).limit(SUPPLIER_ORDER_PLACE_LIMIT).to_list(SUPPLIER_ORDER_PLACE_LIMIT)
+        if not candidates:
+            return []
+
+        batch_id = uuid.uuid4().hex
+        await db.orders.update_many(
+            {
+                "order_id": {"$in": [order["order_id"] for order in candidates]},
+                "status": OrderStatus.CONFIRMED.value,
+                "supplier_state": {"$in": [STATE_PENDING, STATE_RETRY]},
+            },
+            {"$set": {
+                "supplier_state": STATE_PLACING,
+                "supplier_batch": batch_id,
+                "supplier_locked_at": datetime.now(timezone.utc),
+            }}
+        )
+        return await db.orders.find(
+            {"supplier_batch": batch_id, "supplier_state": STATE_PLACING},
+            {"_id": 0, "order_id": 1, "user_telegram_id": 1, "items": 1, "supplier_orders": 1, "supplier_attempts": 1}
+        ).to_list(None)
+
+    async def place_orders(self, db: AsyncIOMotorDatabase, client: FourthchkiClient, notifier: TelegramNotifier) -> Dict[str, int]:
+        """Один проход размещения: CreateOrder на склад для пачки заказов"""
+        await self._recover_stuck(db, notifier)
+        orders = await self._claim_orders(db)
+        if not orders:
+            return {"orders": 0, "supplier_orders": 0, "errors": 0}
+
+        batches = []
+        for warehouse_id, warehouse_orders in group_by_warehouse(orders).items():
+            for start in range(0, len(warehouse_orders), SUPPLIER_ORDER_BATCH_SIZE):
+                batches.append((warehouse_id, warehouse_orders[start:start + SUPPLIER_ORDER_BATCH_SIZE]))
+
+        async def place(warehouse_id: int, batch: List[Dict]):
+            try:
+                response = await self._call(client.create_order, build_product_list(batch, warehouse_id))
+                return parse_create_order_response(response)
+            except Exception as e:
+                return None, str(e)
+
+        results = await asyncio.gather(*(place(warehouse_id, batch) for warehouse_id, batch in batches))
+
+        now = datetime.now(timezone.utc)
+        new_refs: Dict[str, List[Dict]] = {}
+        errors: Dict[str, str] = {}
+        supplier_orders = 0
+        for (warehouse_id, batch), (supplier_order_id, error) in zip(batches, results):
+            if error:
+                logger.error(f"Supplier CreateOrder for warehouse {warehouse_id} failed: {error}")
+            else:
+                supplier_orders += 1
+                logger.info(
+                    f"Supplier order {supplier_order_id} placed for warehouse {warehouse_id}: "
+                    f"{[order['order_id'] for order in batch]}"
+                )
+            for order in batch:
+                if error:
+                    errors[order["order_id"]] = error
+                else:
+                    new_refs.setdefault(order["order_id"], []).append({
+                        "supplier_order_id": supplier_order_id,
+                        "warehouse_id": warehouse_id,
+                        "status": None,
+                        "placed_at": now,
+                        "checked_at": None,
+                    })
+
+        operations = []
+        placed, failed = [], []
+        for order in orders:
+            order_id = order["order_id"]
+            refs = (order.get("supplier_orders") or []) + new_refs.get(order_id, [])
+            update: Dict[str, Any] = {"supplier_orders": refs, "fourthchki_order_id": ",".join(
+                ref["supplier_order_id"] for ref in refs
+            ) or None}
+            if order_id not in errors:
+                update.update({"supplier_state": STATE_PLACED, "supplier_error": None})
+                placed.append(order)
+            else:
+                attempts = order.get("supplier_attempts", 0) + 1
+                state = STATE_FAILED if attempts >= SUPPLIER_ORDER_MAX_ATTEMPTS else STATE_RETRY
+                update.update({"supplier_state": state, "supplier_attempts": attempts, "supplier_error": errors[order_id]})
+                if state == STATE_FAILED:
+                    failed.append(order)
+            operations.append(UpdateOne({"order_id": order_id, "supplier_state": STATE_PLACING}, {
+                "$set": update, "$unset": {"supplier_locked_at": ""}
+            }))
+            if order_id not in errors:
+                # Статус меняем, только если админ не успел изменить его вручную
+                operations.append(UpdateOne(
+                    {"order_id": order_id, "status": OrderStatus.CONFIRMED.value},
+                    {"$set": {"status": OrderStatus.IN_PROGRESS.value, "updated_at": now}}
+                ))
+        await db.orders.bulk_write(operations, ordered=True)
+
+        for order in placed:
+            refs = (order.get("supplier_orders") or []) + new_refs.get(order["order_id"], [])
+            await notifier.notify_user_order_sent_to_supplier(
+                user_telegram_id=order["user_telegram_id"],
+                order_id=order["order_id"],
+                supplier_order_number=", ".join(ref["supplier_order_id"] for ref in refs)
+            )
+        for order in failed:
+            await notifier.enqueue_message(
+                notifier.admin_id,
+                f"⚠️ Не удалось заказать у поставщика заказ #{order['order_id']}: {errors[order['order_id']]}\n"
+                f"Оформите его вручную"
+            )
+
+        self.stats["placed_orders"] += len(placed)
+        self.stats["supplier_orders"] += supplier_orders
+        self.stats["place_errors"] += len(errors)
+        self.stats["last_place_at"] = now.isoformat()
+        return {"orders": len(placed), "supplier_orders": supplier_orders, "errors": len(errors)}
+
+    # Опрос статусов
+
+    async def _fetch_statuses(self, client: FourthchkiClient, supplier_order_ids: List[str]) -> Dict[str, Optional[str]]:
+        """Статусы заказов поставщика; при ошибке запроса заказа в результате нет"""
+        async def fetch(supplier_order_id: str):
+            response = await self._call(client.get_order_info, int(supplier_order_id))
+            return parse_order_status(response)[0]
+
+        results = await asyncio.gather(*(fetch(order_id) for order_id in supplier_order_ids), return_exceptions=True)
+        statuses = {}
+        for supplier_order_id, result in zip(supplier_order_ids, results):
+            if isinstance(result, Exception):
+                self.stats["poll_errors"] += 1
+                logger.warning(f"GetOrderInfo2 for {supplier_order_id} failed: {result}")
+            else:
+                statuses[supplier_order_id] = result
+        return statuses
+
+    async def _poll_chunk(self, db: AsyncIOMotorDatabase, client: FourthchkiClient, notifier: TelegramNotifier, orders: List[Dict]) -> int:
+        supplier_order_ids = sorted({ref["supplier_order_id"] for order in orders for ref in order["supplier_orders"]})
+        statuses = await self._fetch_statuses(client, supplier_order_ids)
+        self.stats["polled"] += len(statuses)
+
+        now = datetime.now(timezone.utc)
+        operations = []
+        changes: List[Tuple[Dict, OrderStatus]] = []
+        for order in orders:
+            refs = order["supplier_orders"]
+            for ref in refs:
+                if ref["supplier_order_id"] in statuses:
+                    ref["status"] = statuses[ref["supplier_order_id"]]
+                    ref["checked_at"] = now
+            operations.append(UpdateOne(
+                {"order_id": order["order_id"]},
+                {"$set": {"supplier_orders": refs, "supplier_checked_at": now}}
+            ))
+
+            new_status = aggregate_status([SUPPLIER_STATUS_MAP.get((ref["status"] or "").lower()) for ref in refs])
+            if new_status and new_status.value != order["status"]:
+                operations.append(UpdateOne(
+                    {"order_id": order["order_id"], "status": order["status"]},
+                    {"$set": {"status": new_status.value, "updated_at": now}}
+                ))
+                changes.append((order, new_status))
+            elif any(SUPPLIER_STATUS_MAP.get((ref["status"] or "").lower()) == OrderStatus.CANCELLED for ref in refs) \
+                    and not order.get("supplier_error"):
+                operations.append(UpdateOne(
+                    {"order_id": order["order_id"]},
+                    {"$set": {"supplier_error": "Поставщик отменил часть заказа"}}
+                ))
+                await notifier.enqueue_message(
+                    notifier.admin_id, f"⚠️ Поставщик отменил часть заказа #{order['order_id']} - проверьте заказ"
+                )
+
+        if operations:
+            await db.orders.bulk_write(operations, ordered=True)
+
+        for order, new_status in changes:
+            logger.info(f"Order {order['order_id']} status {order['status']} -> {new_status.value} from supplier")
+            if new_status == OrderStatus.COMPLETED:
+                await notifier.notify_user_order_completed(order["user_telegram_id"], order["order_id"])
+            else:
+                await notifier.notify_user_order_status_changed(
+                    user_telegram_id=order["user_telegram_id"],
+                    order_id=order["order_id"],
+                    new_status=ORDER_STATUS_MESSAGES.get(new_status, new_status.value)
+                )
+        self.stats["status_changes"] += len(changes)
+        return len(changes)
+
+    async def poll_statuses(self, db: AsyncIOMotorDatabase, client: FourthchkiClient, notifier: TelegramNotifier) -> Dict[str, int]:
+        """Один проход опроса всех открытых заказов поставщика (пачками по SUPPLIER_ORDER_POLL_CHUNK)"""
+        started_at = datetime.now(timezone.utc)
+        due = started_at - timedelta(seconds=SUPPLIER_ORDER_POLL_INTERVAL / 2)
+        query = {
+            "supplier_state": STATE_PLACED,
+            "status": {"$in": [status.value for status in OPEN_STATUSES]},
+            "$or": [{"supplier_checked_at": None}, {"supplier_checked_at": {"$lt": due}}],
+        }
+        projection = {"_id": 0, "order_id": 1, "status": 1, "user_telegram_id": 1, "supplier_orders": 1, "supplier_error": 1}
+
+        orders_checked = changed = 0
+        chunk: List[Dict] = []
+        async for order in db.orders.find(query, projection).batch_size(SUPPLIER_ORDER_POLL_CHUNK):
+            if not order.get("supplier_orders"):
+                continue
+            chunk.append(order)
+            if len(chunk) >= SUPPLIER_ORDER_POLL_CHUNK:
+                changed += await self._poll_chunk(db, client, notifier, chunk)
+                orders_checked += len(chunk)
+                chunk = []
+        if chunk:
+            changed += await self._poll_chunk(db, client, notifier, chunk)
+            orders_checked += len(chunk)
+
+        self.stats["last_poll_at"] = started_at.isoformat()
+        if orders_checked:
+            duration = (datetime.now(timezone.utc) - started_at).total_seconds()
+            logger.info(f"Supplier status poll: {orders_checked} orders, {changed} changed in {duration:.1f}s")
+        return {"orders": orders_checked, "changed": changed}
+
+    # Фоновые циклы
+
+    async def _loop(self, name: str, interval: int, job):
+        while True:
+            try:
+                await job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Supplier order {name} failed: {e}")
+            await asyncio.sleep(interval)
+
+    def start(self, db: AsyncIOMotorDatabase, load_client, notifier: TelegramNotifier):
+        """Лидер: запустить размещение и опрос; load_client - корутина, возвращающая SOAP клиент"""
+        if any(not task.done() for task in self._tasks):
+            return
+
+        async def place():
+            await self.place_orders(db, await load_client(), notifier)
+
+        async def poll():
+            await self.poll_statuses(db, await load_client(), notifier)
+
+        self._tasks = [
+            asyncio.create_task(self._loop("placement", SUPPLIER_ORDER_PLACE_INTERVAL, place)),
+            asyncio.create_task(self._loop("status poll", SUPPLIER_ORDER_POLL_INTERVAL, poll)),
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase):
+    await db.orders.create_index([("supplier_state", 1), ("status", 1), ("supplier_checked_at", 1)])
+
+
+# Singleton instance
+supplier_order_worker = None
+
+
+def get_supplier_order_worker() -> SupplierOrderWorker:
+    global supplier_order_worker
+    if supplier_order_worker is None:
+        supplier_order_worker = SupplierOrderWorker()
+    return supplier_order_worker
@@ -1,60 +1,133 @@
 import os
 import logging
 import asyncio
+import hmac
+import random
+import time
+from datetime import datetime, timezone, timedelta
 from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
-from telegram.error import TelegramError
-from typing import Optional
-from motor.motor_asyncio import AsyncIOMotorClient
+from telegram.error import TelegramError, RetryAfter, Forbidden, BadRequest, InvalidToken
+from typing import Optional, Dict, Any
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+
+from utils.rate_limit import TokenBucket
 
 logger = logging.getLogger(__name__)
 
+# Очередь исходящих уведомлений (outbox) в MongoDB
+OUTBOX_COLLECTION = "notification_outbox"
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('TELEGRAM_OUTBOX_MAX_ATTEMPTS', '8'))
+OUTBOX_BACKOFF_BASE = 2.0  # секунд, удваивается с каждой попыткой
+OUTBOX_BACKOFF_MAX = 600.0
+OUTBOX_LOCK_SECONDS = 60  # через сколько "зависшее" сообщение можно забрать повторно
+OUTBOX_POLL_INTERVAL = 5.0
+OUTBOX_CONCURRENCY = 10
+OUTBOX_SENT_TTL_SECONDS = 7 * 24 * 3600
+
+# Лимиты Telegram: ~30 сообщений в секунду всего и ~1 сообщение в секунду в один чат
+TELEGRAM_GLOBAL_RATE = float(os.environ.get('TELEGRAM_GLOBAL_RATE', '25'))
+TELEGRAM_PER_CHAT_INTERVAL = float(os.environ.get('TELEGRAM_PER_CHAT_INTERVAL', '1.0'))
+
+# Режим получения обновлений: polling (один процесс) или webhook (можно несколько воркеров)
+BOT_MODE_POLLING = "polling"
+BOT_MODE_WEBHOOK = "webhook"
+BOT_MODE_DISABLED = "disabled"
+
 class TelegramNotifier:
-    def __init__(self):
+    def __init__(self, db: Optional[AsyncIOMotorDatabase] = None):
         self.bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
         self.admin_id = os.environ.get('ADMIN_TELEGRAM_ID')
         self.webapp_url = os.environ.get('WEBAPP_URL', 'https://tyres.vpnsuba.ru')
+        # Адрес Bot API (можно указать локальный fake-сервер для тестов)
+        self.api_base_url = os.environ.get('TELEGRAM_API_BASE_URL', 'https://api.telegram.org').rstrip('/')
         self.application = None
         
+        # Режим обработки входящих обновлений
+        self.bot_mode = os.environ.get('TELEGRAM_BOT_MODE', BOT_MODE_POLLING).lower()
+        self.webhook_url = os.environ.get('TELEGRAM_WEBHOOK_URL') or f"{self.webapp_url.rstrip('/')}/api/telegram/webhook"
+        self.webhook_secret = os.environ.get('TELEGRAM_WEBHOOK_SECRET')
+        
+        # Фоновая отправка уведомлений из outbox
+        self.global_rate_limiter = TokenBucket(rate=TELEGRAM_GLOBAL_RATE, capacity=TELEGRAM_GLOBAL_RATE)
+        self._chat_next_send: Dict[str, float] = {}
+        self._outbox_event = asyncio.Event()
+        self._outbox_task: Optional[asyncio.Task] = None
+        self._outbox_stopping = False
+        
         # Подключение к MongoDB для проверки существующих пользователей
-        mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-        db_name = os.environ.get('DB_NAME', 'tires_shop')
-        self.mongo_client = AsyncIOMotorClient(mongo_url)
-        self.db = self.mongo_client[db_name]
+        # (в приложении передается общий пул из AppResources, отдельный клиент - для скриптов)
+        if db is not None:
+            self.mongo_client = db.client
+            self.db = db
+        else:
+            mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+            db_name = os.environ.get('DB_NAME', 'tires_shop')
+            self.mongo_client = AsyncIOMotorClient(mongo_url)
+            self.db = self.mongo_client[db_name]
         
         if not self.bot_token:
             logger.warning("TELEGRAM_BOT_TOKEN not set")
             self.bot = None
         else:
             try:
-                self.bot = Bot(token=self.bot_token)
+                self.bot = Bot(token=self.bot_token, base_url=f"{self.api_base_url}/bot")
                 logger.info("Telegram bot initialized successfully")
             except Exception as e:
                 logger.error(f"Failed to initialize Telegram bot: {e}")
                 self.bot = None
     
+    def _build_application(self) -> Application:
+        """Создать Application и зарегистрировать обработчики команд"""
+        application = (
+            Application.builder()
+            .token(self.bot_token)
+            .base_url(f"{self.api_base_url}/bot")
+            .build()
+        )
+        
+        # Регистрируем обработчики команд
+        application.add_handler(CommandHandler("start", self._handle_start))
+        application.add_handler(CommandHandler("help", self._handle_help))
+        
+        # Регистрируем обработчик callback кнопок
+        application.add_handler(CallbackQueryHandler(self._handle_callback))
+        
+        # Регистрируем обработчик обычных сообщений (для пересылки админу)
+        from telegram.ext import MessageHandler, filters
+        application.add_handler(
+            MessageHandler(filters.TEXT & ~filters.COMMAND, self._handle_message)
+        )
+        return application
+    
+    async def start_bot(self):
+        """Запустить обработку входящих обновлений в режиме TELEGRAM_BOT_MODE"""
+        if self.bot_mode == BOT_MODE_WEBHOOK:
+            await self.start_bot_webhook()
+        elif self.bot_mode == BOT_MODE_DISABLED:
+            logger.info("Telegram bot updates processing disabled (TELEGRAM_BOT_MODE=disabled)")
+        else:
+            await self.start_bot_polling()
+    
+    async def stop_bot(self):
+        """Остановить обработку входящих обновлений"""
+        if self.bot_mode == BOT_MODE_WEBHOOK:
+            await self.stop_bot_webhook()
+        else:
+            await self.stop_bot_polling()
+    
     async def start_bot_polling(self):
         """Запустить бота в режиме polling для обработки команд"""
         if not self.bot_token:
             logger.warning("Cannot start bot polling: token not set")
             return
+        if self.application:
+            return
         
         try:
             # Создаём приложение для обработки команд
-            self.application = Application.builder().token(self.bot_token).build()
-            
-            # Регистрируем обработчики команд
-            self.application.add_handler(CommandHandler("start", self._handle_start))
-            self.application.add_handler(CommandHandler("help", self._handle_help))
-            
-            # Регистрируем обработчик callback кнопок
-            self.application.add_handler(CallbackQueryHandler(self._handle_callback))
-            
-            # Регистрируем обработчик обычных сообщений (для пересылки админу)
-            from telegram.ext import MessageHandler, filters
-            self.application.add_handler(
-                MessageHandler(filters.TEXT & ~filters.COMMAND, self._handle_message)
-            )
+            self.application = self._build_application()
             
             # Запускаем polling в фоне
             logger.info("Starting Telegram bot polling...")
@@ -76,6 +149,80 @@ class TelegramNotifier:
                 logger.info("Telegram bot polling stopped")
             except Exception as e:
                 logger.error(f"Error stopping bot polling: {e}")
+            # Polling может быть запущен повторно (при повторном получении лидерства)
+            self.application = None
+    
+    async def start_bot_webhook(self):
+        """
+        Запустить бота в режиме webhook
+        Обновления принимает POST /api/telegram/webhook и кладет в очередь Application,
+        поэтому API можно запускать в несколько воркеров - каждое обновление
+        Telegram доставит ровно в один из них. Сам webhook регистрирует лидер (register_webhook)
+        """
+        if not self.bot_token:
+            logger.warning("Cannot start bot webhook: token not set")
+            return
+        if not self.webhook_secret:
+            # Без секрета POST /api/telegram/webhook принял бы поддельные обновления от кого угодно
+            logger.error("Cannot start bot webhook: TELEGRAM_WEBHOOK_SECRET not set")
+            return
+        try:
+            self.application = self._build_application()
+            await self.application.initialize()
+            await self.application.start()
+            
+            logger.info("Telegram bot webhook mode started successfully!")
+        except Exception as e:
+            logger.error(f"Failed to start bot webhook: {e}")
+    
+    async def register_webhook(self):
+        """
+        Зарегистрировать webhook у Telegram (вызывает только воркер-лидер)
+        set_webhook идемпотентен, поэтому вызывается при каждом получении лидерства -
+        так Telegram получает и новый URL, и новый TELEGRAM_WEBHOOK_SECRET после перезапуска
+        """
+        if not self.application:
+            return
+        try:
+            await self.application.bot.set_webhook(
+                url=self.webhook_url,
+                secret_token=self.webhook_secret,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            logger.info(f"Telegram webhook set to {self.webhook_url}")
+        except Exception as e:
+            logger.error(f"Failed to set Telegram webhook: {e}")
+    
+    async def stop_bot_webhook(self):
+        """
+        Остановить обработку обновлений в режиме webhook
+        Сам webhook не удаляется - остальные воркеры и следующий запуск продолжают его обслуживать
+        """
+        if self.application:
+            try:
+                logger.info("Stopping Telegram bot webhook processing...")
+                await self.application.stop()
+                await self.application.shutdown()
+                logger.info("Telegram bot webhook processing stopped")
+            except Exception as e:
+                logger.error(f"Error stopping bot webhook: {e}")
+            self.application = None
+    
+    def check_webhook_secret(self, secret_token: Optional[str]) -> bool:
+        """Проверить заголовок X-Telegram-Bot-Api-Secret-Token (без TELEGRAM_WEBHOOK_SECRET - отказ)"""
+        if not self.webhook_secret:
+            return False
+        return secret_token is not None and hmac.compare_digest(secret_token, self.webhook_secret)
+    
+    async def process_webhook_update(self, data: Dict[str, Any]) -> bool:
+        """Передать обновление из webhook в очередь Application"""
+        if self.bot_mode != BOT_MODE_WEBHOOK or not self.application or not self.application.running:
+            logger.warning("Webhook update received but bot is not running in webhook mode")
+            return False
+        
+        update = Update.de_json(data, self.application.bot)
+        await self.application.update_queue.put(update)
+        return True
     
     async def _handle_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
@@ -167,7 +314,7 @@ class TelegramNotifier:
                 f"➡️ Чтобы ответить, используйте админ-панель"
             )
             
-            await self.send_message(self.admin_id, forward_message)
+            await self.enqueue_message(self.admin_id, forward_message)
             logger.info(f"Message from {user.id} forwarded to admin")
             
             # Подтверждаем клиенту получение сообщения
@@ -300,6 +447,247 @@ class TelegramNotifier:
             logger.error(f"Failed to send message to {chat_id}: {e}")
             return False
     
+    async def enqueue_message(self, chat_id: str, text: str) -> bool:
+        """
+        Поставить сообщение в очередь outbox
+        Сообщение отправит фоновый диспетчер с повторами и соблюдением лимитов Telegram
+        """
+        if not self.bot:
+            logger.warning("Bot not initialized, skipping message")
+            return False
+        
+        if not chat_id:
+            logger.warning("Empty chat_id, skipping message")
+            return False
+        
+        now = datetime.now(timezone.utc)
+        try:
+            await self.db[OUTBOX_COLLECTION].insert_one({
+                "chat_id": str(chat_id),
+                "text": text,
+                "parse_mode": "HTML",
+                "status": "pending",
+                "attempts": 0,
+                "next_attempt_at": now,
+                "created_at": now
+            })
+        except Exception as e:
+            logger.error(f"Failed to enqueue message to {chat_id}: {e}")
+            return False
+        
+        self._outbox_event.set()
+        return True
+    
+    async def ensure_outbox_indexes(self):
+        """Индексы для выборки очереди и автоудаления отправленных сообщений"""
+        collection = self.db[OUTBOX_COLLECTION]
+        await collection.create_index([("status", 1), ("next_attempt_at", 1), ("created_at", 1)])
+        await collection.create_index("sent_at", expireAfterSeconds=OUTBOX_SENT_TTL_SECONDS)
+    
+    async def start_outbox_dispatcher(self):
+        """Запустить фоновый диспетчер outbox"""
+        if not self.bot:
+            logger.warning("Cannot start outbox dispatcher: bot not initialized")
+            return
+        if self._outbox_task and not self._outbox_task.done():
+            return
+        
+        try:
+            await self.ensure_outbox_indexes()
+        except Exception as e:
+            logger.warning(f"Outbox index creation warning: {e}")
+        
+        self._outbox_stopping = False
+        self._outbox_task = asyncio.create_task(self._run_outbox_dispatcher())
+        logger.info("Telegram outbox dispatcher started")
+    
+    async def stop_outbox_dispatcher(self):
+        """Остановить фоновый диспетчер outbox"""
+        if not self._outbox_task:
+            return
+        self._outbox_stopping = True
+        self._outbox_event.set()
+        try:
+            await asyncio.wait_for(self._outbox_task, timeout=10)
+        except asyncio.TimeoutError:
+            self._outbox_task.cancel()
+        except Exception as e:
+            logger.error(f"Error stopping outbox dispatcher: {e}")
+        self._outbox_task = None
+        logger.info("Telegram outbox dispatcher stopped")
+    
+    async def get_outbox_stats(self) -> Dict[str, int]:
+        """Количество сообщений в outbox по статусам"""
+        pipeline = [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+        rows = await self.db[OUTBOX_COLLECTION].aggregate(pipeline).to_list(None)
+        return {row["_id"]: row["count"] for row in rows}
+    
+    async def _claim_outbox_message(self) -> Optional[Dict[str, Any]]:
+        """Атомарно забрать следующее готовое к отправке сообщение"""
+        now = datetime.now(timezone.utc)
+        return await self.db[OUTBOX_COLLECTION].find_one_and_update(
+            {
+                "$or": [
+                    {"status": "pending", "next_attempt_at": {"$lte": now}},
+                    # Сообщение взял процесс, который упал до завершения отправки
+                    {"status": "sending", "locked_until": {"$lt": now}}
+                ]
+            },
+            {"$set": {
+                "status": "sending",
+                "locked_until": now + timedelta(seconds=OUTBOX_LOCK_SECONDS)
+            }},
+            sort=[("next_attempt_at", 1), ("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+    
+    async def _outbox_idle_timeout(self) -> float:
+        """Сколько ждать до ближайшего отложенного сообщения (не дольше OUTBOX_POLL_INTERVAL)"""
+        upcoming = await self.db[OUTBOX_COLLECTION].find_one(
+            {"status": "pending"},
+            {"next_attempt_at": 1},
+            sort=[("next_attempt_at", 1)]
+        )
+        if not upcoming:
+            return OUTBOX_POLL_INTERVAL
+        next_attempt_at = upcoming["next_attempt_at"]
+        if next_attempt_at.tzinfo is None:
+            next_attempt_at = next_attempt_at.replace(tzinfo=timezone.utc)
+        delay = (next_attempt_at - datetime.now(timezone.utc)).total_seconds()
+        return min(max(delay, 0.05), OUTBOX_POLL_INTERVAL)
+    
+    def _reserve_chat_slot(self, chat_id: str) -> float:
+        """
+        Занять слот отправки в чат (не чаще TELEGRAM_PER_CHAT_INTERVAL)
+        Возвращает 0 если можно отправлять сейчас, иначе сколько секунд ждать
+        """
+        now = time.monotonic()
+        next_allowed = self._chat_next_send.get(chat_id, 0.0)
+        if next_allowed > now:
+            return next_allowed - now
+        self._chat_next_send[chat_id] = now + TELEGRAM_PER_CHAT_INTERVAL
+        
+        # Не даем словарю расти бесконечно
+        if len(self._chat_next_send) > 10000:
+            self._chat_next_send = {k: v for k, v in self._chat_next_send.items() if v > now}
+        return 0.0
+    
+    async def _reschedule_outbox_message(self, message: Dict[str, Any], delay: float, error: Optional[str] = None, count_attempt: bool = True):
+        update = {
+            "status": "pending",
+            "next_attempt_at": datetime.now(timezone.utc) + timedelta(seconds=delay)
+        }
+        if error:
+            update["last_error"] = error
+        operation = {"$set": update, "$unset": {"locked_until": ""}}
+        if count_attempt:
+            operation["$inc"] = {"attempts": 1}
+        await self.db[OUTBOX_COLLECTION].update_one({"_id": message["_id"]}, operation)
+    
+    async def _deliver_outbox_message(self, message: Dict[str, Any]):
+        """Отправить одно сообщение из outbox и зафиксировать результат"""
+        collection = self.db[OUTBOX_COLLECTION]
+        chat_id = message["chat_id"]
+        try:
+            await self.bot.send_message(
+                chat_id=chat_id,
+                text=message["text"],
+                parse_mode=message.get("parse_mode") or 'HTML'
+            )
+            await collection.update_one(
+                {"_id": message["_id"]},
+                {
+                    "$set": {"status": "sent", "sent_at": datetime.now(timezone.utc)},
+                    "$inc": {"attempts": 1},
+                    "$unset": {"locked_until": "", "last_error": ""}
+                }
+            )
+            logger.info(f"Message sent to {chat_id}")
+        except RetryAfter as e:
+            # Telegram просит подождать - притормаживаем всю отправку
+            retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else float(e.retry_after)
+            logger.warning(f"Telegram rate limit hit, retry after {retry_after}s")
+            self.global_rate_limiter.penalize(retry_after)
+            await self._reschedule_outbox_message(message, retry_after, str(e), count_attempt=False)
+        except (Forbidden, BadRequest, InvalidToken) as e:
+            # Пользователь заблокировал бота, чат не найден и т.п. - повтор не поможет
+            logger.error(f"Failed to send message to {chat_id}: {e}")
+            await collection.update_one(
+                {"_id": message["_id"]},
+                {
+                    "$set": {"status": "failed", "last_error": str(e), "failed_at": datetime.now(timezone.utc)},
+                    "$inc": {"attempts": 1},
+                    "$unset": {"locked_until": ""}
+                }
+            )
+        except Exception as e:
+            attempts = message.get("attempts", 0) + 1
+            if attempts >= OUTBOX_MAX_ATTEMPTS:
+                logger.error(f"Giving up on message to {chat_id} after {attempts} attempts: {e}")
+                await collection.update_one(
+                    {"_id": message["_id"]},
+                    {
+                        "$set": {"status": "failed", "last_error": str(e), "failed_at": datetime.now(timezone.utc)},
+                        "$inc": {"attempts": 1},
+                        "$unset": {"locked_until": ""}
+                    }
+                )
+                return
+            delay = min(OUTBOX_BACKOFF_BASE * (2 ** (attempts - 1)), OUTBOX_BACKOFF_MAX)
+            delay += random.uniform(0, delay / 2)
+            logger.warning(f"Failed to send message to {chat_id} (attempt {attempts}), retry in {delay:.1f}s: {e}")
+            await self._reschedule_outbox_message(message, delay, str(e))
+    
+    async def _run_outbox_dispatcher(self):
+        """Основной цикл диспетчера outbox"""
+        semaphore = asyncio.Semaphore(OUTBOX_CONCURRENCY)
+        in_flight = set()
+        
+        async def deliver(message):
+            try:
+                await self._deliver_outbox_message(message)
+            except Exception as e:
+                logger.error(f"Outbox delivery error: {e}")
+            finally:
+                semaphore.release()
+        
+        while not self._outbox_stopping:
+            await semaphore.acquire()
+            handed_off = False
+            try:
+                message = await self._claim_outbox_message()
+                if not message:
+                    self._outbox_event.clear()
+                    try:
+                        await asyncio.wait_for(self._outbox_event.wait(), timeout=await self._outbox_idle_timeout())
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                
+                # Сначала глобальный лимит, затем слот чата - чтобы ожидание
+                # глобального токена не сжимало интервал между сообщениями в чат
+                await self.global_rate_limiter.acquire()
+                wait = self._reserve_chat_slot(message["chat_id"])
+                if wait > 0:
+                    await self._reschedule_outbox_message(message, wait, count_attempt=False)
+                    continue
+                
+                task = asyncio.create_task(deliver(message))
+                handed_off = True
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Outbox dispatcher error: {e}")
+                await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+            finally:
+                if not handed_off:
+                    semaphore.release()
+        
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+    
     async def send_admin_message_to_client(self, client_telegram_id: str, message_text: str, admin_name: str = "Администратор") -> bool:
         """Отправить сообщение клиенту от имени админа"""
         if not self.bot:
@@ -337,7 +725,7 @@ class TelegramNotifier:
             f"💰 Сумма: <b>{total_amount:,.2f} ₽</b>\n\n"
             f"⚡️ Требуется подтверждение в админ-панели"
         )
-        return await self.send_message(self.admin_id, message)
+        return await self.enqueue_message(self.admin_id, message)
     
     async def notify_user_order_confirmed(
         self,
@@ -355,7 +743,7 @@ class TelegramNotifier:
             message += f"💬 Комментарий: {admin_comment}\n\n"
         message += "Мы сообщим вам о дальнейших изменениях статуса."
         
-        return await self.send_message(user_telegram_id, message)
+        return await self.enqueue_message(user_telegram_id, message)
     
     async def notify_user_order_rejected(
         self,
@@ -370,7 +758,7 @@ class TelegramNotifier:
             f"📝 Причина: {reason}\n\n"
             f"Свяжитесь с нами для уточнения деталей."
         )
-        return await self.send_message(user_telegram_id, message)
+        return await self.enqueue_message(user_telegram_id, message)
     
     async def notify_user_order_sent_to_supplier(
         self,
@@ -385,7 +773,7 @@ class TelegramNotifier:
             f"🏭 Номер у поставщика: <b>{supplier_order_number}</b>\n\n"
             f"Ожидайте дальнейших обновлений."
         )
-        return await self.send_message(user_telegram_id, message)
+        return await self.enqueue_message(user_telegram_id, message)
 
     
     async def notify_user_order_status_changed(
@@ -415,7 +803,7 @@ class TelegramNotifier:
         if comment:
             message += f"\n💬 Комментарий: {comment}\n"
         
-        return await self.send_message(user_telegram_id, message)
+        return await self.enqueue_message(user_telegram_id, message)
 
     
     async def notify_user_order_completed(
@@ -429,7 +817,7 @@ class TelegramNotifier:
             f"📦 Заказ: <b>#{order_id}</b>\n\n"
             f"Благодарим за покупку! 🙏"
         )
-        return await self.send_message(user_telegram_id, message)
+        return await self.enqueue_message(user_telegram_id, message)
     
     async def notify_admin_new_visitor(
         self,
@@ -460,13 +848,13 @@ class TelegramNotifier:
         if user_display:
             message += f"📝 Имя: {user_display}\n"
         
-        return await self.send_message(self.admin_id, message)
+        return await self.enqueue_message(self.admin_id, message)
 
 # Singleton instance
 telegram_notifier = None
 
-def get_telegram_notifier() -> TelegramNotifier:
+def get_telegram_notifier(db: Optional[AsyncIOMotorDatabase] = None) -> TelegramNotifier:
     global telegram_notifier
     if telegram_notifier is None:
-        telegram_notifier = TelegramNotifier()
+        telegram_notifier = TelegramNotifier(db)
     return telegram_notifier
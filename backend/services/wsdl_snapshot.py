@@ -0,0 +1,311 @@
+"""
+Локальный снимок WSDL 4tochki и кэш разобранной схемы zeep
+
+Снимок - это WSDL и все импортируемые XSD, сохраненные в backend/wsdl/4tochki
+(ссылки schemaLocation/location переписаны на локальные файлы) + manifest.json
+с адресом источника и sha256 документов. Обновляется скриптом manage_wsdl_snapshot.py (в корне проекта).
+
+Разбор WSDL со всеми схемами - самая долгая часть создания клиента, поэтому
+готовый zeep Document сохраняется в pickle. Кэш привязан к содержимому снимка
+и версиям zeep/python: при любом изменении он просто пересоздается
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import pickle
+import sys
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse, parse_qs
+
+import zeep
+from lxml import etree
+from zeep import Settings
+from zeep.cache import SqliteCache
+from zeep.transports import Transport
+from zeep.wsdl import Document
+from zeep.xsd.valueobjects import ArrayValue
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_SNAPSHOT_DIR = BACKEND_DIR / "wsdl" / "4tochki"
+DEFAULT_SCHEMA_CACHE = BACKEND_DIR / ".cache" / "4tochki_schema.pickle"
+DEFAULT_HTTP_CACHE = BACKEND_DIR / ".cache" / "zeep_http.db"
+
+ROOT_FILENAME = "service.wsdl"
+MANIFEST_FILENAME = "manifest.json"
+
+WSDL_NS = "http://schemas.xmlsoap.org/wsdl/"
+XSD_NS = "http://www.w3.org/2001/XMLSchema"
+
+# Атрибуты со ссылками на другие документы
+_REFERENCES = [
+    (f"{{{WSDL_NS}}}import", "location"),
+    (f"{{{XSD_NS}}}import", "schemaLocation"),
+    (f"{{{XSD_NS}}}include", "schemaLocation"),
+    (f"{{{XSD_NS}}}redefine", "schemaLocation"),
+]
+
+
+def get_snapshot_dir() -> Optional[Path]:
+    """
+    Каталог снимка WSDL или None, если снимок не используется
+    FOURTHCHKI_WSDL_SNAPSHOT: путь к каталогу или 'off'; по умолчанию - backend/wsdl/4tochki, если там есть снимок
+    """
+    value = os.environ.get('FOURTHCHKI_WSDL_SNAPSHOT', '')
+    if value.lower() in ('off', 'false', '0'):
+        return None
+    path = Path(value) if value else DEFAULT_SNAPSHOT_DIR
+    return path if (path / ROOT_FILENAME).exists() else None
+
+
+def get_schema_cache_path() -> Optional[Path]:
+    """Файл кэша разобранной схемы (FOURTHCHKI_SCHEMA_CACHE, 'off' - без кэша)"""
+    value = os.environ.get('FOURTHCHKI_SCHEMA_CACHE', '')
+    if value.lower() in ('off', 'false', '0'):
+        return None
+    return Path(value) if value else DEFAULT_SCHEMA_CACHE
+
+
+def get_http_cache() -> SqliteCache:
+    """
+    HTTP кэш zeep для загрузки WSDL по сети (когда снимка нет)
+    Лежит рядом с backend, а не во временном каталоге - переживает перезапуск
+    """
+    path = Path(os.environ.get('FOURTHCHKI_HTTP_CACHE', str(DEFAULT_HTTP_CACHE)))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return SqliteCache(path=str(path), timeout=24 * 3600)
+
+
+# --- Снимок: скачивание, сохранение, сравнение ---
+
+def _local_name(url: str, index: int) -> str:
+    """Имя файла для документа: ?xsd=xsd0 -> xsd0.xsd, ?wsdl=wsdl0 -> wsdl0.wsdl"""
+    query = parse_qs(urlparse(url).query)
+    for key in ("xsd", "wsdl"):
+        if query.get(key) and query[key][0]:
+            return f"{query[key][0]}.{key}"
+    suffix = Path(urlparse(url).path).suffix or ".xml"
+    return f"doc{index}{suffix}"
+
+
+def _references(tree: etree._Element):
+    for tag, attribute in _REFERENCES:
+        for node in tree.iter(tag):
+            if node.get(attribute):
+                yield node, attribute
+
+
+def fetch_documents(wsdl_url: str, session=None) -> Dict[str, bytes]:
+    """Скачать WSDL и рекурсивно все импортируемые документы: {url: содержимое}"""
+    import requests
+
+    session = session or requests.Session()
+    documents: Dict[str, bytes] = {}
+    queue = [wsdl_url]
+    while queue:
+        url = queue.pop(0)
+        if url in documents:
+            continue
+        response = session.get(url, timeout=60)
+        response.raise_for_status()
+        documents[url] = response.content
+        tree = etree.fromstring(response.content)
+        for node, attribute in _references(tree):
+            queue.append(urljoin(url, node.get(attribute)))
+    return documents
+
+
+def localize_documents(wsdl_url: str, documents: Dict[str, bytes]) -> Dict[str, bytes]:
+    """Переписать ссылки между документами на локальные имена файлов: {имя файла: содержимое}"""
+    names = {wsdl_url: ROOT_FILENAME}
+    for index, url in enumerate(url for url in documents if url != wsdl_url):
+        names[url] = _local_name(url, index)
+
+    files = {}
+    for url, content in documents.items():
+        tree = etree.fromstring(content)
+        for node, attribute in _references(tree):
+            target = urljoin(url, node.get(attribute))
+            if target in names:
+                node.set(attribute, names[target])
+        files[names[url]] = etree.tostring(tree, xml_declaration=True, encoding="utf-8")
+    return files
+
+
+def _digest(content: bytes) -> str:
+    # C14N - чтобы перевод строк и порядок атрибутов не считались изменением
+    canonical = etree.tostring(etree.fromstring(content), method="c14n")
+    return hashlib.sha256(canonical).hexdigest()
+
+
+def write_snapshot(wsdl_url: str, files: Dict[str, bytes], target_dir: Path = DEFAULT_SNAPSHOT_DIR):
+    """Сохранить снимок и manifest.json"""
+    target_dir.mkdir(parents=True, exist_ok=True)
+    for old in target_dir.glob("*"):
+        if old.suffix in (".wsdl", ".xsd", ".xml"):
+            old.unlink()
+    for name, content in files.items():
+        (target_dir / name).write_bytes(content)
+
+    manifest = {
+        "source_url": wsdl_url,
+        "fetched_at": datetime.now(timezone.utc).isoformat(),
+        "files": {name: _digest(content) for name, content in sorted(files.items())},
+    }
+    (target_dir / MANIFEST_FILENAME).write_text(json.dumps(manifest, indent=2, ensure_ascii=False) + "\n")
+    return manifest
+
+
+def read_manifest(snapshot_dir: Path) -> Dict:
+    return json.loads((snapshot_dir / MANIFEST_FILENAME).read_text())
+
+
+def diff_snapshot(snapshot_dir: Path, files: Dict[str, bytes]) -> List[Tuple[str, str]]:
+    """
+    Сравнить снимок с актуальными документами
+    Возвращает список (имя файла, added/removed/changed), пустой - расхождений нет
+    """
+    expected = read_manifest(snapshot_dir)["files"]
+    actual = {name: _digest(content) for name, content in files.items()}
+    drift = []
+    for name in sorted(set(expected) | set(actual)):
+        if name not in expected:
+            drift.append((name, "added"))
+        elif name not in actual:
+            drift.append((name, "removed"))
+        elif expected[name] != actual[name]:
+            drift.append((name, "changed"))
+    return drift
+
+
+# --- Кэш разобранной схемы ---
+
+def _rebuild_class(name, bases, attrs):
+    return type(name, bases, dict(attrs, __module__="zeep.xsd.dynamic_types"))
+
+
+def _new_instance(cls):
+    return cls.__new__(cls)
+
+
+def _value_class(xsd_type, is_array):
+    return xsd_type._array_class if is_array else xsd_type._value_class
+
+
+class _SchemaPickler(pickle.Pickler):
+    """
+    Pickler для zeep Document
+    - Settings и Transport не сохраняются, при загрузке подставляются текущие
+    - классы, которые zeep создает на лету (zeep.xsd.dynamic_types, zeep.objects), пересоздаются
+    - lxml QName/элементы сохраняются как текст
+    """
+
+    def persistent_id(self, obj):
+        if isinstance(obj, Settings):
+            return "settings"
+        if isinstance(obj, Transport):
+            return "transport"
+        return None
+
+    def reducer_override(self, obj):
+        if isinstance(obj, type):
+            if obj.__module__ == "zeep.objects":
+                return _value_class, (obj._xsd_type, issubclass(obj, ArrayValue))
+            if obj.__module__ == "zeep.xsd.dynamic_types":
+                attrs = {
+                    key: value for key, value in vars(obj).items()
+                    if key not in ("__module__", "__dict__", "__weakref__", "__doc__")
+                }
+                return _rebuild_class, (obj.__name__, obj.__bases__, attrs)
+            return NotImplemented
+        if isinstance(obj, etree.QName):
+            return etree.QName, (obj.text,)
+        if isinstance(obj, etree._Element):
+            return etree.fromstring, (etree.tostring(obj),)
+        if type(obj).__module__ == "zeep.xsd.dynamic_types":
+            # Ленивые классы значений пересоздадутся при первом обращении
+            state = {
+                key: value for key, value in vars(obj).items()
+                if key not in ("_value_class", "_array_class")
+            }
+            return _new_instance, (type(obj),), state
+        return NotImplemented
+
+
+class _SchemaUnpickler(pickle.Unpickler):
+    def __init__(self, file, settings: Settings, transport: Transport):
+        super().__init__(file)
+        self._persistent = {"settings": settings, "transport": transport}
+
+    def persistent_load(self, pid):
+        return self._persistent[pid]
+
+
+def _cache_key(snapshot_dir: Path) -> str:
+    digest = hashlib.sha256()
+    digest.update(f"zeep={zeep.__version__};python={sys.version_info[:2]}".encode())
+    for path in sorted(snapshot_dir.glob("*")):
+        if path.name != MANIFEST_FILENAME and path.is_file():
+            digest.update(path.name.encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def _load_cached_document(cache_path: Path, key: str, settings: Settings, transport: Transport) -> Optional[Document]:
+    if not cache_path.exists():
+        return None
+    try:
+        with cache_path.open("rb") as file:
+            cached_key = pickle.load(file)
+            if cached_key != key:
+                logger.info("WSDL schema cache is stale, rebuilding")
+                return None
+            return _SchemaUnpickler(file, settings, transport).load()
+    except Exception as e:
+        logger.warning(f"Failed to load WSDL schema cache {cache_path}: {e}")
+        return None
+
+
+def _store_cached_document(cache_path: Path, key: str, document: Document):
+    buffer = io.BytesIO()
+    try:
+        pickle.dump(key, buffer)
+        _SchemaPickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(document)
+    except Exception as e:
+        logger.warning(f"WSDL schema cannot be cached: {e}")
+        return
+
+    # Пишем во временный файл и переименовываем - воркеры стартуют одновременно
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent, prefix=cache_path.name)
+    with os.fdopen(fd, "wb") as file:
+        file.write(buffer.getvalue())
+    os.replace(tmp_path, cache_path)
+
+
+def load_snapshot_document(
+    snapshot_dir: Path,
+    transport: Transport,
+    settings: Settings,
+    cache_path: Optional[Path] = None,
+) -> Document:
+    """Получить zeep Document из снимка: из кэша схемы или разбором локальных файлов"""
+    key = _cache_key(snapshot_dir)
+    if cache_path:
+        document = _load_cached_document(cache_path, key, settings, transport)
+        if document is not None:
+            logger.info(f"WSDL loaded from schema cache {cache_path}")
+            return document
+
+    document = Document(str(snapshot_dir / ROOT_FILENAME), transport, settings=settings)
+    logger.info(f"WSDL parsed from snapshot {snapshot_dir}")
+    if cache_path:
+        _store_cached_document(cache_path, key, document)
+    return document
@@ -0,0 +1,83 @@
+"""
+Преобразование документов MongoDB в модели ответов и обратно
+
+Даты заказов и пользователей хранятся как BSON datetime (клиент MongoDB создан
+с tz_aware=True - даты возвращаются в UTC с часовым поясом). Документ целиком
+валидируется pydantic-core за один вызов: строковые статусы и даты из старых
+документов (ISO строки до миграции) приводятся к типам модели без циклов по полям.
+Списки документов эндпоинты возвращают как есть - их так же за один проход
+валидирует response_model
+"""
+
+import base64
+import json
+from datetime import datetime
+from enum import Enum
+from typing import Any, Dict, List, Tuple, Union
+
+from pydantic import BaseModel
+
+from models.order import Order
+from models.user import User
+
+# Поля-даты, которые хранились ISO строками (см. services/date_migration.py)
+ORDER_DATE_FIELDS = ("created_at", "confirmed_at", "updated_at")
+USER_DATE_FIELDS = ("created_at", "last_activity")
+
+
+def encode_model(model: BaseModel) -> Dict[str, Any]:
+    """Модель -> документ для записи: даты остаются datetime, перечисления - значениями"""
+    doc = model.model_dump()
+    for key, value in doc.items():
+        if isinstance(value, Enum):
+            doc[key] = value.value
+    return doc
+
+
+def decode_order(doc: Dict[str, Any]) -> Order:
+    return Order.model_validate(doc)
+
+
+def decode_user(doc: Dict[str, Any]) -> User:
+    return User.model_validate(doc)
+
+
+def encode_cursor(created_at: Union[datetime, str], order_id: str) -> str:
+    """
+    Курсор keyset пагинации по (created_at, order_id) - непрозрачная строка для клиента
+    До окончания миграции created_at старых заказов - ISO строка: курсор хранит и тип
+    """
+    if isinstance(created_at, datetime):
+        value = {"c": created_at.isoformat()}
+    else:
+        value = {"s": str(created_at)}
+    payload = json.dumps({**value, "o": order_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Union[datetime, str], str]:
+    """Обратное к encode_cursor; ValueError для некорректного курсора"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if "s" in payload:
+            return str(payload["s"]), str(payload["o"])
+        return datetime.fromisoformat(payload["c"]), str(payload["o"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def cursor_condition(created_at: Union[datetime, str], order_id: str) -> Dict[str, Any]:
+    """
+    Условие "строго после курсора" для сортировки {created_at: -1, order_id: -1}
+    MongoDB сортирует по типу раньше, чем по значению: по убыванию сначала идут даты,
+    затем ISO строки старых заказов. $lt сравнивает только значения одного типа,
+    поэтому после курсора-даты добавляются все строки
+    """
+    conditions: List[Dict[str, Any]] = [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "order_id": {"$lt": order_id}},
+    ]
+    if isinstance(created_at, datetime):
+        conditions.append({"created_at": {"$type": "string"}})
+    return {"$or": conditions}
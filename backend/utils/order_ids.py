@@ -0,0 +1,73 @@
+"""
+Генератор номеров заказов в стиле ULID
+
+Формат: ORD-YYYYMMDDHHMMSSmmm-XXXXXXXXXX
+- время UTC с точностью до миллисекунды (номера сортируются по времени создания)
+- 10 символов Crockford Base32 (50 бит): случайные для нового миллисекундного
+  интервала и монотонно увеличиваемые внутри него
+
+Внутри одного процесса номера строго возрастают и не повторяются.
+Между воркерами коллизию исключает случайная часть, а последний рубеж -
+уникальный индекс на orders.order_id
+"""
+
+import secrets
+import threading
+import time
+from datetime import datetime, timezone
+
+ORDER_ID_PREFIX = "ORD"
+
+_CROCKFORD_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_RANDOM_CHARS = 10
+_RANDOM_BITS = _RANDOM_CHARS * 5
+_RANDOM_MAX = (1 << _RANDOM_BITS) - 1
+
+
+def _encode_base32(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        value, index = divmod(value, 32)
+        chars.append(_CROCKFORD_ALPHABET[index])
+    return "".join(reversed(chars))
+
+
+class OrderIdGenerator:
+    """Монотонный потокобезопасный генератор номеров заказов"""
+
+    def __init__(self, prefix: str = ORDER_ID_PREFIX):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._last_random = 0
+
+    def _next_components(self):
+        with self._lock:
+            now_ms = time.time_ns() // 1_000_000
+            # Часы могли уйти назад - продолжаем от последнего значения
+            if now_ms <= self._last_ms:
+                now_ms = self._last_ms
+                self._last_random += 1
+                if self._last_random > _RANDOM_MAX:
+                    # Исчерпали диапазон в этой миллисекунде - занимаем следующую
+                    now_ms += 1
+                    self._last_random = secrets.randbits(_RANDOM_BITS - 1)
+            else:
+                # Старший бит оставляем нулевым, чтобы был запас для инкремента
+                self._last_random = secrets.randbits(_RANDOM_BITS - 1)
+            self._last_ms = now_ms
+            return now_ms, self._last_random
+
+    def generate(self) -> str:
+        now_ms, random_part = self._next_components()
+        moment = datetime.fromtimestamp(now_ms / 1000, tz=timezone.utc)
+        timestamp = moment.strftime("%Y%m%d%H%M%S") + f"{now_ms % 1000:03d}"
+        return f"{self.prefix}-{timestamp}-{_encode_base32(random_part, _RANDOM_CHARS)}"
+
+
+_generator = OrderIdGenerator()
+
+
+def generate_order_id() -> str:
+    """Получить новый уникальный номер заказа"""
+    return _generator.generate()
@@ -0,0 +1,61 @@
+"""
+Token bucket для ограничения частоты операций внутри процесса
+"""
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Классический token bucket: capacity токенов, пополнение rate токенов в секунду
+    Не потокобезопасен - рассчитан на использование внутри одного event loop
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """Через сколько секунд хватит токенов (0 - уже хватает); токены не берутся"""
+        self._refill(time.monotonic())
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    def refund(self, tokens: float):
+        """Вернуть взятые токены (не больше capacity)"""
+        self.tokens = min(self.capacity, self.tokens + tokens)
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """
+        Попытаться взять токены
+        Возвращает 0 если токены взяты, иначе через сколько секунд их хватит
+        """
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    async def acquire(self, tokens: float = 1):
+        """Дождаться и взять токены"""
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def penalize(self, seconds: float):
+        """Заблокировать выдачу токенов на seconds (например, после 429 от Telegram)"""
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+        self.updated_at = time.monotonic()
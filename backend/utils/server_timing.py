@@ -0,0 +1,153 @@
+"""
+Разбивка времени запроса по фазам для заголовка Server-Timing
+
+Последовательные фазы эндпоинта отмечаются в конце каждой:
+
+    markup_settings = await get_markup_settings(db)
+    server_timing.lap("markup")      # время с начала эндпоинта
+    response = await ...
+    server_timing.lap("supplier")    # время с предыдущей отметки
+
+Вложенные фазы (вызов SOAP внутри загрузки кэша) - контекстным менеджером:
+
+    with server_timing.span("soap"):
+        ...
+
+Фазы текущего запроса хранятся в contextvar: его видят и задачи, и потоки
+asyncio.to_thread, запущенные из запроса. Одноименные фазы суммируются.
+Эндпоинт, помеченный @timed_endpoint, дополнительно получает фазу encode -
+от возврата из эндпоинта до готового ответа (сериализация в JSON).
+
+Включается SERVER_TIMING_ENABLED=true. Выключенный, span() возвращает общий пустой
+контекстный менеджер, lap() сразу возвращается, а @timed_endpoint оставляет функцию
+без обертки
+"""
+
+import functools
+import json
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'false').lower() == 'true'
+# Писать разбивку в лог (одна JSON строка на запрос) для запросов не быстрее N мс
+SERVER_TIMING_LOG = os.environ.get('SERVER_TIMING_LOG', 'false').lower() == 'true'
+SERVER_TIMING_LOG_MIN_MS = float(os.environ.get('SERVER_TIMING_LOG_MIN_MS', '0'))
+
+_current: ContextVar[Optional["RequestTimings"]] = ContextVar("server_timing", default=None)
+
+
+class RequestTimings:
+    """Фазы одного запроса: имя -> суммарная длительность в секундах"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.last_lap = self.started
+        self.handler_finished: Optional[float] = None
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def finish(self) -> float:
+        """Закончить запрос: добавить encode и вернуть общую длительность"""
+        now = time.perf_counter()
+        if self.handler_finished is not None:
+            self.add("encode", now - self.handler_finished)
+        return now - self.started
+
+    def header_value(self, total: float) -> str:
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.phases.items()]
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+    def log(self, method: str, path: str, status: int, total: float):
+        if total * 1000 < SERVER_TIMING_LOG_MIN_MS:
+            return
+        logger.info(json.dumps({
+            "event": "server_timing",
+            "method": method,
+            "path": path,
+            "status": status,
+            "total_ms": round(total * 1000, 1),
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+        }, ensure_ascii=False))
+
+
+class _Span:
+    __slots__ = ("timings", "name", "started")
+
+    def __init__(self, timings: RequestTimings, name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.timings.add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str):
+    """Замерить фазу текущего запроса (вне запроса или при выключенном замере - ничего)"""
+    timings = _current.get()
+    if timings is None:
+        return _NOOP_SPAN
+    return _Span(timings, name)
+
+
+def lap(name: str):
+    """Закончить фазу, начатую предыдущей отметкой (или началом эндпоинта)"""
+    timings = _current.get()
+    if timings is None:
+        return
+    now = time.perf_counter()
+    timings.add(name, now - timings.last_lap)
+    timings.last_lap = now
+
+
+def begin_request() -> RequestTimings:
+    """Начать замер запроса (вызывается middleware до обработки)"""
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+def timed_endpoint(func):
+    """Отметить, когда эндпоинт вернул результат - остаток до ответа считается фазой encode"""
+    if not SERVER_TIMING_ENABLED:
+        return func
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        timings = _current.get()
+        if timings is not None:
+            # Отметки фаз считаются от начала эндпоинта, а не от начала запроса
+            timings.last_lap = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            timings = _current.get()
+            if timings is not None:
+                timings.handler_finished = time.perf_counter()
+
+    return wrapper
@@ -0,0 +1,105 @@
+"""
+Проверка initData Telegram Mini App и токены сессии
+
+initData - строка, которую Telegram передает Mini App (window.Telegram.WebApp.initData),
+подписанная HMAC-SHA256 ключом, производным от токена бота:
+https://core.telegram.org/bots/webapps#validating-data-received-via-the-mini-app
+
+После проверки выдается короткоживущий токен сессии (JWT, HS256) с telegram_id
+и флагами is_admin / is_blocked. Эндпоинты и middleware доверяют токену вместо
+поиска пользователя в базе; изменения флагов вступают в силу не позже чем через
+SESSION_TOKEN_TTL_MINUTES
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qsl
+
+import jwt
+
+# Сколько секунд initData считается действительной (auth_date)
+TELEGRAM_INIT_DATA_MAX_AGE = int(os.environ.get('TELEGRAM_INIT_DATA_MAX_AGE', '86400'))
+SESSION_TOKEN_TTL_MINUTES = int(os.environ.get('SESSION_TOKEN_TTL_MINUTES', '15'))
+SESSION_TOKEN_ALGORITHM = "HS256"
+
+
+class TelegramAuthError(ValueError):
+    """Неверная или просроченная initData либо токен сессии"""
+
+
+def verify_init_data(init_data: str, bot_token: str, max_age: int = TELEGRAM_INIT_DATA_MAX_AGE) -> Dict[str, Any]:
+    """Проверить подпись initData; возвращает поля initData с разобранным user"""
+    try:
+        fields = dict(parse_qsl(init_data, keep_blank_values=True, strict_parsing=True))
+    except ValueError:
+        raise TelegramAuthError("Malformed init data")
+
+    received_hash = fields.pop("hash", None)
+    if not received_hash:
+        raise TelegramAuthError("Init data hash is missing")
+
+    data_check_string = "\n".join(f"{key}={value}" for key, value in sorted(fields.items()))
+    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    expected_hash = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected_hash, received_hash):
+        raise TelegramAuthError("Init data signature mismatch")
+
+    try:
+        auth_date = int(fields.get("auth_date", "0"))
+        user = json.loads(fields.get("user") or "null")
+    except ValueError:
+        raise TelegramAuthError("Malformed init data")
+    if max_age and time.time() - auth_date > max_age:
+        raise TelegramAuthError("Init data expired")
+    if not isinstance(user, dict) or "id" not in user:
+        raise TelegramAuthError("Init data has no user")
+
+    fields["user"] = user
+    fields["auth_date"] = auth_date
+    return fields
+
+
+def _session_secret() -> Optional[str]:
+    """SESSION_SECRET, по умолчанию - производный от токена бота (одинаковый во всех воркерах)"""
+    secret = os.environ.get('SESSION_SECRET')
+    if secret:
+        return secret
+    bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
+    if not bot_token:
+        return None
+    return hmac.new(b"SessionToken", bot_token.encode(), hashlib.sha256).hexdigest()
+
+
+def issue_session_token(user: Dict[str, Any]) -> Tuple[str, datetime]:
+    """Токен сессии для документа пользователя -> (токен, время истечения)"""
+    secret = _session_secret()
+    if not secret:
+        raise TelegramAuthError("Session secret is not configured")
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(minutes=SESSION_TOKEN_TTL_MINUTES)
+    claims = {
+        "sub": user["telegram_id"],
+        "adm": bool(user.get("is_admin")),
+        "blk": bool(user.get("is_blocked")),
+        "usr": user.get("username"),
+        "name": user.get("username") or user.get("first_name") or user["telegram_id"],
+        "iat": now,
+        "exp": expires_at,
+    }
+    return jwt.encode(claims, secret, algorithm=SESSION_TOKEN_ALGORITHM), expires_at
+
+
+def decode_session_token(token: str) -> Dict[str, Any]:
+    """Проверить подпись и срок токена сессии"""
+    secret = _session_secret()
+    if not secret:
+        raise TelegramAuthError("Session secret is not configured")
+    try:
+        return jwt.decode(token, secret, algorithms=[SESSION_TOKEN_ALGORITHM], options={"require": ["sub", "exp"]})
+    except jwt.InvalidTokenError as e:
+        raise TelegramAuthError(str(e))
@@ -0,0 +1,175 @@
+"""
+TTL кэш с объединением одновременных запросов (single-flight)
+и отдачей устаревших данных на время обновления (stale-while-revalidate)
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+# Откуда взят ответ
+CACHE_HIT = "hit"              # свежее значение из кэша
+CACHE_STALE = "stale"          # устаревшее значение, обновление запущено в фоне
+CACHE_MISS = "miss"            # загружено этим запросом
+CACHE_COALESCED = "coalesced"  # дождались загрузки, начатой другим запросом
+CACHE_BYPASS = "bypass"        # кэш пропущен по требованию свежих данных
+
+
+@dataclass
+class CacheResult:
+    value: Any
+    age: float  # секунд с момента загрузки значения
+    status: str
+
+
+class SingleFlightCache:
+    """
+    Кэш результатов асинхронных загрузок
+    - значение свежее ttl секунд, при переполнении вытесняются самые старые записи
+    - еще stale_ttl секунд после этого значение отдается сразу, а обновляется в фоне
+    - одновременные запросы одного ключа ждут одну загрузку, а не запускают свои
+    - ошибки загрузки не кэшируются и передаются всем ожидающим
+    Не потокобезопасен - рассчитан на использование внутри одного event loop
+    """
+
+    def __init__(self, name: str, ttl: float, max_entries: int = 1000, stale_ttl: float = 0):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.stats = {
+            "hits": 0, "stale": 0, "misses": 0, "coalesced": 0, "bypass": 0, "refreshes": 0, "errors": 0,
+        }
+
+    def _lookup(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """(значение, возраст) или None, если записи нет или она старше ttl + stale_ttl"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, loaded_at = entry
+        age = time.monotonic() - loaded_at
+        if age >= self.ttl + self.stale_ttl:
+            del self._entries[key]
+            return None
+        return value, age
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Свежее значение или None"""
+        found = self._lookup(key)
+        if found is None or found[1] >= self.ttl:
+            return None
+        return found[0]
+
+    def set(self, key: Hashable, value: Any):
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def fetch(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+        should_cache: Optional[Callable[[Any], bool]] = None,
+        fresh: bool = False,
+    ) -> CacheResult:
+        """
+        Значение из кэша или загрузка (одна загрузка на ключ одновременно)
+        fresh=True - не отдавать значение из кэша (запрос с Cache-Control: no-cache)
+        """
+        if not fresh:
+            found = self._lookup(key)
+            if found is not None:
+                value, age = found
+                if age < self.ttl:
+                    self.stats["hits"] += 1
+                    return CacheResult(value, age, CACHE_HIT)
+                # Устарело, но в пределах stale_ttl - отвечаем сразу, обновляем в фоне
+                self.stats["stale"] += 1
+                if key not in self._inflight:
+                    self._start_load(key, loader, should_cache)
+                return CacheResult(value, age, CACHE_STALE)
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            status = CACHE_COALESCED
+        else:
+            self.stats["bypass" if fresh else "misses"] += 1
+            status = CACHE_BYPASS if fresh else CACHE_MISS
+            task = self._start_load(key, loader, should_cache)
+
+        # shield - отключившийся клиент не должен отменять загрузку для остальных
+        value = await asyncio.shield(task)
+        return CacheResult(value, 0.0, status)
+
+    async def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+        should_cache: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """Вернуть значение из кэша или загрузить его"""
+        return (await self.fetch(key, loader, should_cache)).value
+
+    async def refresh(
+        self,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+        should_cache: Optional[Callable[[Any], bool]] = None,
+    ) -> Any:
+        """
+        Загрузить значение заново, даже если в кэше есть свежее (прогрев)
+        Не учитывается в hits/misses - статистика отражает только запросы покупателей
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats["refreshes"] += 1
+            task = self._start_load(key, loader, should_cache)
+        return await asyncio.shield(task)
+
+    def _start_load(self, key: Hashable, loader, should_cache) -> asyncio.Task:
+        task = asyncio.ensure_future(self._load(key, loader, should_cache))
+        # Фоновое обновление никто не ждет - ошибку забираем, чтобы asyncio не ругался
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._inflight[key] = task
+        return task
+
+    async def _load(self, key: Hashable, loader, should_cache) -> Any:
+        try:
+            value = await loader()
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        if should_cache is None or should_cache(value):
+            self.set(key, value)
+        return value
+
+    def served_from_cache(self) -> Tuple[int, int]:
+        """(ответов без собственной загрузки, всего запросов)"""
+        served = self.stats["hits"] + self.stats["stale"] + self.stats["coalesced"]
+        return served, served + self.stats["misses"] + self.stats["bypass"]
+
+    def get_stats(self) -> Dict[str, Any]:
+        served, requests = self.served_from_cache()
+        return {
+            "name": self.name,
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "ttl_seconds": self.ttl,
+            "stale_ttl_seconds": self.stale_ttl,
+            **self.stats,
+            "hit_rate": round(served / requests, 3) if requests else 0.0,
+        }
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пропускной способности backend в зависимости от числа воркеров gunicorn
+
+Для каждого значения WEB_CONCURRENCY запускает `gunicorn -c gunicorn.conf.py server:app`,
+ждет готовности и дает нагрузку на выбранный эндпоинт с заданной параллельностью.
+Нужен запущенный MongoDB и backend/.env (как для обычного запуска).
+
+    python benchmark_workers.py --workers 1 2 4 --path /api/health --requests 5000 --concurrency 100
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+
+class Colors:
+    GREEN = '\033[92m'
+    RED = '\033[91m'
+    YELLOW = '\033[93m'
+    BLUE = '\033[94m'
+    RESET = '\033[0m'
+
+def print_test(message):
+    print(f"\n{Colors.BLUE}{'='*80}{Colors.RESET}")
+    print(f"{Colors.BLUE}{message}{Colors.RESET}")
+    print(f"{Colors.BLUE}{'='*80}{Colors.RESET}")
+
+def print_error(message):
+    print(f"{Colors.RED}❌ {message}{Colors.RESET}")
+
+def print_info(message):
+    print(f"ℹ️  {message}")
+
+def start_server(workers: int, port: int) -> subprocess.Popen:
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), BIND=f"127.0.0.1:{port}", LOG_LEVEL="warning", GUNICORN_ACCESS_LOG="")
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "server:app"],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+async def wait_ready(base_url: str, timeout: float = 60) -> bool:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                response = await client.get(f"{base_url}/api/")
+                if response.status_code == 200:
+                    return True
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    return False
+
+async def run_load(url: str, total: int, concurrency: int):
+    """Дать total запросов с параллельностью concurrency, вернуть (req/s, задержки, ошибки)"""
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal errors
+            for _ in counter:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(url)
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return total / elapsed, latencies, errors
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+async def benchmark(args):
+    results = []
+    for workers in args.workers:
+        print_test(f"{workers} воркер(ов): {args.requests} запросов, параллельно {args.concurrency}")
+        process = start_server(workers, args.port)
+        base_url = f"http://127.0.0.1:{args.port}"
+        try:
+            if not await wait_ready(base_url):
+                print_error("Сервер не запустился")
+                continue
+            # Прогрев: соединения с MongoDB и WSDL в каждом воркере
+            await run_load(f"{base_url}{args.path}", min(200, args.requests), args.concurrency)
+            rps, latencies, errors = await run_load(f"{base_url}{args.path}", args.requests, args.concurrency)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+        p50 = statistics.median(latencies) * 1000
+        p95 = percentile(latencies, 95) * 1000
+        print_info(f"{rps:.0f} req/s, p50 {p50:.1f} мс, p95 {p95:.1f} мс, ошибок: {errors}")
+        results.append((workers, rps, p50, p95, errors))
+
+    if not results:
+        return False
+
+    print(f"\n{Colors.BLUE}ИТОГОВЫЙ ОТЧЕТ{Colors.RESET} ({args.path}, CPU: {os.cpu_count()})")
+    print(f"{'Воркеров':>9} {'req/s':>9} {'x к 1':>7} {'p50, мс':>9} {'p95, мс':>9} {'ошибок':>7}")
+    base_rps = results[0][1]
+    for workers, rps, p50, p95, errors in results:
+        print(f"{workers:>9} {rps:>9.0f} {rps / base_rps:>7.2f} {p50:>9.1f} {p95:>9.1f} {errors:>7}")
+
+    return all(errors == 0 for *_, errors in results)
+
+def main():
+    parser = argparse.ArgumentParser(description="Масштабирование backend по числу воркеров")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--path", default="/api/health", help="Эндпоинт для нагрузки")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--port", type=int, default=8011)
+    args = parser.parse_args()
+
+    return asyncio.run(benchmark(args))
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
@@ -24,7 +24,35 @@ export const getTelegramUser = () => {
 };
 
 // Auth
+let sessionRefreshTimer = null;
+
+// Токен сессии добавляется ко всем запросам и обновляется за минуту до истечения
+const startSession = (session, initData) => {
+  axios.defaults.headers.common['Authorization'] = `Bearer ${session.token}`;
+  clearTimeout(sessionRefreshTimer);
+  const refreshIn = new Date(session.expires_at).getTime() - Date.now() - 60 * 1000;
+  sessionRefreshTimer = setTimeout(async () => {
+    try {
+      const response = await axios.post(`${API}/auth/session`, { init_data: initData });
+      startSession(response.data, initData);
+    } catch (error) {
+      // Без токена запросы продолжают работать - сервер проверит пользователя по базе
+      console.error('Не удалось обновить сессию:', error);
+      delete axios.defaults.headers.common['Authorization'];
+    }
+  }, Math.max(refreshIn, 0));
+};
+
 export const authenticateUser = async (userData) => {
+  // В Telegram входим только по подписанной initData и получаем токен сессии -
+  // без подписи вход не повторяем, иначе проверку initData можно обойти
+  const initData = window.Telegram?.WebApp?.initData;
+  if (initData) {
+    const response = await axios.post(`${API}/auth/session`, { init_data: initData });
+    startSession(response.data, initData);
+    return response.data.user;
+  }
+  // Вне Telegram (тесты) - вход без подписи, если он разрешен на сервере
   const response = await axios.post(`${API}/auth/telegram`, userData);
   return response.data;
 };
@@ -87,10 +115,12 @@ export const getWarehouses = async () => {
 };
 
 // Orders
-export const createOrder = async (orderData, telegramId) => {
+// idempotencyKey - один на попытку оформления: повтор с ним вернёт уже созданный заказ
+export const createOrder = async (orderData, telegramId, idempotencyKey = null) => {
   const response = await axios.post(
     `${API}/orders?telegram_id=${telegramId}`, 
-    orderData
+    orderData,
+    idempotencyKey ? { headers: { 'Idempotency-Key': idempotencyKey } } : undefined
   );
   return response.data;
 };
@@ -140,6 +170,15 @@ export const getAllOrders = async (telegramId, status = null) => {
   return response.data;
 };
 
+// Список заказов для админки: только поля строки, страницы по курсору
+export const getAdminOrderSummary = async (telegramId, { statuses = null, cursor = null, limit = 50 } = {}) => {
+  const params = new URLSearchParams({ telegram_id: telegramId, limit });
+  if (statuses) statuses.forEach((status) => params.append('status', status));
+  if (cursor) params.append('cursor', cursor);
+  const response = await axios.get(`${API}/orders/admin/summary`, { params });
+  return response.data;
+};
+
 export const updateOrderStatus = async (orderId, telegramId, newStatus, comment = null) => {
   const params = { telegram_id: telegramId };
   if (comment) params.comment = comment;
@@ -1,15 +1,23 @@
 import React, { useState, useEffect } from 'react';
-import { ArrowLeft, Check, X, Settings, BarChart3, Users, Activity, MessageCircle, Trash2, Send, Phone } from 'lucide-react';
-import { getPendingOrders, getAllOrders, confirmOrder, rejectOrder, updateOrderStatus, hideOrderFromAdmin, getMarkup, updateMarkup, getMarkupSettings, updateMarkupSettings, getAdminStats, getAllUsers, blockUser, unblockUser, getUserActivity, resetActivityLogs, resetStatistics, sendMessageToClient } from '../api/api';
+import { ArrowLeft, Check, X, Settings, BarChart3, Users, Activity, MessageCircle, Trash2, Send, Phone, ChevronDown, ChevronUp } from 'lucide-react';
+import { getPendingOrders, getAdminOrderSummary, getOrderDetails, confirmOrder, rejectOrder, updateOrderStatus, hideOrderFromAdmin, getMarkup, updateMarkup, getMarkupSettings, updateMarkupSettings, getAdminStats, getAllUsers, blockUser, unblockUser, getUserActivity, resetActivityLogs, resetStatistics, sendMessageToClient } from '../api/api';
 
 // Хелпер для форматирования цены без копеек
 const formatPrice = (price) => {
   return Math.round(price).toLocaleString('ru-RU');
 };
 
+// Статусы заказов на вкладке "Заказы" (отменённые не показываем)
+const ACTIVE_ORDER_STATUSES = ['pending_confirmation', 'confirmed', 'awaiting_payment', 'in_progress', 'delivery', 'delayed', 'completed'];
+
 const AdminPage = ({ user, onBack }) => {
   const [tab, setTab] = useState('pending'); // 'pending', 'settings', 'stats', 'users', 'activity'
   const [orders, setOrders] = useState([]);
+  const [ordersCursor, setOrdersCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  // Состав и полный адрес заказа загружаются при раскрытии карточки
+  const [orderDetails, setOrderDetails] = useState({});
+  const [expandedOrders, setExpandedOrders] = useState({});
   const [stats, setStats] = useState(null);
   const [markup, setMarkup] = useState(15);
   const [users, setUsers] = useState([]);
@@ -42,10 +50,12 @@ const AdminPage = ({ user, onBack }) => {
     setLoading(true);
     try {
       if (tab === 'pending') {
-        const response = await getAllOrders(user.telegram_id);
-        // Фильтруем отменённые заказы - они не должны отображаться в админке
-        const activeOrders = response.filter(order => order.status !== 'cancelled');
-        setOrders(activeOrders);
+        // Отменённые заказы не должны отображаться в админке
+        const response = await getAdminOrderSummary(user.telegram_id, { statuses: ACTIVE_ORDER_STATUSES });
+        setOrders(response.orders);
+        setOrdersCursor(response.next_cursor);
+        setOrderDetails({});
+        setExpandedOrders({});
       } else if (tab === 'settings') {
         const response = await getMarkupSettings(user.telegram_id);
         setMarkupSettings(response);
@@ -211,6 +221,35 @@ const AdminPage = ({ user, onBack }) => {
     }
   };
 
+  const loadMoreOrders = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await getAdminOrderSummary(user.telegram_id, {
+        statuses: ACTIVE_ORDER_STATUSES,
+        cursor: ordersCursor
+      });
+      setOrders((prev) => [...prev, ...response.orders]);
+      setOrdersCursor(response.next_cursor);
+    } catch (error) {
+      console.error('Ошибка загрузки заказов:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  const toggleOrderDetails = async (orderId) => {
+    const expanded = !expandedOrders[orderId];
+    setExpandedOrders((prev) => ({ ...prev, [orderId]: expanded }));
+    if (!expanded || orderDetails[orderId]) return;
+    try {
+      const details = await getOrderDetails(orderId, user.telegram_id);
+      setOrderDetails((prev) => ({ ...prev, [orderId]: details }));
+    } catch (error) {
+      console.error('Ошибка загрузки заказа:', error);
+      setExpandedOrders((prev) => ({ ...prev, [orderId]: false }));
+    }
+  };
+
   const handleOpenMessageModal = (order) => {
     setMessageModalData({
       clientId: order.user_telegram_id,
@@ -395,8 +434,21 @@ const AdminPage = ({ user, onBack }) => {
                           </div>
                         </div>
 
+                        <button
+                          onClick={() => toggleOrderDetails(order.order_id)}
+                          className="w-full mb-4 py-2 px-3 bg-gray-50 hover:bg-gray-100 rounded-lg flex items-center justify-between text-sm text-gray-700 transition-colors"
+                        >
+                          <span>Товаров: {order.items_count}</span>
+                          {expandedOrders[order.order_id] ? <ChevronUp size={16} /> : <ChevronDown size={16} />}
+                        </button>
+
+                        {expandedOrders[order.order_id] && !orderDetails[order.order_id] && (
+                          <p className="text-sm text-gray-500 text-center mb-4">Загрузка...</p>
+                        )}
+
+                        {expandedOrders[order.order_id] && orderDetails[order.order_id] && (
                         <div className="space-y-2 mb-4">
-                          {order.items.map((item, idx) => (
+                          {orderDetails[order.order_id].items.map((item, idx) => (
                             <div key={idx} className="flex justify-between text-sm py-2 border-b border-gray-100">
                               <div>
                                 <p className="font-medium">{item.brand} {item.name}</p>
@@ -411,20 +463,23 @@ const AdminPage = ({ user, onBack }) => {
                             </div>
                           ))}
                         </div>
+                        )}
 
                         {order.delivery_address && (
                           <div className="mb-4 p-3 bg-gray-50 rounded-lg">
                             <p className="text-xs text-gray-600 mb-1">Адрес доставки:</p>
                             <p className="text-sm text-gray-900">
-                              {order.delivery_address.city}, {order.delivery_address.street}, д. {order.delivery_address.house}
+                              {orderDetails[order.order_id]?.delivery_address
+                                ? `${orderDetails[order.order_id].delivery_address.city}, ${orderDetails[order.order_id].delivery_address.street}, д. ${orderDetails[order.order_id].delivery_address.house}`
+                                : order.delivery_address.city}
                             </p>
                             {order.delivery_address.phone && (
                               <p className="text-sm text-gray-900 mt-1">
                                 <span className="font-medium">📞 Телефон:</span> {order.delivery_address.phone}
                               </p>
                             )}
-                            {order.delivery_address.comment && (
-                              <p className="text-xs text-gray-600 mt-1">Комментарий: {order.delivery_address.comment}</p>
+                            {orderDetails[order.order_id]?.delivery_address?.comment && (
+                              <p className="text-xs text-gray-600 mt-1">Комментарий: {orderDetails[order.order_id].delivery_address.comment}</p>
                             )}
                           </div>
                         )}
@@ -542,6 +597,16 @@ const AdminPage = ({ user, onBack }) => {
                         )}
                       </div>
                     ))}
+
+                    {ordersCursor && (
+                      <button
+                        onClick={loadMoreOrders}
+                        disabled={loadingMore}
+                        className="w-full bg-gray-100 hover:bg-gray-200 disabled:opacity-50 text-gray-700 py-3 rounded-lg font-medium transition-colors"
+                      >
+                        {loadingMore ? 'Загрузка...' : 'Показать ещё'}
+                      </button>
+                    )}
                   </div>
                 )}
               </div>
@@ -96,7 +96,10 @@ const CarSelectionPage = ({ onAddToCart, onRemoveFromCart, onBack, user, cart })
     setSelected(finalSelection);
     setLoading(true);
     try {
-      const response = await getGoodsByCar(finalSelection);
+      const params = { ...finalSelection };
+      // telegram_id для логирования выбора авто (прогрев кэша популярных автомобилей)
+      if (user?.telegram_id) params.telegram_id = user.telegram_id;
+      const response = await getGoodsByCar(params);
       setResults(response.data || []);
       setStep(5);
     } catch (error) {
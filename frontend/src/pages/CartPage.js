@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useState, useRef } from 'react';
 import { ArrowLeft, Trash2, Minus, Plus, ShoppingBag } from 'lucide-react';
 import { createOrder } from '../api/api';
 
@@ -7,6 +7,12 @@ const formatPrice = (price) => {
   return Math.round(price).toLocaleString('ru-RU');
 };
 
+// Ключ идемпотентности заказа
+const newIdempotencyKey = () => {
+  if (window.crypto?.randomUUID) return window.crypto.randomUUID();
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+};
+
 const CartPage = ({ cart, user, onUpdateQuantity, onRemove, onClear, onBack }) => {
   const [deliveryAddress, setDeliveryAddress] = useState({
     city: '',
@@ -17,10 +23,14 @@ const CartPage = ({ cart, user, onUpdateQuantity, onRemove, onClear, onBack }) =
   });
   const [submitting, setSubmitting] = useState(false);
   const [orderCreated, setOrderCreated] = useState(false);
+  // Текущая попытка оформления: повторная отправка того же заказа идёт с тем же ключом
+  const pendingOrder = useRef(null);
 
   const total = cart.reduce((sum, item) => sum + (item.price * item.quantity), 0);
 
   const handleSubmitOrder = async () => {
+    if (submitting) return;
+
     if (!deliveryAddress.city || !deliveryAddress.street || !deliveryAddress.house || !deliveryAddress.phone) {
       alert('Пожалуйста, заполните все обязательные поля (город, улица, дом, телефон)');
       return;
@@ -59,7 +69,13 @@ const CartPage = ({ cart, user, onUpdateQuantity, onRemove, onClear, onBack }) =
         delivery_address: deliveryAddress
       };
 
-      await createOrder(orderData, user.telegram_id);
+      const payload = JSON.stringify(orderData);
+      if (!pendingOrder.current || pendingOrder.current.payload !== payload) {
+        pendingOrder.current = { payload, key: newIdempotencyKey() };
+      }
+
+      await createOrder(orderData, user.telegram_id, pendingOrder.current.key);
+      pendingOrder.current = null;
       setOrderCreated(true);
       onClear();
     } catch (error) {
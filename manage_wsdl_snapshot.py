@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Управление локальным снимком WSDL 4tochki (backend/wsdl/4tochki)
+
+    python manage_wsdl_snapshot.py update      # скачать WSDL и все XSD, сохранить снимок
+    python manage_wsdl_snapshot.py check       # сравнить снимок с живым WSDL (код 1 - есть расхождения)
+    python manage_wsdl_snapshot.py benchmark   # время создания клиента: сеть / снимок / снимок + кэш схемы
+
+Адрес WSDL берется из FOURTHCHKI_API_URL (backend/.env) или --url
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from dotenv import load_dotenv  # noqa: E402
+
+load_dotenv(Path(__file__).parent / "backend" / ".env")
+
+from zeep import Client, Settings  # noqa: E402
+from zeep.transports import Transport  # noqa: E402
+
+from services.wsdl_snapshot import (  # noqa: E402
+    DEFAULT_SNAPSHOT_DIR,
+    ROOT_FILENAME,
+    diff_snapshot,
+    fetch_documents,
+    load_snapshot_document,
+    localize_documents,
+    read_manifest,
+    write_snapshot,
+)
+
+class Colors:
+    GREEN = '\033[92m'
+    RED = '\033[91m'
+    YELLOW = '\033[93m'
+    BLUE = '\033[94m'
+    RESET = '\033[0m'
+
+def print_test(message):
+    print(f"\n{Colors.BLUE}{'='*80}{Colors.RESET}")
+    print(f"{Colors.BLUE}{message}{Colors.RESET}")
+    print(f"{Colors.BLUE}{'='*80}{Colors.RESET}")
+
+def print_success(message):
+    print(f"{Colors.GREEN}✅ {message}{Colors.RESET}")
+
+def print_error(message):
+    print(f"{Colors.RED}❌ {message}{Colors.RESET}")
+
+def print_info(message):
+    print(f"ℹ️  {message}")
+
+def cmd_update(args):
+    print_test(f"Обновление снимка WSDL: {args.url}")
+    documents = fetch_documents(args.url)
+    files = localize_documents(args.url, documents)
+    manifest = write_snapshot(args.url, files, args.snapshot_dir)
+    for name in manifest["files"]:
+        print_info(name)
+    print_success(f"Сохранено документов: {len(files)} в {args.snapshot_dir}")
+    return True
+
+def cmd_check(args):
+    print_test(f"Проверка расхождений снимка с {args.url}")
+    if not (args.snapshot_dir / ROOT_FILENAME).exists():
+        print_error(f"Снимок не найден в {args.snapshot_dir} - выполните update")
+        return False
+
+    manifest = read_manifest(args.snapshot_dir)
+    print_info(f"Снимок от {manifest['fetched_at']}")
+    files = localize_documents(args.url, fetch_documents(args.url))
+    drift = diff_snapshot(args.snapshot_dir, files)
+    if not drift:
+        print_success("Снимок совпадает с живым WSDL")
+        return True
+
+    for name, change in drift:
+        print_error(f"{name}: {change}")
+    print_info("Обновите снимок: python manage_wsdl_snapshot.py update")
+    return False
+
+def measure(label, factory, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        factory()
+        timings.append(time.perf_counter() - started)
+    median = statistics.median(timings) * 1000
+    print_info(f"{label}: медиана {median:.0f} мс (min {min(timings) * 1000:.0f}, max {max(timings) * 1000:.0f})")
+    return median
+
+def cmd_benchmark(args):
+    print_test(f"Время создания SOAP клиента ({args.runs} запусков)")
+
+    def client_from(wsdl_factory):
+        def build():
+            transport = Transport()  # без HTTP кэша - как в новом контейнере
+            settings = Settings()
+            Client(wsdl_factory(transport, settings), transport=transport, settings=settings)
+        return build
+
+    results = {}
+    if args.url and not args.offline:
+        results["live"] = measure("Живой WSDL по сети", client_from(lambda t, s: args.url), args.runs)
+
+    if (args.snapshot_dir / ROOT_FILENAME).exists():
+        results["snapshot"] = measure(
+            "Снимок, разбор схем",
+            client_from(lambda t, s: load_snapshot_document(args.snapshot_dir, t, s)),
+            args.runs,
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_path = Path(tmp) / "schema.pickle"
+            load_snapshot_document(args.snapshot_dir, Transport(), Settings(), cache_path)
+            results["cached"] = measure(
+                "Снимок + кэш схемы",
+                client_from(lambda t, s: load_snapshot_document(args.snapshot_dir, t, s, cache_path)),
+                args.runs,
+            )
+    else:
+        print_error(f"Снимок не найден в {args.snapshot_dir} - выполните update")
+
+    baseline = results.get("live") or results.get("snapshot")
+    if baseline and results.get("cached"):
+        print_success(f"Кэш схемы быстрее в {baseline / results['cached']:.1f} раз")
+    return bool(results)
+
+def main():
+    parser = argparse.ArgumentParser(description="Снимок WSDL 4tochki")
+    parser.add_argument("command", choices=["update", "check", "benchmark"])
+    parser.add_argument("--url", default=os.environ.get("FOURTHCHKI_API_URL"), help="Адрес WSDL")
+    parser.add_argument("--snapshot-dir", type=Path, default=DEFAULT_SNAPSHOT_DIR)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--offline", action="store_true", help="benchmark без обращения к живому WSDL")
+    args = parser.parse_args()
+
+    if args.command in ("update", "check") and not args.url:
+        print_error("Не задан адрес WSDL (FOURTHCHKI_API_URL или --url)")
+        return False
+
+    commands = {"update": cmd_update, "check": cmd_check, "benchmark": cmd_benchmark}
+    return commands[args.command](args)
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Тест очереди уведомлений (notification_outbox) на локальном fake Bot API сервере
+
+Проверяет:
+1. enqueue_message возвращается сразу, не дожидаясь Telegram
+2. Диспетчер доставляет все сообщения
+3. 429 Too Many Requests (retry_after) и 5xx - сообщение отправляется повторно
+4. 403 Forbidden (бот заблокирован) - сообщение помечается failed без повторов
+5. В один чат не чаще одного сообщения в TELEGRAM_PER_CHAT_INTERVAL
+"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# Configuration
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.environ.get("OUTBOX_TEST_DB_NAME", "tires_shop_outbox_test")
+FAKE_API_PORT = int(os.environ.get("FAKE_BOT_API_PORT", "8081"))
+FAKE_TOKEN = "123456:TEST"
+SEND_DELAY = 0.5  # Имитация медленного api.telegram.org
+
+CHAT_OK = "1001"
+CHAT_RATE_LIMITED = "1002"  # Первый запрос получает 429 retry_after=1
+CHAT_FLAKY = "1003"  # Первый запрос получает 502
+CHAT_BLOCKED = "1004"  # Всегда 403
+
+os.environ["MONGO_URL"] = MONGO_URL
+os.environ["DB_NAME"] = DB_NAME
+os.environ["TELEGRAM_BOT_TOKEN"] = FAKE_TOKEN
+os.environ["ADMIN_TELEGRAM_ID"] = CHAT_OK
+os.environ["TELEGRAM_API_BASE_URL"] = f"http://127.0.0.1:{FAKE_API_PORT}"
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from services.telegram_bot import TelegramNotifier, OUTBOX_COLLECTION  # noqa: E402
+
+class Colors:
+    GREEN = '\033[92m'
+    RED = '\033[91m'
+    YELLOW = '\033[93m'
+    BLUE = '\033[94m'
+    RESET = '\033[0m'
+
+def print_test(message):
+    print(f"\n{Colors.BLUE}{'='*80}{Colors.RESET}")
+    print(f"{Colors.BLUE}{message}{Colors.RESET}")
+    print(f"{Colors.BLUE}{'='*80}{Colors.RESET}")
+
+def print_success(message):
+    print(f"{Colors.GREEN}✅ {message}{Colors.RESET}")
+
+def print_error(message):
+    print(f"{Colors.RED}❌ {message}{Colors.RESET}")
+
+def print_info(message):
+    print(f"ℹ️  {message}")
+
+class FakeBotAPI(BaseHTTPRequestHandler):
+    """Минимальная имитация Telegram Bot API (только sendMessage)"""
+
+    calls = []  # (chat_id, время получения запроса, http status)
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length).decode()
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(raw or "{}")
+        else:
+            params = {k: v[0] for k, v in parse_qs(raw).items()}
+
+        if not self.path.endswith("/sendMessage"):
+            self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            return
+
+        chat_id = str(params.get("chat_id"))
+        received_at = time.monotonic()
+        time.sleep(SEND_DELAY)
+
+        with self.lock:
+            previous = sum(1 for call in self.calls if call[0] == chat_id)
+            if chat_id == CHAT_BLOCKED:
+                status = 403
+            elif chat_id == CHAT_RATE_LIMITED and previous == 0:
+                status = 429
+            elif chat_id == CHAT_FLAKY and previous == 0:
+                status = 502
+            else:
+                status = 200
+            self.calls.append((chat_id, received_at, status))
+
+        if status == 403:
+            self._reply(403, {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"})
+        elif status == 429:
+            self._reply(429, {
+                "ok": False,
+                "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1}
+            })
+        elif status == 502:
+            self._reply(502, {"ok": False, "error_code": 502, "description": "Bad Gateway"})
+        else:
+            self._reply(200, {"ok": True, "result": {
+                "message_id": len(self.calls),
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id), "type": "private"},
+                "text": params.get("text", "")
+            }})
+
+def start_fake_api():
+    server = ThreadingHTTPServer(("127.0.0.1", FAKE_API_PORT), FakeBotAPI)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+async def wait_for_outbox(notifier, timeout=30):
+    """Ждем пока в outbox не останется неотправленных сообщений"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = await notifier.get_outbox_stats()
+        if not stats.get("pending") and not stats.get("sending"):
+            return stats
+        await asyncio.sleep(0.2)
+    return await notifier.get_outbox_stats()
+
+async def run_tests():
+    results = []
+    notifier = TelegramNotifier()
+    await notifier.db[OUTBOX_COLLECTION].delete_many({})
+    await notifier.start_outbox_dispatcher()
+
+    try:
+        print_test("ТЕСТ 1: enqueue_message не ждет Telegram")
+        started = time.perf_counter()
+        for chat_id in (CHAT_OK, CHAT_OK, CHAT_OK, CHAT_RATE_LIMITED, CHAT_FLAKY, CHAT_BLOCKED):
+            await notifier.enqueue_message(chat_id, f"Тестовое уведомление для {chat_id}")
+        elapsed = time.perf_counter() - started
+        print_info(f"6 сообщений поставлено в очередь за {elapsed * 1000:.0f} мс (fake API отвечает {SEND_DELAY} c)")
+        results.append(("Тест 1: Мгновенная постановка в очередь", elapsed < SEND_DELAY))
+
+        print_test("ТЕСТ 2: Доставка, повторы и ошибки")
+        stats = await wait_for_outbox(notifier)
+        print_info(f"Статусы outbox: {stats}")
+
+        delivered = {call[0] for call in FakeBotAPI.calls if call[2] == 200}
+        retried_ok = CHAT_RATE_LIMITED in delivered and CHAT_FLAKY in delivered
+        if retried_ok:
+            print_success("Сообщения после 429 и 502 доставлены повторной попыткой")
+        else:
+            print_error(f"Повторная доставка не сработала, доставлено: {delivered}")
+        results.append(("Тест 2: Повтор после 429/502", retried_ok))
+
+        blocked_calls = [call for call in FakeBotAPI.calls if call[0] == CHAT_BLOCKED]
+        blocked = await notifier.db[OUTBOX_COLLECTION].find_one({"chat_id": CHAT_BLOCKED})
+        blocked_ok = len(blocked_calls) == 1 and blocked and blocked["status"] == "failed"
+        if blocked_ok:
+            print_success("403 Forbidden: сообщение помечено failed без повторов")
+        else:
+            print_error(f"403 обработан неверно: вызовов {len(blocked_calls)}, документ {blocked}")
+        results.append(("Тест 3: 403 без повторов", blocked_ok))
+
+        sent_ok = stats.get("sent") == 5
+        results.append(("Тест 4: Все доступные сообщения доставлены", sent_ok))
+
+        print_test("ТЕСТ 5: Лимит на один чат")
+        times = sorted(call[1] for call in FakeBotAPI.calls if call[0] == CHAT_OK)
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        print_info(f"Интервалы между сообщениями в чат {CHAT_OK}: {[round(g, 2) for g in gaps]}")
+        per_chat_ok = all(gap >= 0.9 for gap in gaps)
+        results.append(("Тест 5: Не чаще 1 сообщения в секунду в чат", per_chat_ok))
+    finally:
+        await notifier.stop_outbox_dispatcher()
+        await notifier.mongo_client.drop_database(DB_NAME)
+
+    return results
+
+def main():
+    print(f"\n{Colors.BLUE}ТЕСТИРОВАНИЕ NOTIFICATION OUTBOX{Colors.RESET}")
+    print(f"Fake Bot API: {os.environ['TELEGRAM_API_BASE_URL']}")
+    print(f"MongoDB: {MONGO_URL} / {DB_NAME}")
+
+    server = start_fake_api()
+    try:
+        results = asyncio.run(run_tests())
+    finally:
+        server.shutdown()
+
+    print(f"\n{Colors.BLUE}ИТОГОВЫЙ ОТЧЕТ{Colors.RESET}")
+    for test_name, result in results:
+        status = f"{Colors.GREEN}✅ ПРОЙДЕН{Colors.RESET}" if result else f"{Colors.RED}❌ ПРОВАЛЕН{Colors.RESET}"
+        print(f"{test_name}: {status}")
+
+    return all(result for _, result in results)
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Стресс-тест генератора номеров заказов
+
+Проверяет что при массовом одновременном создании заказов:
+1. Все order_id уникальны (в том числе при генерации из нескольких потоков)
+2. Номера сортируются по времени создания
+3. Уникальный индекс на orders.order_id не дает вставить дубликат
+4. 10 000 заказов, вставленных конкурентно, сохраняются без коллизий
+"""
+
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from models.order import Order, OrderItem, OrderStatus  # noqa: E402
+from utils.order_ids import generate_order_id  # noqa: E402
+
+# Configuration
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.environ.get("STRESS_DB_NAME", "tires_shop_stress_test")
+ORDERS_COUNT = 10_000
+CONCURRENCY = 200
+
+class Colors:
+    GREEN = '\033[92m'
+    RED = '\033[91m'
+    YELLOW = '\033[93m'
+    BLUE = '\033[94m'
+    RESET = '\033[0m'
+
+def print_test(message):
+    print(f"\n{Colors.BLUE}{'='*80}{Colors.RESET}")
+    print(f"{Colors.BLUE}{message}{Colors.RESET}")
+    print(f"{Colors.BLUE}{'='*80}{Colors.RESET}")
+
+def print_success(message):
+    print(f"{Colors.GREEN}✅ {message}{Colors.RESET}")
+
+def print_error(message):
+    print(f"{Colors.RED}❌ {message}{Colors.RESET}")
+
+def print_info(message):
+    print(f"ℹ️  {message}")
+
+def make_order(index: int) -> dict:
+    """Сформировать документ заказа так же, как это делает POST /api/orders"""
+    order = Order(
+        user_telegram_id=f"stress_{index % 500}",
+        user_name="Stress Test",
+        items=[
+            OrderItem(
+                code="2329500",
+                name="185/60R15 Stress Test",
+                brand="Test",
+                quantity=4,
+                price_base=5000,
+                price_final=5750,
+                warehouse_id=42,
+                warehouse_name="Склад 42"
+            )
+        ],
+        total_amount=23000,
+        markup_percentage=15.0,
+        status=OrderStatus.PENDING_CONFIRMATION
+    )
+    order_dict = order.model_dump()
+    order_dict['created_at'] = order_dict['created_at'].isoformat()
+    order_dict['status'] = order_dict['status'].value
+    return order_dict
+
+def test_1_unique_ids_across_threads():
+    """Тест 1: уникальность и сортируемость номеров при генерации из нескольких потоков"""
+    print_test(f"ТЕСТ 1: Генерация {ORDERS_COUNT} номеров из 16 потоков")
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        chunks = list(pool.map(lambda _: [generate_order_id() for _ in range(ORDERS_COUNT // 16)], range(16)))
+
+    all_ids = [order_id for chunk in chunks for order_id in chunk]
+    if len(set(all_ids)) != len(all_ids):
+        print_error(f"Найдены дубликаты: {len(all_ids) - len(set(all_ids))}")
+        return False
+    print_success(f"Все {len(all_ids)} номеров уникальны")
+
+    # Внутри одного потока номера должны строго возрастать
+    for chunk in chunks:
+        if chunk != sorted(chunk) or len(set(chunk)) != len(chunk):
+            print_error("Номера внутри потока не возрастают монотонно")
+            return False
+    print_success("Номера внутри потока строго возрастают")
+
+    sample = generate_order_id()
+    print_info(f"Пример номера: {sample}")
+    today = datetime.now(timezone.utc).strftime("%Y%m%d")
+    if not sample.startswith(f"ORD-{today}"):
+        print_error("Номер не содержит текущую дату")
+        return False
+
+    print_success("ТЕСТ 1 ПРОЙДЕН")
+    return True
+
+async def test_2_unique_index(db):
+    """Тест 2: уникальный индекс отклоняет повторный order_id"""
+    print_test("ТЕСТ 2: Уникальный индекс на orders.order_id")
+
+    order_dict = make_order(0)
+    await db.orders.insert_one(dict(order_dict))
+    try:
+        await db.orders.insert_one(dict(order_dict))
+    except DuplicateKeyError:
+        print_success("Дубликат order_id отклонен индексом")
+        print_success("ТЕСТ 2 ПРОЙДЕН")
+        return True
+
+    print_error("Дубликат order_id был вставлен - индекс не работает")
+    return False
+
+async def test_3_concurrent_inserts(db):
+    """Тест 3: конкурентная вставка 10 000 заказов"""
+    print_test(f"ТЕСТ 3: Конкурентное создание {ORDERS_COUNT} заказов (параллельно {CONCURRENCY})")
+
+    await db.orders.delete_many({})
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    collisions = 0
+
+    async def create(index: int):
+        nonlocal collisions
+        async with semaphore:
+            order_dict = make_order(index)
+            try:
+                await db.orders.insert_one(order_dict)
+            except DuplicateKeyError:
+                collisions += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(create(i) for i in range(ORDERS_COUNT)))
+    elapsed = time.perf_counter() - started
+
+    stored = await db.orders.count_documents({})
+    print_info(f"Время: {elapsed:.2f} c ({ORDERS_COUNT / elapsed:.0f} заказов/с)")
+    print_info(f"Сохранено: {stored}, коллизий: {collisions}")
+
+    if collisions or stored != ORDERS_COUNT:
+        print_error("Часть заказов потеряна из-за коллизий order_id")
+        return False
+
+    print_success("ТЕСТ 3 ПРОЙДЕН")
+    return True
+
+async def run_db_tests():
+    client = AsyncIOMotorClient(MONGO_URL)
+    db = client[DB_NAME]
+    try:
+        await db.orders.drop()
+        await db.orders.create_index("order_id", unique=True)
+        return [
+            ("Тест 2: Уникальный индекс", await test_2_unique_index(db)),
+            ("Тест 3: Конкурентная вставка", await test_3_concurrent_inserts(db)),
+        ]
+    finally:
+        await client.drop_database(DB_NAME)
+        client.close()
+
+def main():
+    """Запуск всех тестов"""
+    print(f"\n{Colors.BLUE}СТРЕСС-ТЕСТ НОМЕРОВ ЗАКАЗОВ{Colors.RESET}")
+    print(f"MongoDB: {MONGO_URL} / {DB_NAME}")
+
+    results = [("Тест 1: Уникальность номеров", test_1_unique_ids_across_threads())]
+    results.extend(asyncio.run(run_db_tests()))
+
+    print(f"\n{Colors.BLUE}ИТОГОВЫЙ ОТЧЕТ{Colors.RESET}")
+    for test_name, result in results:
+        status = f"{Colors.GREEN}✅ ПРОЙДЕН{Colors.RESET}" if result else f"{Colors.RED}❌ ПРОВАЛЕН{Colors.RESET}"
+        print(f"{test_name}: {status}")
+
+    return all(result for _, result in results)
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Тест идемпотентного создания заказов (заголовок Idempotency-Key)
+
+Проверяет что:
+1. Одновременные повторы с одним ключом создают один заказ и одно уведомление
+2. Повтор после ответа возвращает исходный заказ (Idempotent-Replayed: true)
+3. Ключ нельзя использовать для заказа с другим составом (422)
+4. Разные ключи создают разные заказы
+5. Неудачный запрос освобождает ключ - повтор выполняется заново
+6. Ключи удаляются TTL индексом
+"""
+
+import asyncio
+import os
+import sys
+
+from fastapi import HTTPException, Response
+from motor.motor_asyncio import AsyncIOMotorClient
+
+# Configuration
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.environ.get("IDEMPOTENCY_TEST_DB_NAME", "tires_shop_idempotency_test")
+CONCURRENT_REQUESTS = 20
+
+os.environ["MONGO_URL"] = MONGO_URL
+os.environ["DB_NAME"] = DB_NAME
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from models.order import DeliveryAddress, OrderCreate, OrderItem  # noqa: E402
+from routers.orders import create_order  # noqa: E402
+from services import idempotency  # noqa: E402
+
+TELEGRAM_ID = "777000"
+
+class Colors:
+    GREEN = '\033[92m'
+    RED = '\033[91m'
+    YELLOW = '\033[93m'
+    BLUE = '\033[94m'
+    RESET = '\033[0m'
+
+def print_test(message):
+    print(f"\n{Colors.BLUE}{'='*80}{Colors.RESET}")
+    print(f"{Colors.BLUE}{message}{Colors.RESET}")
+    print(f"{Colors.BLUE}{'='*80}{Colors.RESET}")
+
+def print_success(message):
+    print(f"{Colors.GREEN}✅ {message}{Colors.RESET}")
+
+def print_error(message):
+    print(f"{Colors.RED}❌ {message}{Colors.RESET}")
+
+def print_info(message):
+    print(f"ℹ️  {message}")
+
+class FakeNotifier:
+    """Считает уведомления админу вместо отправки в Telegram"""
+
+    def __init__(self):
+        self.notified = []
+
+    async def notify_admin_new_order(self, order_id, user_name, total_amount, items_count):
+        # Медленная постановка в очередь - повторы приходят, пока первый запрос не закончил
+        await asyncio.sleep(0.2)
+        self.notified.append(order_id)
+        return True
+
+def make_order_data(quantity: int = 4) -> OrderCreate:
+    return OrderCreate(
+        items=[
+            OrderItem(
+                code="2329500",
+                name="185/60R15 Idempotency Test",
+                brand="Test",
+                quantity=quantity,
+                price_base=5000,
+                price_final=5750,
+                warehouse_id=42,
+                warehouse_name="Склад 42"
+            )
+        ],
+        delivery_address=DeliveryAddress(city="Тюмень", street="Ленина", house="1", phone="+79990000000")
+    )
+
+async def submit(db, notifier, key, order_data=None, telegram_id=TELEGRAM_ID):
+    """Вызов POST /api/orders так, как его выполняет FastAPI"""
+    response = Response()
+    order = await create_order(
+        order_data=order_data or make_order_data(),
+        response=response,
+        telegram_id=telegram_id,
+        idempotency_key=key,
+        db=db,
+        notifier=notifier,
+        session=None
+    )
+    return order, response
+
+async def test_1_concurrent_duplicates(db):
+    """Тест 1: двойное нажатие - конкурентные запросы с одним ключом"""
+    print_test(f"ТЕСТ 1: {CONCURRENT_REQUESTS} одновременных запросов с одним Idempotency-Key")
+
+    notifier = FakeNotifier()
+    results = await asyncio.gather(
+        *(submit(db, notifier, "double-tap") for _ in range(CONCURRENT_REQUESTS)),
+        return_exceptions=True
+    )
+    errors = [result for result in results if isinstance(result, Exception)]
+    order_ids = {order.order_id for order, _ in (result for result in results if not isinstance(result, Exception))}
+    stored = await db.orders.count_documents({"user_telegram_id": TELEGRAM_ID})
+    replayed = sum(1 for result in results if not isinstance(result, Exception) and result[1].headers.get("Idempotent-Replayed"))
+
+    print_info(f"Ошибок: {len(errors)}, разных order_id в ответах: {len(order_ids)}, заказов в базе: {stored}")
+    print_info(f"Уведомлений админу: {len(notifier.notified)}, повторов: {replayed}")
+
+    if errors or len(order_ids) != 1 or stored != 1 or len(notifier.notified) != 1:
+        print_error(f"Создано несколько заказов или запросы завершились ошибкой: {errors[:3]}")
+        return False
+    if replayed != CONCURRENT_REQUESTS - 1:
+        print_error("Повторы не помечены заголовком Idempotent-Replayed")
+        return False
+
+    print_success("ТЕСТ 1 ПРОЙДЕН")
+    return True
+
+async def test_2_retry_after_response(db):
+    """Тест 2: повтор после получения ответа"""
+    print_test("ТЕСТ 2: Повтор запроса после ответа")
+
+    notifier = FakeNotifier()
+    first, _ = await submit(db, notifier, "retry")
+    second, response = await submit(db, notifier, "retry")
+
+    if first.order_id != second.order_id or len(notifier.notified) != 1:
+        print_error(f"Повтор создал новый заказ: {first.order_id} / {second.order_id}")
+        return False
+    if response.headers.get("Idempotent-Replayed") != "true":
+        print_error("Нет заголовка Idempotent-Replayed")
+        return False
+
+    print_success(f"Повтор вернул заказ {first.order_id}")
+    print_success("ТЕСТ 2 ПРОЙДЕН")
+    return True
+
+async def test_3_key_reuse(db):
+    """Тест 3: тот же ключ для другого заказа"""
+    print_test("ТЕСТ 3: Ключ с другим составом заказа")
+
+    notifier = FakeNotifier()
+    await submit(db, notifier, "reuse")
+    try:
+        await submit(db, notifier, "reuse", make_order_data(quantity=2))
+    except HTTPException as e:
+        if e.status_code == 422:
+            print_success("Повторное использование ключа отклонено (422)")
+            print_success("ТЕСТ 3 ПРОЙДЕН")
+            return True
+        print_error(f"Неверный код ответа: {e.status_code}")
+        return False
+
+    print_error("Ключ принят для другого заказа")
+    return False
+
+async def test_4_different_keys(db):
+    """Тест 4: разные ключи - разные заказы"""
+    print_test("ТЕСТ 4: Разные ключи")
+
+    notifier = FakeNotifier()
+    orders = await asyncio.gather(*(submit(db, notifier, f"key-{i}") for i in range(3)))
+    order_ids = {order.order_id for order, _ in orders}
+
+    if len(order_ids) != 3 or len(notifier.notified) != 3:
+        print_error(f"Ожидалось 3 заказа, получено {len(order_ids)}")
+        return False
+
+    print_success("ТЕСТ 4 ПРОЙДЕН")
+    return True
+
+async def test_5_failed_request_releases_key(db):
+    """Тест 5: ошибка освобождает ключ"""
+    print_test("ТЕСТ 5: Повтор после неудачного запроса")
+
+    notifier = FakeNotifier()
+    try:
+        await submit(db, notifier, "after-error", telegram_id="unknown_user")
+        print_error("Заказ создан для несуществующего пользователя")
+        return False
+    except HTTPException as e:
+        print_info(f"Первый запрос: {e.status_code} {e.detail}")
+
+    await db.users.insert_one({"telegram_id": "unknown_user", "username": "late"})
+    try:
+        order, response = await submit(db, notifier, "after-error", telegram_id="unknown_user")
+    except HTTPException as e:
+        print_error(f"Ключ не освобожден после ошибки: {e.status_code} {e.detail}")
+        return False
+
+    if response.headers.get("Idempotent-Replayed") or len(notifier.notified) != 1:
+        print_error("Повтор не выполнил запрос заново")
+        return False
+
+    print_success(f"Повтор создал заказ {order.order_id}")
+    print_success("ТЕСТ 5 ПРОЙДЕН")
+    return True
+
+async def test_6_ttl_index(db):
+    """Тест 6: TTL индекс на ключах"""
+    print_test("ТЕСТ 6: TTL индекс idempotency_keys")
+
+    indexes = await db[idempotency.IDEMPOTENCY_COLLECTION].index_information()
+    ttl = [index for index in indexes.values() if "expireAfterSeconds" in index]
+    if not ttl:
+        print_error(f"TTL индекс не найден: {indexes}")
+        return False
+
+    print_info(f"expireAfterSeconds: {ttl[0]['expireAfterSeconds']}")
+    print_success("ТЕСТ 6 ПРОЙДЕН")
+    return True
+
+async def run_tests():
+    client = AsyncIOMotorClient(MONGO_URL, tz_aware=True)
+    db = client[DB_NAME]
+    try:
+        await client.drop_database(DB_NAME)
+        await db.orders.create_index("order_id", unique=True)
+        await idempotency.ensure_indexes(db)
+        await db.users.insert_one({"telegram_id": TELEGRAM_ID, "username": "idempotency_test"})
+        return [
+            ("Тест 1: Одновременные повторы", await test_1_concurrent_duplicates(db)),
+            ("Тест 2: Повтор после ответа", await test_2_retry_after_response(db)),
+            ("Тест 3: Ключ для другого заказа", await test_3_key_reuse(db)),
+            ("Тест 4: Разные ключи", await test_4_different_keys(db)),
+            ("Тест 5: Ошибка освобождает ключ", await test_5_failed_request_releases_key(db)),
+            ("Тест 6: TTL индекс", await test_6_ttl_index(db)),
+        ]
+    finally:
+        await client.drop_database(DB_NAME)
+        client.close()
+
+def main():
+    """Запуск всех тестов"""
+    print(f"\n{Colors.BLUE}ТЕСТ ИДЕМПОТЕНТНОСТИ ЗАКАЗОВ{Colors.RESET}")
+    print(f"MongoDB: {MONGO_URL} / {DB_NAME}")
+
+    results = asyncio.run(run_tests())
+
+    print(f"\n{Colors.BLUE}ИТОГОВЫЙ ОТЧЕТ{Colors.RESET}")
+    for test_name, result in results:
+        status = f"{Colors.GREEN}✅ ПРОЙДЕН{Colors.RESET}" if result else f"{Colors.RED}❌ ПРОВАЛЕН{Colors.RESET}"
+        print(f"{test_name}: {status}")
+
+    return all(result for _, result in results)
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
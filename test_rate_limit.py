@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Тест ограничения частоты запросов к поставщику (services/rate_limiter.py)
+
+Проверяет что:
+1. Пакетный поиск шин списывает бюджет поставщика за каждый размер и исчерпывает его
+2. Отказ по бюджету поставщика не расходует общий бюджет клиента (memory)
+3. То же для бакетов в MongoDB (RATE_LIMIT_BACKEND=mongo) - списанные бакеты возвращаются
+"""
+
+import asyncio
+import os
+import sys
+
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from motor.motor_asyncio import AsyncIOMotorClient
+
+# Configuration
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.environ.get("RATE_LIMIT_TEST_DB_NAME", "tires_shop_rate_limit_test")
+SUPPLIER_IP_BURST = 60
+
+os.environ["MONGO_URL"] = MONGO_URL
+os.environ["DB_NAME"] = DB_NAME
+os.environ["USE_MOCK_DATA"] = "true"
+os.environ["RATE_LIMIT_ENABLED"] = "true"
+os.environ["RATE_LIMIT_BACKEND"] = "memory"
+# Бакеты почти не пополняются за время теста
+os.environ["RATE_LIMIT_SUPPLIER_IP_RATE"] = "0.001"
+os.environ["RATE_LIMIT_SUPPLIER_IP_BURST"] = str(SUPPLIER_IP_BURST)
+os.environ["RATE_LIMIT_SUPPLIER_GLOBAL_RATE"] = "0.001"
+os.environ["RATE_LIMIT_SUPPLIER_GLOBAL_BURST"] = "1000"
+os.environ["RATE_LIMIT_IP_RATE"] = "0.001"
+os.environ["RATE_LIMIT_IP_BURST"] = "100"
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from dependencies import AppResources  # noqa: E402
+from routers import products  # noqa: E402
+from server import RateLimitMiddleware  # noqa: E402
+from services import rate_limiter  # noqa: E402
+
+class Colors:
+    GREEN = '\033[92m'
+    RED = '\033[91m'
+    YELLOW = '\033[93m'
+    BLUE = '\033[94m'
+    RESET = '\033[0m'
+
+def print_test(message):
+    print(f"\n{Colors.BLUE}{'='*80}{Colors.RESET}")
+    print(f"{Colors.BLUE}{message}{Colors.RESET}")
+    print(f"{Colors.BLUE}{'='*80}{Colors.RESET}")
+
+def print_success(message):
+    print(f"{Colors.GREEN}✅ {message}{Colors.RESET}")
+
+def print_error(message):
+    print(f"{Colors.RED}❌ {message}{Colors.RESET}")
+
+def print_info(message):
+    print(f"ℹ️  {message}")
+
+def make_app(mongo_client, db) -> FastAPI:
+    """Приложение только с products и RateLimitMiddleware, как в server.py"""
+    app = FastAPI()
+    app.include_router(products.router, prefix="/api")
+    app.add_middleware(RateLimitMiddleware)
+    app.state.resources = AppResources(mongo_client=mongo_client, db=db, notifier=None)
+    return app
+
+def batch_body(count: int) -> dict:
+    return {"sizes": [{"width": 185 + 10 * i, "height": 60, "diameter": 15} for i in range(count)]}
+
+async def test_1_batch_exhausts_supplier_budget(app):
+    """Тест 1: пакет из TIRE_BATCH_MAX_SIZES размеров стоит как столько же поисков"""
+    per_batch = products.TIRE_BATCH_MAX_SIZES * rate_limiter.search_cost()
+    allowed = int(SUPPLIER_IP_BURST // per_batch)
+    print_test(f"ТЕСТ 1: пакеты по {products.TIRE_BATCH_MAX_SIZES} размеров ({per_batch} токенов) при бюджете {SUPPLIER_IP_BURST}")
+
+    statuses = []
+    async with AsyncClient(transport=ASGITransport(app=app, client=("10.0.0.1", 1234)), base_url="http://test") as client:
+        for _ in range(allowed + 1):
+            response = await client.post(
+                "/api/products/tires/search/batch",
+                json=batch_body(products.TIRE_BATCH_MAX_SIZES)
+            )
+            statuses.append(response.status_code)
+        retry_after = response.headers.get("Retry-After")
+
+    print_info(f"Статусы: {statuses}, Retry-After: {retry_after}")
+    if statuses != [200] * allowed + [429] or not retry_after:
+        print_error(f"Ожидалось {allowed} успешных пакетов и 429 с Retry-After")
+        return False
+
+    print_success("ТЕСТ 1 ПРОЙДЕН")
+    return True
+
+async def check_refund(limiter, db, read_tokens):
+    """Отказ по бюджету поставщика: бакеты ip и user не должны уменьшиться"""
+    ip, user_key = "10.0.0.2", "42@10.0.0.2"
+    # Исчерпываем бюджет поставщика IP
+    await limiter.check(db, ip, user_key, supplier_cost=SUPPLIER_IP_BURST)
+    ip_before = await read_tokens(rate_limiter.IP_BUDGET, ip)
+    user_before = await read_tokens(rate_limiter.USER_BUDGET, user_key)
+
+    waits = [await limiter.check(db, ip, user_key, supplier_cost=2) for _ in range(5)]
+    ip_after = await read_tokens(rate_limiter.IP_BUDGET, ip)
+    user_after = await read_tokens(rate_limiter.USER_BUDGET, user_key)
+
+    print_info(f"Ожидание: {[round(wait) for wait in waits]}")
+    print_info(f"ip: {ip_before:.2f} -> {ip_after:.2f}, user: {user_before:.2f} -> {user_after:.2f}")
+    if not all(wait > 0 for wait in waits):
+        print_error("Запросы сверх бюджета поставщика не отклонены")
+        return False
+    if ip_before - ip_after > 0.1 or user_before - user_after > 0.1:
+        print_error("Отклоненные запросы списали общий бюджет")
+        return False
+    return True
+
+async def test_2_rejected_request_keeps_budget_memory():
+    """Тест 2: бакеты в памяти"""
+    print_test("ТЕСТ 2: Отказ по бюджету поставщика не списывает общий бюджет (memory)")
+
+    limiter = rate_limiter.RateLimiter(backend=rate_limiter.BACKEND_MEMORY)
+
+    async def read_tokens(budget, key):
+        bucket = limiter._bucket(budget, key)
+        bucket._refill(bucket.updated_at)
+        return bucket.tokens
+
+    if not await check_refund(limiter, None, read_tokens):
+        return False
+    print_success("ТЕСТ 2 ПРОЙДЕН")
+    return True
+
+async def test_3_rejected_request_keeps_budget_mongo(db):
+    """Тест 3: бакеты в MongoDB"""
+    print_test("ТЕСТ 3: Отказ по бюджету поставщика не списывает общий бюджет (mongo)")
+
+    limiter = rate_limiter.RateLimiter(backend=rate_limiter.BACKEND_MONGO)
+
+    async def read_tokens(budget, key):
+        doc = await db[rate_limiter.RATE_LIMITS_COLLECTION].find_one({"_id": f"{budget.name}:{key}"})
+        return doc["tokens"]
+
+    if not await check_refund(limiter, db, read_tokens):
+        return False
+    if limiter.buckets:
+        print_error("Проверка ушла в бакеты в памяти - ошибка MongoDB")
+        return False
+    print_success("ТЕСТ 3 ПРОЙДЕН")
+    return True
+
+async def run_tests():
+    client = AsyncIOMotorClient(MONGO_URL, tz_aware=True)
+    db = client[DB_NAME]
+    try:
+        await client.drop_database(DB_NAME)
+        return [
+            ("Тест 1: Пакетный поиск исчерпывает бюджет", await test_1_batch_exhausts_supplier_budget(make_app(client, db))),
+            ("Тест 2: Отказ не списывает бюджет (memory)", await test_2_rejected_request_keeps_budget_memory()),
+            ("Тест 3: Отказ не списывает бюджет (mongo)", await test_3_rejected_request_keeps_budget_mongo(db)),
+        ]
+    finally:
+        await client.drop_database(DB_NAME)
+        client.close()
+
+def main():
+    """Запуск всех тестов"""
+    print(f"\n{Colors.BLUE}ТЕСТ ОГРАНИЧЕНИЯ ЗАПРОСОВ К ПОСТАВЩИКУ{Colors.RESET}")
+    print(f"MongoDB: {MONGO_URL} / {DB_NAME}")
+
+    results = asyncio.run(run_tests())
+
+    print(f"\n{Colors.BLUE}ИТОГОВЫЙ ОТЧЕТ{Colors.RESET}")
+    for test_name, result in results:
+        status = f"{Colors.GREEN}✅ ПРОЙДЕН{Colors.RESET}" if result else f"{Colors.RED}❌ ПРОВАЛЕН{Colors.RESET}"
+        print(f"{test_name}: {status}")
+
+    return all(result for _, result in results)
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)